@@ -2,25 +2,87 @@
 
 Instantiates a :class:`FastAPI` instance and declares the REST API.
 """
+import base64
+import binascii
+import calendar
+import logging
 import os
-import random
-import string
+from dataclasses import dataclass
 from datetime import datetime
-from typing import Iterator, List
-
-from databases import Database
-from fastapi import Depends, FastAPI, Query, Request
-from fastapi.responses import JSONResponse
-from pydantic import root_validator
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session, sessionmaker
-
-from fx.database import Base, Trade, engine, get_db
-from fx.model import BaseModel, Currency
-from fx.rates import ClientException, RatesApi, get_rates
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, WebSocket
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import ValidationError, conlist, constr, root_validator
+from sqlalchemy import and_, or_
+from sqlalchemy.engine import ResultProxy
+from sqlalchemy.orm import Query as OrmQuery
+from sqlalchemy.orm import Session
+
+from fx.admission import AdmissionController, AdmissionMiddleware, RouteLimit
+from fx.caching import TRADES_VERSION, NotModified, cache_headers
+from fx.database import TRADE_COLUMNS, Position, RatesHistory, Trade, get_db, run_db
+from fx.export import ExportFormat, Row, encode_chunks, encode_trades_json, gzip_chunks
+from fx.feed import FEED_HUB, encode_event, stream
+from fx.history import HISTORY_INGESTER, unpack_rates
+from fx.ids import IdGenerator, get_id_generator
+from fx.metrics import REGISTRY, Counter, Gauge, MetricsMiddleware
+from fx.model import BaseModel, Currency, CurrencyArray
+from fx.partitions import archive_path, archived_months, create_schema
+from fx.positions import MAX_AMOUNT, PositionOverflow, apply_trades, net_value
+from fx.profiling import (
+    PROFILER,
+    ProfiledRoute,
+    ProfilingMiddleware,
+    RequestProfile,
+    phase,
+)
+from fx.rates import (
+    FIXER_API,
+    RATES_API,
+    RATES_STORE,
+    ClientException,
+    RatesApi,
+    RatesSnapshot,
+    get_rates,
+)
+from fx.shared import SHARED_STORE
+from fx.writes import TRADE_WRITER, insert_trades
+
+logger = logging.getLogger(__name__)
+
+# Number of rows fetched from the database at a time by /trades/export
+EXPORT_CHUNK_SIZE = 1000
+# Maximum number of trades booked by a single request to /trades/batch
+BATCH_MAX_SIZE = 10_000
+# Maximum number of currency pairs quoted by a single request to POST /rates
+QUOTES_MAX_SIZE = 10_000
+# Encode /trades responses straight from database rows instead of going through pydantic models
+FAST_JSON = "FX_FAST_JSON" in os.environ
+
+# Expensive routes, limited while cheap ones such as /symbols and /rate are always served
+ADMISSION = AdmissionController(
+    {
+        ("GET", "/trades"): RouteLimit(),
+        ("GET", "/trades/export"): RouteLimit(concurrency=4),
+        ("POST", "/trades/batch"): RouteLimit(concurrency=4),
+        ("GET", "/positions"): RouteLimit(),
+        ("POST", "/rates"): RouteLimit(),
+        ("GET", "/rates/history"): RouteLimit(),
+    }
+)
 
 app = FastAPI(docs_url=None, redoc_url=None)
-Base.metadata.create_all(bind=engine, checkfirst=True)
+# Times the endpoints of profiled requests
+app.router.route_class = ProfiledRoute
+# The last middleware added handles requests first, rejected requests are still measured but
+# aren't profiled
+app.add_middleware(ProfilingMiddleware, profiler=PROFILER)
+app.add_middleware(AdmissionMiddleware, controller=ADMISSION)
+app.add_middleware(MetricsMiddleware)
+# Workers sharing state start concurrently, only one of them may create the tables
+with SHARED_STORE.lock("schema"):
+    create_schema()
 
 
 @app.exception_handler(ClientException)
@@ -29,6 +91,70 @@ async def _client_exception_handler(_request: Request, exc: ClientException):
     return JSONResponse(status_code=400, content={"message": str(exc)})
 
 
+@app.exception_handler(PositionOverflow)
+async def _position_overflow_handler(_request: Request, exc: PositionOverflow):
+    return JSONResponse(status_code=422, content={"message": str(exc)})
+
+
+@app.exception_handler(NotModified)
+async def _not_modified_handler(_request: Request, exc: NotModified):
+    return Response(status_code=304, headers=exc.headers)
+
+
+if RATES_STORE is not None:
+    RATES_STORE.add_listener(HISTORY_INGESTER.record, all_workers=False)
+
+
+@app.on_event("startup")
+async def _start_metrics():
+    REGISTRY.start()
+
+
+@app.on_event("startup")
+async def _start_admission():
+    ADMISSION.start()
+
+
+@app.on_event("shutdown")
+async def _stop_admission():
+    await ADMISSION.stop()
+
+
+@app.on_event("startup")
+async def _start_trade_writer():
+    TRADE_WRITER.start()
+
+
+@app.on_event("shutdown")
+async def _stop_trade_writer():
+    await TRADE_WRITER.stop()
+
+
+@app.on_event("shutdown")
+async def _stop_metrics():
+    await REGISTRY.stop()
+
+
+@app.on_event("startup")
+async def _start_rates_refresh():
+    # The rates providers' clients live in the server's event loop. Keep the shared rates cache
+    # warm so requests don't wait on providers, and record every snapshot it fetches.
+    if RATES_API is not None and RATES_STORE is not None:
+        await RATES_API.open()
+        HISTORY_INGESTER.start()
+        RATES_STORE.start()
+
+
+@app.on_event("shutdown")
+async def _stop_rates_refresh():
+    if RATES_API is not None and RATES_STORE is not None:
+        await RATES_STORE.stop()
+        await HISTORY_INGESTER.stop()
+        await RATES_API.close()
+        if FIXER_API is not None:
+            logger.info("fixer.io connection pool: %s", FIXER_API.pool_stats)
+
+
 class TradeModel(BaseModel):
     """Response model for each trade sent in /trades.
     """
@@ -44,29 +170,202 @@ class TradeModel(BaseModel):
 
 class TradesResponse(BaseModel):
     """Response body for /trades.
+
+    `next_cursor` is passed as `cursor` to fetch the next page, it's null on the last page.
     """
 
     trades: List[TradeModel]
+    next_cursor: Optional[str]
+
+
+@dataclass
+class TradeFilter:
+    """Query parameters filtering trades by currencies and booking time.
+
+    `since` is inclusive and `until` is exclusive.
+    """
+
+    sell_ccy: Optional[str] = Query(None, regex="^[A-Z]{3}$")
+    buy_ccy: Optional[str] = Query(None, regex="^[A-Z]{3}$")
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+
+    def apply(self, query: OrmQuery) -> OrmQuery:
+        """Adds the filters to a query on :class:`Trade`.
+        """
+        if self.sell_ccy is not None:
+            query = query.filter(Trade.sell_ccy == self.sell_ccy)
+        if self.buy_ccy is not None:
+            query = query.filter(Trade.buy_ccy == self.buy_ccy)
+        if self.since is not None:
+            query = query.filter(Trade.timestamp >= self.since)
+        if self.until is not None:
+            query = query.filter(Trade.timestamp < self.until)
+        return query
 
 
 @app.get("/trades", response_model=TradesResponse)
-async def get_trades(db: Session = Depends(get_db)):
-    """Returns a list of all trades, sorted in descending order by timetamps.
+async def get_trades(  # pylint: disable=too-many-arguments
+    request: Request,
+    response: Response,
+    filters: TradeFilter = Depends(),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Returns a page of at most `limit` trades, sorted in descending order by timestamps.
+
+    Pages are keyed on `(timestamp, id)` of the last trade of the previous page, so fetching a page
+    costs the same however many trades were booked before it.
+
+    Responses must be revalidated, requests with the `ETag` of the last response are answered with
+    304 until new trades are booked.
     """
-    trade_rows = db.query(Trade).order_by(Trade.timestamp.desc())
-    return TradesResponse(
-        trades=[
+    # Read before the query, so trades booked meanwhile change the ETag of the next response
+    headers = cache_headers(request, TRADES_VERSION.etag, "no-cache")
+    after = None if cursor is None else _decode_cursor(cursor)
+    trade_rows = await run_db(_query_trades, db, filters, after, limit + 1)
+    next_cursor = None
+    if len(trade_rows) > limit:
+        trade_rows = trade_rows[:limit]
+        next_cursor = _encode_cursor(trade_rows[-1])
+    if FAST_JSON:
+        return Response(
+            encode_trades_json(trade_rows, next_cursor),
+            media_type="application/json",
+            headers=headers,
+        )
+    response.headers.update(headers)
+    with phase("model"):
+        return _trades_response(trade_rows, next_cursor)
+
+
+def _trades_response(rows: List[Row], next_cursor: Optional[str]) -> TradesResponse:
+    buy_amounts = CurrencyArray(r[2] for r in rows) * [r[4] for r in rows]
+    trades = []
+    for row, buy_amount in zip(rows, buy_amounts.tolist()):
+        trade_id, sell_ccy, sell_amount, buy_ccy, rate, timestamp = row
+        trades.append(
             TradeModel(
-                id=r.trade_id,
-                sell_ccy=r.sell_ccy,
-                sell_amount=Currency(r.sell_amount),
-                buy_ccy=r.buy_ccy,
-                buy_amount=Currency(r.sell_amount) * r.rate,
-                rate=r.rate,
-                timestamp=r.timestamp,
+                id=trade_id,
+                sell_ccy=sell_ccy,
+                sell_amount=sell_amount,
+                buy_ccy=buy_ccy,
+                buy_amount=buy_amount,
+                rate=rate,
+                timestamp=timestamp,
             )
-            for r in trade_rows
-        ]
+        )
+    return TradesResponse(trades=trades, next_cursor=next_cursor)
+
+
+def _query_trades(
+    db: Session,
+    filters: TradeFilter,
+    after: Optional[Tuple[datetime, str]],
+    limit: int,
+) -> List[Row]:
+    query = filters.apply(db.query(*TRADE_COLUMNS))
+    if after is not None:
+        timestamp, trade_id = after
+        query = query.filter(
+            or_(
+                Trade.timestamp < timestamp,
+                and_(Trade.timestamp == timestamp, Trade.trade_id < trade_id),
+            )
+        )
+    return (
+        query.order_by(Trade.timestamp.desc(), Trade.trade_id.desc()).limit(limit).all()
+    )
+
+
+def _encode_cursor(trade: Row) -> str:
+    key = f"{trade.timestamp.isoformat()} {trade.trade_id}"
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        timestamp, trade_id = base64.urlsafe_b64decode(cursor).decode().split(" ", 1)
+        return datetime.fromisoformat(timestamp), trade_id
+    except (binascii.Error, UnicodeDecodeError, ValueError) as exc:
+        raise ClientException(f"Invalid cursor {cursor!r}") from exc
+
+
+@app.get("/trades/export")
+async def export_trades(
+    filters: TradeFilter = Depends(),
+    fmt: ExportFormat = Query(ExportFormat.NDJSON, alias="format"),
+    gzip: bool = False,
+    db: Session = Depends(get_db),
+):
+    """Streams all trades matching `filters` as NDJSON or CSV, sorted in ascending order by
+    timestamps. The response is gzip-encoded if `gzip` is set.
+
+    Rows are read from a server-side cursor as the response is sent, so the whole blotter is never
+    held in memory.
+    """
+    body = encode_chunks(_export_rows(db, filters), fmt)
+    headers = {"Content-Disposition": f'attachment; filename="trades.{fmt.value}"'}
+    if gzip:
+        body = gzip_chunks(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=fmt.media_type, headers=headers)
+
+
+async def _export_rows(db: Session, filters: TradeFilter) -> AsyncIterator[List[Row]]:
+    result = await run_db(_open_export_cursor, db, filters)
+    try:
+        while True:
+            rows = await run_db(result.fetchmany, EXPORT_CHUNK_SIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        await run_db(result.close)
+
+
+def _open_export_cursor(db: Session, filters: TradeFilter) -> ResultProxy:
+    query = filters.apply(db.query(*TRADE_COLUMNS)).order_by(
+        Trade.timestamp, Trade.trade_id
+    )
+    return db.execute(query.statement.execution_options(stream_results=True))
+
+
+class ArchiveResponse(BaseModel):
+    """Response body for /trades/archive.
+    """
+
+    months: List[str]
+
+
+@app.get("/trades/archive", response_model=ArchiveResponse)
+def get_archived_months():
+    """Lists the months whose trades were moved to archives (see :mod:`fx.partitions`), formatted
+    as `YYYY-MM`.
+    """
+    return ArchiveResponse(months=archived_months())
+
+
+@app.get("/trades/archive/{month}")
+def get_archive(month: str):
+    """Streams the trades archived for `month`, formatted as `YYYY-MM`, as gzip-encoded NDJSON in
+    the format of /trades/export. The archive is sent as stored, without decompressing it.
+    """
+    if month not in archived_months():
+        raise HTTPException(status_code=404, detail=f"Month {month} isn't archived")
+
+    def chunks() -> Iterator[bytes]:
+        with open(archive_path(month), "rb") as archive:
+            yield from iter(lambda: archive.read(64 * 1024), b"")
+
+    return StreamingResponse(
+        chunks(),
+        media_type=ExportFormat.NDJSON.media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="trades-{month}.ndjson"',
+            "Content-Encoding": "gzip",
+        },
     )
 
 
@@ -85,6 +384,10 @@ class NewTradeRequest(BaseModel):
         if "sell_ccy" in values and "buy_ccy" in values:
             if values["sell_ccy"] == values["buy_ccy"]:
                 raise ValueError("buy_ccy and sell_ccy must not be the same symbol")
+        if "sell_amount" in values and "rate" in values:
+            amount = values["sell_amount"]
+            if max(amount.value, (amount * values["rate"]).value) > MAX_AMOUNT:
+                raise ValueError(f"sell and buy amounts must not exceed {MAX_AMOUNT}")
         return values
 
 
@@ -102,28 +405,31 @@ class NewTradeResponse(BaseModel):
 
 
 @app.post("/trades", response_model=NewTradeResponse)
-async def post_trade(trade: NewTradeRequest, db: Session = Depends(get_db)):
+async def post_trade(
+    trade: NewTradeRequest,
+    db: Session = Depends(get_db),
+    ids: IdGenerator = Depends(get_id_generator),
+):
     """Create a new trade.
     """
 
-    new_id = "TR" + "".join(
-        random.choice(string.ascii_uppercase + string.digits) for _ in range(7)
-    )
+    new_id = ids.new_id()
     timestamp = datetime.utcnow()
 
-    db.add(
-        Trade(
-            trade_id=new_id,
-            sell_ccy=trade.sell_ccy,
-            sell_amount=trade.sell_amount.value,
-            buy_ccy=trade.buy_ccy,
-            rate=trade.rate,
-            timestamp=timestamp,
-        )
+    await TRADE_WRITER.book(
+        db,
+        {
+            "trade_id": new_id,
+            "sell_ccy": trade.sell_ccy,
+            "sell_amount": trade.sell_amount.value,
+            "buy_ccy": trade.buy_ccy,
+            "rate": trade.rate,
+            "timestamp": timestamp,
+        },
     )
-    db.commit()
+    TRADES_VERSION.bump()
 
-    return NewTradeResponse(
+    response = NewTradeResponse(
         id=new_id,
         sell_ccy=trade.sell_ccy,
         sell_amount=trade.sell_amount,
@@ -132,6 +438,155 @@ async def post_trade(trade: NewTradeRequest, db: Session = Depends(get_db)):
         rate=trade.rate,
         timestamp=timestamp,
     )
+    FEED_HUB.publish("trades", [response], all_workers=True)
+    return response
+
+
+class NewTradesBatchRequest(BaseModel):
+    """Request body for POST /trades/batch.
+
+    Trades are validated one by one against :class:`NewTradeRequest`, so invalid trades don't
+    prevent the others from being booked.
+    """
+
+    trades: conlist(Dict[str, Any], max_items=BATCH_MAX_SIZE)  # type: ignore
+
+
+class BatchTradeResult(BaseModel):
+    """Result for each trade sent to POST /trades/batch, in the same order.
+
+    `trade` is set if the trade was booked, otherwise `errors` lists why it was rejected.
+    """
+
+    trade: Optional[NewTradeResponse]
+    errors: Optional[List[Dict[str, Any]]]
+
+
+class NewTradesBatchResponse(BaseModel):
+    """Response body for POST /trades/batch.
+    """
+
+    results: List[BatchTradeResult]
+
+
+@app.post("/trades/batch", response_model=NewTradesBatchResponse)
+async def post_trades_batch(
+    batch: NewTradesBatchRequest,
+    db: Session = Depends(get_db),
+    ids: IdGenerator = Depends(get_id_generator),
+):
+    """Create many trades at once.
+
+    All valid trades are inserted with a single statement in a single transaction.
+    """
+    timestamp = datetime.utcnow()
+    results = []
+    rows = []
+    for item in batch.trades:
+        try:
+            trade = NewTradeRequest.parse_obj(item)
+        except ValidationError as exc:
+            results.append(BatchTradeResult(errors=exc.errors()))
+            continue
+        new_id = ids.new_id()
+        rows.append(
+            {
+                "trade_id": new_id,
+                "sell_ccy": trade.sell_ccy,
+                "sell_amount": trade.sell_amount.value,
+                "buy_ccy": trade.buy_ccy,
+                "rate": trade.rate,
+                "timestamp": timestamp,
+            }
+        )
+        results.append(
+            BatchTradeResult(
+                trade=NewTradeResponse(
+                    id=new_id,
+                    sell_ccy=trade.sell_ccy,
+                    sell_amount=trade.sell_amount,
+                    buy_ccy=trade.buy_ccy,
+                    buy_amount=trade.sell_amount * trade.rate,
+                    rate=trade.rate,
+                    timestamp=timestamp,
+                )
+            )
+        )
+
+    if rows:
+        await run_db(insert_trades, db, rows)
+        TRADES_VERSION.bump()
+        booked = [r.trade for r in results if r.trade is not None]
+        FEED_HUB.publish("trades", booked, all_workers=True)
+    return NewTradesBatchResponse(results=results)
+
+
+class PositionModel(BaseModel):
+    """Position in each currency sent in /positions.
+
+    `net` is `bought` minus `sold`. When a valuation currency is requested, `value` is `net`
+    converted to it at the current rates, in cents, or None if there's no rate for `ccy`.
+    """
+
+    ccy: str
+    bought: Currency
+    sold: Currency
+    net: int
+    value: Optional[int]
+
+
+class PositionsResponse(BaseModel):
+    """Response body for /positions.
+
+    `valuation_ccy`, `timestamp` and `total_value` are only set when positions are valued, in which
+    case `timestamp` is when the rates used were published and `total_value` sums the positions
+    which could be valued.
+    """
+
+    positions: List[PositionModel]
+    valuation_ccy: Optional[str]
+    timestamp: Optional[int]
+    total_value: Optional[int]
+
+
+@app.get("/positions", response_model=PositionsResponse)
+async def get_positions(
+    valuation_ccy: Optional[str] = Query(None, regex="^[A-Z]{3}$"),
+    db: Session = Depends(get_db),
+    rates: RatesApi = Depends(get_rates),
+):
+    """Returns the net position in each traded currency, sorted by currency.
+
+    If `valuation_ccy` is set, positions are also marked to market in that currency.
+    """
+    rows = await run_db(_query_positions, db)
+    positions = [
+        PositionModel(
+            ccy=r.ccy,
+            bought=Currency(r.bought),
+            sold=Currency(r.sold),
+            net=r.bought - r.sold,
+        )
+        for r in rows
+    ]
+    if valuation_ccy is None:
+        return PositionsResponse(positions=positions)
+
+    snapshot = await rates.get_snapshot()
+    # Raises a ClientException if the valuation currency is unknown
+    snapshot.get_rate(valuation_ccy, valuation_ccy)
+    for position in positions:
+        position.value = net_value(position.ccy, position.net, snapshot, valuation_ccy)
+    return PositionsResponse(
+        positions=positions,
+        valuation_ccy=valuation_ccy,
+        timestamp=snapshot.timestamp,
+        total_value=sum(p.value for p in positions if p.value is not None),
+    )
+
+
+def _query_positions(db: Session) -> List[Position]:
+    return db.query(Position).order_by(Position.ccy).all()
 
 
 class SymbolsResponse(BaseModel):
@@ -141,8 +596,35 @@ class SymbolsResponse(BaseModel):
     symbols: List[str]
 
 
+async def get_cached_snapshot(
+    request: Request, response: Response, rates: RatesApi = Depends(get_rates)
+) -> RatesSnapshot:
+    """Dependency returning the current rates snapshot, which answers with 304 if the client
+    already has a response computed from it.
+
+    Responses can be cached for as long as the rates are fresh. They carry the age of the rates,
+    and a warning if the rates expired but couldn't be refreshed.
+    """
+    snapshot = await rates.get_snapshot()
+    extra = {"Age": str(rates.age())}
+    if rates.is_stale():
+        extra["Warning"] = '110 - "Response is Stale"'
+    response.headers.update(
+        cache_headers(
+            request,
+            f'"{snapshot.timestamp}"',
+            f"public, max-age={rates.max_age()}",
+            extra,
+        )
+    )
+    return snapshot
+
+
 @app.get("/symbols", response_model=SymbolsResponse)
-async def get_symbols(rates: RatesApi = Depends(get_rates)):
+async def get_symbols(
+    rates: RatesApi = Depends(get_rates),
+    _snapshot: RatesSnapshot = Depends(get_cached_snapshot),
+):
     """Returns all available symbols.
     """
     return SymbolsResponse(symbols=await rates.get_symbols())
@@ -159,8 +641,360 @@ class RateResponse(BaseModel):
 async def get_rate(
     from_symbol: str = Query(..., regex="^[A-Z]{3}$"),
     to_symbol: str = Query(..., regex="^[A-Z]{3}$"),
-    rates: RatesApi = Depends(get_rates),
+    snapshot: RatesSnapshot = Depends(get_cached_snapshot),
 ):
     """Returns the exchange rate for from `from_symbol` to `to_symbol`.
     """
-    return RateResponse(rate=await rates.get_rate(from_symbol, to_symbol))
+    return RateResponse(rate=snapshot.get_rate(from_symbol, to_symbol))
+
+
+class RatesResponse(BaseModel):
+    """Response body for GET /rates.
+
+    `rates` maps each symbol to the exchange rate from `base` to it, all taken from the rates
+    published at `timestamp`.
+    """
+
+    base: str
+    timestamp: int
+    rates: Dict[str, float]
+
+
+@app.get("/rates", response_model=RatesResponse)
+async def get_rates_for_base(
+    base: str = Query(..., regex="^[A-Z]{3}$"),
+    symbols: Optional[str] = Query(None, regex="^[A-Z]{3}(,[A-Z]{3})*$"),
+    snapshot: RatesSnapshot = Depends(get_cached_snapshot),
+):
+    """Returns the exchange rates from `base` to each of the comma-separated `symbols`, or to all
+    available symbols if `symbols` isn't set.
+    """
+    selected = snapshot.matrix.symbols if symbols is None else symbols.split(",")
+    return RatesResponse(
+        base=base,
+        timestamp=snapshot.timestamp,
+        rates={s: snapshot.get_rate(base, s) for s in selected},
+    )
+
+
+class CurrencyPair(BaseModel):
+    """Currency pair to be quoted by POST /rates.
+    """
+
+    from_symbol: constr(regex="^[A-Z]{3}$")  # type: ignore
+    to_symbol: constr(regex="^[A-Z]{3}$")  # type: ignore
+
+
+class QuotesRequest(BaseModel):
+    """Request body for POST /rates.
+    """
+
+    pairs: conlist(CurrencyPair, max_items=QUOTES_MAX_SIZE)  # type: ignore
+
+
+class Quote(BaseModel):
+    """Exchange rate for each pair sent in POST /rates.
+    """
+
+    from_symbol: str
+    to_symbol: str
+    rate: float
+
+
+class QuotesResponse(BaseModel):
+    """Response body for POST /rates.
+
+    `quotes` are in the same order as the requested pairs, all taken from the rates published at
+    `timestamp`.
+    """
+
+    timestamp: int
+    quotes: List[Quote]
+
+
+@app.post("/rates", response_model=QuotesResponse)
+async def post_rates(request: QuotesRequest, rates: RatesApi = Depends(get_rates)):
+    """Returns the exchange rates for many currency pairs at once.
+    """
+    snapshot = await rates.get_snapshot()
+    return QuotesResponse(
+        timestamp=snapshot.timestamp,
+        quotes=[
+            Quote(
+                from_symbol=pair.from_symbol,
+                to_symbol=pair.to_symbol,
+                rate=snapshot.get_rate(pair.from_symbol, pair.to_symbol),
+            )
+            for pair in request.pairs
+        ],
+    )
+
+
+class HistoricalRates(BaseModel):
+    """Rates from `base` published at the UNIX timestamp `timestamp`, sent in /rates/history.
+    """
+
+    base: str
+    timestamp: int
+    rates: Dict[str, float]
+
+
+class RatesHistoryResponse(BaseModel):
+    """Response body for /rates/history.
+    """
+
+    history: List[HistoricalRates]
+
+
+@app.get("/rates/history", response_model=RatesHistoryResponse)
+async def get_rates_history(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    symbols: Optional[str] = Query(None, regex="^[A-Z]{3}(,[A-Z]{3})*$"),
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    """Returns at most `limit` recorded rates snapshots published between `since` (inclusive) and
+    `until` (exclusive), sorted in descending order by timestamps. Only the comma-separated
+    `symbols` are included if set.
+
+    The rates in effect at a given time are the first result with `until` set to that time.
+    """
+    rows = await run_db(_query_rates_history, db, since, until, limit)
+    history = []
+    for row in rows:
+        rates = unpack_rates(row)
+        if symbols is not None:
+            rates = {s: rates[s] for s in symbols.split(",") if s in rates}
+        history.append(
+            HistoricalRates(base=row.base, timestamp=row.timestamp, rates=rates)
+        )
+    return RatesHistoryResponse(history=history)
+
+
+def _query_rates_history(
+    db: Session, since: Optional[datetime], until: Optional[datetime], limit: int,
+) -> List[RatesHistory]:
+    query = db.query(RatesHistory)
+    if since is not None:
+        query = query.filter(
+            RatesHistory.timestamp >= calendar.timegm(since.utctimetuple())
+        )
+    if until is not None:
+        query = query.filter(
+            RatesHistory.timestamp < calendar.timegm(until.utctimetuple())
+        )
+    return query.order_by(RatesHistory.timestamp.desc()).limit(limit).all()
+
+
+class RateMatrixResponse(BaseModel):
+    """Response body for /rates/matrix.
+
+    `rates[i][j]` is the exchange rate from `symbols[i]` to `symbols[j]`.
+    """
+
+    timestamp: int
+    symbols: List[str]
+    rates: List[List[float]]
+
+
+@app.get("/rates/matrix", response_model=RateMatrixResponse)
+async def get_rate_matrix(
+    symbols: Optional[str] = Query(None, regex="^[A-Z]{3}(,[A-Z]{3})*$"),
+    snapshot: RatesSnapshot = Depends(get_cached_snapshot),
+):
+    """Returns the exchange rates between all pairs of the comma-separated `symbols`, or between
+    all available symbols if `symbols` isn't set.
+    """
+    selected = None if symbols is None else symbols.split(",")
+    return RateMatrixResponse(
+        timestamp=snapshot.timestamp,
+        symbols=snapshot.matrix.symbols if selected is None else selected,
+        rates=snapshot.matrix.rows(selected),
+    )
+
+
+def _rates_event(snapshot: RatesSnapshot) -> RatesResponse:
+    return RatesResponse(
+        base=snapshot.base, timestamp=snapshot.timestamp, rates=snapshot.rates
+    )
+
+
+def _publish_rates(snapshot: RatesSnapshot) -> None:
+    FEED_HUB.publish("rates", _rates_event(snapshot))
+
+
+if RATES_STORE is not None:
+    RATES_STORE.add_listener(_publish_rates)
+
+
+def _rates_cache_lookups() -> Dict[Tuple[str, ...], float]:
+    if RATES_STORE is None:
+        return {}
+    stats = RATES_STORE.stats
+    return {("hit",): stats.hits, ("miss",): stats.misses, ("stale",): stats.stale}
+
+
+def _fixer_pool() -> Dict[Tuple[str, ...], float]:
+    if FIXER_API is None:
+        return {}
+    stats = FIXER_API.pool_stats
+    return {
+        ("in_flight",): stats.in_flight,
+        ("queued",): stats.queued,
+        ("limit",): stats.limit,
+    }
+
+
+def _admission_requests() -> Dict[Tuple[str, ...], float]:
+    values: Dict[Tuple[str, ...], float] = {}
+    for (method, route), limiter in ADMISSION.limiters.items():
+        values[(method, route, "active")] = limiter.active
+        values[(method, route, "queued")] = limiter.queued
+    return values
+
+
+# Values maintained by the rates store, the fixer.io client, admission control and the feed, read
+# on collection
+Counter(
+    "fx_rates_cache_lookups_total",
+    "Lookups of the shared rates cache, by result: hit, miss or stale.",
+    ("result",),
+    function=_rates_cache_lookups,
+)
+Counter(
+    "fx_rates_refreshes_total",
+    "Rates fetched from fixer.io by the shared rates cache.",
+    function=lambda: {(): RATES_STORE.stats.refreshes} if RATES_STORE else {},
+)
+Gauge(
+    "fx_fixer_pool_connections",
+    "Requests to fixer.io holding a connection, waiting for one, and the pool size.",
+    ("state",),
+    function=_fixer_pool,
+)
+Counter(
+    "fx_fixer_pool_waits_total",
+    "Requests to fixer.io which waited for a free connection.",
+    function=lambda: {(): FIXER_API.pool_stats.waits} if FIXER_API else {},
+)
+Counter(
+    "fx_trade_groups_total",
+    "Groups of trades committed together by POST /trades.",
+    function=lambda: {(): TRADE_WRITER.groups},
+)
+Counter(
+    "fx_trade_group_trades_total",
+    "Trades committed in groups by POST /trades.",
+    function=lambda: {(): TRADE_WRITER.trades},
+)
+Gauge(
+    "fx_event_loop_lag_seconds",
+    "How late the event loop runs callbacks.",
+    function=lambda: {(): ADMISSION.monitor.lag},
+)
+Gauge(
+    "fx_admission_requests",
+    "Requests to routes limited by admission control, by state: active or queued.",
+    ("method", "route", "state"),
+    function=_admission_requests,
+)
+Gauge(
+    "fx_feed_subscribers",
+    "Clients subscribed to /feed.",
+    function=lambda: {(): FEED_HUB.subscribers},
+)
+
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    """Returns metrics in the Prometheus text format.
+    """
+    return Response(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def _require_admin(x_fx_profile: Optional[str] = Header(None)) -> None:
+    # The admin endpoints don't exist unless an admin token is set
+    if PROFILER.token is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not PROFILER.is_admin(x_fx_profile):
+        raise HTTPException(status_code=403, detail="Invalid X-Fx-Profile admin token")
+
+
+ADMIN_ONLY = [Depends(_require_admin)]
+
+
+def _get_profile(profile_id: int) -> RequestProfile:
+    profile = PROFILER.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    return profile
+
+
+@app.get("/admin/profiles", include_in_schema=False, dependencies=ADMIN_ONLY)
+def get_profiles():
+    """Lists the kept request profiles, most recent first, without their cProfile statistics.
+    """
+    return {"profiles": [profile.summary() for profile in PROFILER.profiles()]}
+
+
+@app.get(
+    "/admin/profiles/{profile_id}", include_in_schema=False, dependencies=ADMIN_ONLY
+)
+def get_profile(profile_id: int):
+    """Returns a request profile without its cProfile statistics.
+    """
+    return _get_profile(profile_id).summary()
+
+
+@app.get(
+    "/admin/profiles/{profile_id}/pstats",
+    include_in_schema=False,
+    dependencies=ADMIN_ONLY,
+)
+def get_profile_pstats(profile_id: int):
+    """Returns the cProfile statistics of a request profile, to be loaded with :mod:`pstats` or
+    snakeviz.
+    """
+    try:
+        content = _get_profile(profile_id).dump_stats()
+    except ValueError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    return Response(
+        content,
+        media_type="application/octet-stream",
+        headers={
+            "Content-Disposition": f'attachment; filename="profile-{profile_id}.pstats"'
+        },
+    )
+
+
+@app.get(
+    "/admin/profiles/{profile_id}/collapsed",
+    include_in_schema=False,
+    dependencies=ADMIN_ONLY,
+)
+def get_profile_collapsed(profile_id: int):
+    """Returns the cProfile statistics of a request profile as collapsed stacks, to be rendered
+    with flamegraph.pl or speedscope.
+    """
+    try:
+        content = _get_profile(profile_id).collapsed()
+    except ValueError as exc:
+        raise HTTPException(status_code=404, detail=str(exc)) from exc
+    return Response(content, media_type="text/plain")
+
+
+@app.websocket("/feed")
+async def feed(websocket: WebSocket, rates: RatesApi = Depends(get_rates)):
+    """Pushes events to the client as they happen:
+
+    - `rates` with the same body as GET /rates for the snapshot's base, whenever new rates are
+      fetched. The current rates are sent on connection.
+    - `trades` with a list of trades in the same format as /trades, whenever trades are booked.
+    """
+    await websocket.accept()
+    with FEED_HUB.subscribe() as subscription:
+        snapshot = await rates.get_snapshot()
+        await websocket.send_text(encode_event("rates", _rates_event(snapshot)))
+        await stream(websocket, subscription)
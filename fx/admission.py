@@ -0,0 +1,249 @@
+"""Admission control of expensive requests.
+
+Requests to expensive routes, such as full /trades listings, are limited per route: at most
+`concurrency` of them are handled at once, up to `queue_size` more wait for a slot for at most
+`queue_timeout` seconds, and the others are rejected right away with a 503 and a `Retry-After`
+header. Expensive requests are also rejected while the event loop lags behind by more than
+FX_MAX_LOOP_LAG seconds (0.5 by default), which happens when it's saturated by blocking calls or
+too many requests. Cheap routes such as /symbols or /rate are never limited, so they keep being
+served quickly while expensive requests are shed.
+
+Limits default to FX_ADMISSION_CONCURRENCY (16), FX_ADMISSION_QUEUE_SIZE (64) and
+FX_ADMISSION_QUEUE_TIMEOUT (2 seconds). Setting FX_ADMISSION to 0 disables admission control.
+"""
+import asyncio
+import os
+from collections import deque
+from contextlib import suppress
+from dataclasses import dataclass
+from typing import Deque, Dict, List, Optional, Tuple
+
+from starlette.responses import JSONResponse
+from starlette.routing import Match, Route
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from fx.metrics import HTTP_SHED_REQUESTS
+from fx.tasks import BackgroundTask
+
+ADMISSION = os.environ.get("FX_ADMISSION", "1") != "0"
+ADMISSION_CONCURRENCY = int(os.environ.get("FX_ADMISSION_CONCURRENCY", "16"))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("FX_ADMISSION_QUEUE_SIZE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("FX_ADMISSION_QUEUE_TIMEOUT", "2"))
+MAX_LOOP_LAG = float(os.environ.get("FX_MAX_LOOP_LAG", "0.5"))
+# Seconds clients are told to wait before retrying rejected requests
+RETRY_AFTER = 1
+
+
+class Overloaded(Exception):
+    """Raised when a request is rejected to shed load. `reason` is one of `queue_full`,
+    `queue_timeout` or `loop_lag`.
+    """
+
+    def __init__(self, reason: str) -> None:
+        super().__init__(reason)
+        self.reason = reason
+
+
+@dataclass
+class RouteLimit:
+    """Limits of requests to a route, see the module documentation.
+    """
+
+    concurrency: int = ADMISSION_CONCURRENCY
+    queue_size: int = ADMISSION_QUEUE_SIZE
+    queue_timeout: float = ADMISSION_QUEUE_TIMEOUT
+
+
+class Limiter:
+    """Lets at most `limit.concurrency` callers of :meth:`acquire` through at once, queueing the
+    next `limit.queue_size` callers for at most `limit.queue_timeout` seconds each, first come
+    first served.
+    """
+
+    def __init__(self, limit: RouteLimit) -> None:
+        self.limit = limit
+        self.active = 0
+        self._waiters: Deque["asyncio.Future[None]"] = deque()
+
+    @property
+    def queued(self) -> int:
+        """Number of callers waiting for a slot.
+        """
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        """Waits for a slot, which must be given back with :meth:`release`.
+
+        Raises
+        ------
+        Overloaded
+            When the queue is full or no slot was freed in time.
+        """
+        if self.active < self.limit.concurrency and not self._waiters:
+            self.active += 1
+            return
+        if len(self._waiters) >= self.limit.queue_size:
+            raise Overloaded("queue_full")
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.limit.queue_timeout)
+        except BaseException as exc:
+            if waiter.done() and not waiter.cancelled():
+                # A slot was handed over just as the caller gave up, pass it on
+                self.release()
+            else:
+                with suppress(ValueError):
+                    self._waiters.remove(waiter)
+            if isinstance(exc, asyncio.TimeoutError):
+                raise Overloaded("queue_timeout") from None
+            raise
+
+    def release(self) -> None:
+        """Gives back a slot, handing it over to the first waiting caller if any.
+        """
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs callbacks by sleeping `interval` seconds in a loop.
+
+    :attr:`lag` is the delay of the last wake up, or how late the current one already is.
+    """
+
+    def __init__(self, interval: float = 0.05) -> None:
+        self._interval = interval
+        self._lag = 0.0
+        self._deadline: Optional[float] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._task = BackgroundTask()
+
+    @property
+    def lag(self) -> float:
+        """Current event loop lag, in seconds. Can be read from any thread.
+        """
+        deadline, loop = self._deadline, self._loop
+        if deadline is None or loop is None:
+            return self._lag
+        return max(self._lag, loop.time() - deadline)
+
+    def start(self) -> None:
+        """Starts monitoring. Must be called from the event loop to monitor.
+        """
+        if not self._task.running:
+            self._loop = asyncio.get_event_loop()
+            self._task.start(self._run)
+
+    async def stop(self) -> None:
+        """Stops the task started by :meth:`start`.
+        """
+        if await self._task.stop():
+            self._deadline = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            self._deadline = loop.time() + self._interval
+            await asyncio.sleep(self._interval)
+            self._lag = max(0.0, loop.time() - self._deadline)
+
+
+class AdmissionController:
+    """Limits of the expensive routes, keyed by `(method, path template)`, and the event loop
+    lag above which they're rejected.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[Tuple[str, str], RouteLimit],
+        max_lag: float = MAX_LOOP_LAG,
+        enabled: bool = ADMISSION,
+    ) -> None:
+        self.limiters = {key: Limiter(limit) for key, limit in limits.items()}
+        self.max_lag = max_lag
+        self.enabled = enabled
+        self.monitor = LoopLagMonitor()
+
+    def start(self) -> None:
+        """Starts monitoring the event loop lag. Must be called from the event loop serving
+        requests.
+        """
+        if self.enabled:
+            self.monitor.start()
+
+    async def stop(self) -> None:
+        """Stops monitoring the event loop lag.
+        """
+        await self.monitor.stop()
+
+    async def admit(self, limiter: Limiter) -> None:
+        """Waits for `limiter` to let a request through.
+
+        Raises
+        ------
+        Overloaded
+            When the request must be rejected.
+        """
+        if self.monitor.lag > self.max_lag:
+            raise Overloaded("loop_lag")
+        await limiter.acquire()
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the limits of `controller` to requests.
+
+    Rejected requests get a 503 response with a `Retry-After` header, without reaching the route.
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController) -> None:
+        self.app = app
+        self.controller = controller
+        self._routes: Optional[List[Tuple[str, Route, Limiter]]] = None
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not self.controller.enabled:
+            await self.app(scope, receive, send)
+            return
+        matched = self._match(scope)
+        if matched is None:
+            await self.app(scope, receive, send)
+            return
+
+        route, limiter = matched
+        try:
+            await self.controller.admit(limiter)
+        except Overloaded as exc:
+            # Let the metrics middleware label the response with the route
+            scope["endpoint"] = route.endpoint
+            HTTP_SHED_REQUESTS.inc((scope["method"], route.path, exc.reason))
+            response = JSONResponse(
+                status_code=503,
+                content={"message": "Server overloaded, retry later"},
+                headers={"Retry-After": str(RETRY_AFTER)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+    def _match(self, scope: Scope) -> Optional[Tuple[Route, Limiter]]:
+        if self._routes is None:
+            # Resolved once, scope["app"] is the application being served
+            self._routes = [
+                (method, route, self.controller.limiters[(method, route.path)])
+                for route in scope["app"].routes
+                if isinstance(route, Route)
+                for method in route.methods or ()
+                if (method, route.path) in self.controller.limiters
+            ]
+        for method, route, limiter in self._routes:
+            if method == scope["method"] and route.matches(scope)[0] == Match.FULL:
+                return route, limiter
+        return None
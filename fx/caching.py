@@ -0,0 +1,100 @@
+"""Conditional GET support for read endpoints.
+
+Responses carry an `ETag` computed before doing any work, so requests whose `If-None-Match`
+matches it are answered with 304 Not Modified without reading the database or fetching rates.
+Rates ETags are derived from the timestamp of the rates snapshot and trades ETags from
+:data:`TRADES_VERSION`, which is bumped every time trades are booked and shared between workers
+through :data:`fx.shared.SHARED_STORE`.
+"""
+import time
+from typing import Dict, Optional
+
+from fastapi import Request
+
+from fx.shared import SHARED_STORE, LocalStore, SharedStore
+
+
+class NotModified(Exception):
+    """Raised to answer a request with 304 Not Modified and `headers`.
+    """
+
+    def __init__(self, headers: Dict[str, str]) -> None:
+        super().__init__()
+        self.headers = headers
+
+
+class VersionCounter:
+    """Version of data, kept in `store` under `key` so all workers sharing `store` agree on it.
+
+    ETags include the time the version was first stored, so a restarted server never answers 304
+    to an ETag sent by its previous run unless the version outlived it in a shared store.
+    """
+
+    def __init__(self, store: Optional[SharedStore] = None, key: str = "version") -> None:
+        self._store = LocalStore() if store is None else store
+        self._key = key
+        self._store.update(key, lambda value: value or f"{time.time_ns():x}-0".encode())
+
+    @property
+    def version(self) -> int:
+        """Current version.
+        """
+        return int(self._current().rsplit("-", 1)[1])
+
+    def bump(self) -> None:
+        """Marks the data as changed.
+        """
+
+        def increment(value: Optional[bytes]) -> bytes:
+            epoch, version = (value or b"0-0").decode().rsplit("-", 1)
+            return f"{epoch}-{int(version) + 1}".encode()
+
+        self._store.update(self._key, increment)
+
+    @property
+    def etag(self) -> str:
+        """ETag of the current version.
+        """
+        return f'"{self._current()}"'
+
+    def _current(self) -> str:
+        value = self._store.get(self._key)
+        return "0-0" if value is None else value.decode()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Returns whether the value of an `If-None-Match` header matches `etag`, using the weak
+    comparison required for `If-None-Match`.
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if (tag[2:] if tag.startswith("W/") else tag) == opaque:
+            return True
+    return False
+
+
+def cache_headers(
+    request: Request,
+    etag: str,
+    cache_control: str,
+    extra: Optional[Dict[str, str]] = None,
+) -> Dict[str, str]:
+    """Returns the caching headers for a response to `request`, including `extra` headers.
+
+    Raises
+    ------
+    NotModified
+        When the client already has the response identified by `etag`.
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control, **(extra or {})}
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        raise NotModified(headers)
+    return headers
+
+
+TRADES_VERSION = VersionCounter(SHARED_STORE, "trades_version")
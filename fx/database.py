@@ -2,24 +2,70 @@
 
 The database uses the :mod:`databases` database URI from the environment variable FX_DATABASE. It
 defaults to `sqlite:///./fx.db`.
+
+SQLAlchemy sessions are blocking, so queries must be run through :func:`run_db`, which runs them
+in a thread pool of FX_DB_POOL_SIZE threads (5 by default) instead of the event loop.
+
+The execution time of every SQL statement is recorded in :data:`fx.metrics.DB_QUERY_SECONDS`.
 """
+import asyncio
+import functools
 import os
-from typing import Iterator
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, TypeVar
 
-from databases import Database
-from sqlalchemy import Column, DateTime, Float, Integer, String, create_engine
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DateTime,
+    Float,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    create_engine,
+    event,
+)
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+
+from fx.metrics import DB_QUERY_SECONDS
+from fx.profiling import phase
 
 Base = declarative_base()
 
+T = TypeVar("T")
 
 DB_URL = os.environ.get("FX_DATABSE", "sqlite:///./fx.db")
-engine = create_engine(DB_URL, connect_args={"check_same_thread": False})
+DB_POOL_SIZE = int(os.environ.get("FX_DB_POOL_SIZE", "5"))
+
+if DB_URL.startswith("sqlite"):
+    engine = create_engine(DB_URL, connect_args={"check_same_thread": False})
+else:
+    # Every thread in the pool holds at most one connection
+    engine = create_engine(DB_URL, pool_size=DB_POOL_SIZE, max_overflow=0)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="fx-db")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(  # pylint: disable=too-many-arguments
+    _conn, _cursor, _statement, _parameters, context, _executemany
+):
+    context.fx_query_start = time.perf_counter()
+
 
-def get_db() -> Iterator[Database]:
+@event.listens_for(Engine, "after_cursor_execute")
+def _observe_query_time(  # pylint: disable=too-many-arguments
+    _conn, _cursor, _statement, _parameters, context, _executemany
+):
+    DB_QUERY_SECONDS.observe(time.perf_counter() - context.fx_query_start)
+
+
+def get_db() -> Iterator[Session]:
     """Function for dependency injection with :class:`fastapi.Dependency`.
     """
     try:
@@ -29,6 +75,15 @@ def get_db() -> Iterator[Database]:
         db.close()
 
 
+async def run_db(func: Callable[..., T], *args: Any) -> T:
+    """Runs `func(*args)` in the database thread pool and waits for its result without blocking
+    the event loop.
+    """
+    loop = asyncio.get_event_loop()
+    with phase("db"):
+        return await loop.run_in_executor(_executor, functools.partial(func, *args))
+
+
 class Trade(Base):
     """Trades table.
     """
@@ -40,4 +95,58 @@ class Trade(Base):
     sell_amount = Column(Integer, nullable=False)
     buy_ccy = Column(String, nullable=False)
     rate = Column(Float, nullable=False)
-    timestamp = Column(DateTime, nullable=False, index=True)
+    # Postgres partitions trades by month (see fx.partitions), which requires the partition key
+    # to be part of the primary key
+    timestamp = Column(
+        DateTime, nullable=False, index=True, primary_key=DB_URL.startswith("postgres")
+    )
+
+    # Listings are sorted by (timestamp, trade_id), these back the currency filters
+    __table_args__ = (
+        Index("ix_trades_sell_ccy_timestamp", "sell_ccy", "timestamp", "trade_id"),
+        Index("ix_trades_buy_ccy_timestamp", "buy_ccy", "timestamp", "trade_id"),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+    # Trades are identified by trade_id alone, whatever the primary key of the table
+    __mapper_args__ = {"primary_key": [trade_id]}
+
+
+# Trade columns read by listings, exports and archives, in the order of :data:`fx.export.Row`
+TRADE_COLUMNS = (
+    Trade.trade_id,
+    Trade.sell_ccy,
+    Trade.sell_amount,
+    Trade.buy_ccy,
+    Trade.rate,
+    Trade.timestamp,
+)
+
+
+class RatesHistory(Base):
+    """Exchange rates snapshots, one row per snapshot.
+
+    `timestamp` is the UNIX timestamp the rates were published at. `symbols` holds the
+    comma-separated symbols and `rates` their rates against `base` in the same order, packed as
+    little-endian doubles (see :mod:`fx.history`).
+    """
+
+    __tablename__ = "rates_history"
+
+    timestamp = Column(Integer, primary_key=True)
+    base = Column(String, nullable=False)
+    symbols = Column(String, nullable=False)
+    rates = Column(LargeBinary, nullable=False)
+
+
+class Position(Base):
+    """Totals bought and sold of each currency over all trades, in cents.
+
+    Rows are updated in the same transaction as the trades they account for (see
+    :mod:`fx.positions`).
+    """
+
+    __tablename__ = "positions"
+
+    ccy = Column(String, primary_key=True)
+    bought = Column(BigInteger, nullable=False)
+    sold = Column(BigInteger, nullable=False)
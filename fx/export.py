@@ -0,0 +1,119 @@
+"""Encoders streaming the trade blotter out of /trades/export.
+
+Trades are read in chunks of database rows and each chunk is encoded on its own, so memory use
+doesn't depend on how many trades are exported.
+
+:func:`encode_trades_json` also encodes pages of /trades when FX_FAST_JSON is set.
+"""
+import csv
+import io
+import json
+import zlib
+from enum import Enum
+from typing import AsyncIterator, Iterator, Optional, Sequence, Tuple
+
+from fx.model import CurrencyArray
+
+# Trade columns read for each exported row: trade_id, sell_ccy, sell_amount, buy_ccy, rate and
+# timestamp
+Row = Tuple[str, str, int, str, float, object]
+
+FIELDS = (
+    "id",
+    "sell_ccy",
+    "sell_amount",
+    "buy_ccy",
+    "buy_amount",
+    "rate",
+    "timestamp",
+)
+
+
+class ExportFormat(str, Enum):
+    """Formats supported by /trades/export.
+    """
+
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+    @property
+    def media_type(self) -> str:
+        """MIME type of the exported document.
+        """
+        return {"ndjson": "application/x-ndjson", "csv": "text/csv"}[self.value]
+
+
+def _values(rows: Sequence[Row]) -> Iterator[tuple]:
+    # Buy amounts of the whole chunk are computed at once
+    buy_amounts = CurrencyArray(row[2] for row in rows) * [row[4] for row in rows]
+    for row, buy_amount in zip(rows, buy_amounts.tolist()):
+        trade_id, sell_ccy, sell_amount, buy_ccy, rate, timestamp = row
+        yield (
+            trade_id,
+            sell_ccy,
+            sell_amount,
+            buy_ccy,
+            buy_amount,
+            rate,
+            timestamp.isoformat(),  # type: ignore
+        )
+
+
+def encode_ndjson(rows: Sequence[Row]) -> bytes:
+    """Encodes `rows` as one JSON object per line.
+    """
+    return "".join(
+        json.dumps(dict(zip(FIELDS, values)), separators=(",", ":")) + "\n"
+        for values in _values(rows)
+    ).encode()
+
+
+def encode_csv(rows: Sequence[Row], header: bool = False) -> bytes:
+    """Encodes `rows` as CSV lines, preceded by the column names if `header` is set.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    if header:
+        writer.writerow(FIELDS)
+    writer.writerows(_values(rows))
+    return buf.getvalue().encode()
+
+
+def encode_trades_json(rows: Sequence[Row], next_cursor: Optional[str]) -> bytes:
+    """Encodes a page of /trades from database rows.
+
+    The output is byte for byte what FastAPI renders for :class:`fx.TradesResponse`, without
+    building and validating a model per trade.
+    """
+    trades = [dict(zip(FIELDS, values)) for values in _values(rows)]
+    return json.dumps(
+        {"trades": trades, "next_cursor": next_cursor},
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode()
+
+
+async def encode_chunks(
+    chunks: AsyncIterator[Sequence[Row]], fmt: ExportFormat
+) -> AsyncIterator[bytes]:
+    """Encodes each chunk of rows in `fmt`.
+    """
+    if fmt is ExportFormat.CSV:
+        yield encode_csv((), header=True)
+    async for rows in chunks:
+        if fmt is ExportFormat.CSV:
+            yield encode_csv(rows)
+        else:
+            yield encode_ndjson(rows)
+
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Compresses a stream of bytes in the gzip format.
+    """
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
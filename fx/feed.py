@@ -0,0 +1,228 @@
+"""Live feed of rates and trades pushed to WebSocket subscribers.
+
+Events are published once to :data:`FEED_HUB`, which encodes them to JSON a single time and fans
+them out to every subscriber, so clients don't have to poll for new rates or trades. Each event is
+sent as a text message `{"type": ..., "data": ...}`.
+
+When workers share state through FX_SHARED_DIR (see :mod:`fx.shared`), events published for all
+workers, such as booked trades, are relayed to the subscribers of the other workers through a log
+of the last events kept in the shared store. Workers poll the log every RELAY_POLL_INTERVAL
+seconds while they have subscribers.
+"""
+import asyncio
+import functools
+import json
+import logging
+import os
+from contextlib import contextmanager, suppress
+from typing import Any, Iterator, List, Optional, Set
+
+from fastapi.encoders import jsonable_encoder
+from starlette.websockets import WebSocket
+
+from fx.shared import SHARED_DIR, SHARED_STORE, SharedStore
+from fx.tasks import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+# Close code sent to subscribers which fall too far behind
+TRY_AGAIN_LATER = 1013
+
+RELAY_KEY = "feed"
+RELAY_POLL_INTERVAL = 0.1
+# The relay log keeps at most this many events, and drops the oldest beyond this many bytes
+RELAY_MAX_EVENTS = 64
+RELAY_MAX_BYTES = 256 * 1024
+
+
+def encode_event(event: str, data: Any) -> str:
+    """Encodes an event as sent to subscribers.
+    """
+    return json.dumps(
+        {"type": event, "data": jsonable_encoder(data)}, separators=(",", ":")
+    )
+
+
+class Subscription:
+    """Queue of encoded events for a single subscriber, bound to the event loop it was created in.
+
+    At most `max_pending` events wait to be sent. A subscriber which falls further behind is
+    dropped, and :meth:`get` returns None once its pending events are discarded.
+    """
+
+    def __init__(self, max_pending: int) -> None:
+        self._loop = asyncio.get_event_loop()
+        self._queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue(max_pending)
+        self.dropped = False
+
+    async def get(self) -> Optional[str]:
+        """Waits for the next event, returns None if the subscriber was dropped.
+        """
+        return await self._queue.get()
+
+    def _put(self, message: str) -> bool:
+        # Returns False if the subscriber must be dropped
+        if self.dropped:
+            return False
+        try:
+            self._queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            self.dropped = True
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait(None)
+            return False
+
+
+def _relay_seq(line: bytes) -> int:
+    return int(line.split(b" ", 1)[0])
+
+
+def _append_event(worker: bytes, message: bytes, log: Optional[bytes]) -> bytes:
+    # Log lines are `sequence worker message`, messages are JSON without newlines
+    lines: List[bytes] = log.splitlines() if log else []
+    seq = _relay_seq(lines[-1]) + 1 if lines else 1
+    lines.append(b"%d %s %s" % (seq, worker, message))
+    del lines[:-RELAY_MAX_EVENTS]
+    size = sum(len(line) + 1 for line in lines)
+    while len(lines) > 1 and size > RELAY_MAX_BYTES:
+        size -= len(lines.pop(0)) + 1
+    return b"\n".join(lines)
+
+
+class FeedHub:  # pylint: disable=too-many-instance-attributes
+    """Publish/subscribe hub, relaying events to the hubs of other workers sharing `store` if
+    set, see the module documentation.
+
+    :meth:`publish` can be called from any thread, subscribers in other event loops receive events
+    through :meth:`asyncio.AbstractEventLoop.call_soon_threadsafe`.
+    """
+
+    def __init__(
+        self, max_pending: int = 100, store: Optional[SharedStore] = None
+    ) -> None:
+        self._max_pending = max_pending
+        self._subscriptions: Set[Subscription] = set()
+        self.dropped = 0
+        self._store = store
+        self._worker = f"{os.getpid()}-{id(self):x}".encode()
+        self._relay = BackgroundTask()
+        # Sequence number of the last event read from the relay log, and the log it was read from
+        self._relayed = 0
+        self._log: Optional[bytes] = None
+
+    @property
+    def subscribers(self) -> int:
+        """Number of current subscribers.
+        """
+        return len(self._subscriptions)
+
+    @contextmanager
+    def subscribe(self) -> Iterator[Subscription]:
+        """Subscribes to events published while the context is active. Must be called from a
+        running event loop.
+        """
+        subscription = Subscription(self._max_pending)
+        self._subscriptions.add(subscription)
+        if self._store is not None and not self._relay.running:
+            # Only events published from now on are relayed
+            self._log = self._store.get(RELAY_KEY)
+            self._relayed = _relay_seq(self._log.splitlines()[-1]) if self._log else 0
+            self._relay.start(self._follow)
+        try:
+            yield subscription
+        finally:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event: str, data: Any, all_workers: bool = False) -> None:
+        """Sends `data` as an `event` to all subscribers, and to the subscribers of the other
+        workers if `all_workers` is set and workers share a store.
+
+        `data` is encoded with :func:`fastapi.encoders.jsonable_encoder`, so it can contain
+        :mod:`pydantic` models.
+        """
+        relay = all_workers and self._store is not None
+        if not self._subscriptions and not relay:
+            return
+        message = encode_event(event, data)
+        if relay:
+            append = functools.partial(_append_event, self._worker, message.encode())
+            self._store.update(RELAY_KEY, append)  # type: ignore
+        self._send(message)
+
+    def _send(self, message: str) -> None:
+        current_loop: Optional[asyncio.AbstractEventLoop] = None
+        with suppress(RuntimeError):
+            current_loop = asyncio.get_running_loop()
+        for subscription in list(self._subscriptions):
+            # pylint: disable=protected-access
+            if subscription._loop is current_loop:
+                self._deliver(subscription, message)
+            else:
+                subscription._loop.call_soon_threadsafe(
+                    self._deliver, subscription, message
+                )
+
+    def _deliver(self, subscription: Subscription, message: str) -> None:
+        # pylint: disable=protected-access
+        if not subscription._put(message) and subscription in self._subscriptions:
+            self._subscriptions.discard(subscription)
+            self.dropped += 1
+            logger.warning("Feed subscriber fell behind, dropping it")
+
+    async def _follow(self) -> None:
+        while self._subscriptions:
+            await asyncio.sleep(RELAY_POLL_INTERVAL)
+            try:
+                self._poll()
+            except (OSError, ValueError):
+                logger.exception("Failed to read relayed feed events")
+
+    def _poll(self) -> None:
+        log = self._store.get(RELAY_KEY)  # type: ignore
+        if log is None or log is self._log:
+            return
+        self._log = log
+        for line in log.splitlines():
+            seq = _relay_seq(line)
+            if seq <= self._relayed:
+                continue
+            if seq > self._relayed + 1:
+                logger.warning("Missed %d relayed feed events", seq - self._relayed - 1)
+            self._relayed = seq
+            _, worker, message = line.split(b" ", 2)
+            if worker != self._worker:
+                self._send(message.decode())
+
+
+async def stream(websocket: WebSocket, subscription: Subscription) -> None:
+    """Sends events from `subscription` to `websocket` until the client disconnects or is dropped.
+    """
+
+    async def send() -> None:
+        while True:
+            message = await subscription.get()
+            if message is None:
+                await websocket.close(code=TRY_AGAIN_LATER)
+                return
+            await websocket.send_text(message)
+
+    async def receive() -> None:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+    tasks = {asyncio.ensure_future(send()), asyncio.ensure_future(receive())}
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+    for task in done:
+        if task.exception() is not None:
+            logger.debug("Feed subscriber disconnected: %r", task.exception())
+
+
+FEED_HUB = FeedHub(store=None if SHARED_DIR is None else SHARED_STORE)
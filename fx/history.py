@@ -0,0 +1,115 @@
+"""Historical exchange rates.
+
+Every new snapshot fetched by the shared rates cache is recorded in the `rates_history` table by a
+background task, so past rates can be looked up without calling fixer.io.
+"""
+import asyncio
+import logging
+import sys
+from array import array
+from typing import Callable, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from fx.database import RatesHistory, SessionLocal, run_db
+from fx.rates import RatesSnapshot
+from fx.tasks import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+
+def pack_snapshot(snapshot: RatesSnapshot) -> RatesHistory:
+    """Builds the `rates_history` row for `snapshot`.
+    """
+    rates = array("d", snapshot.rates.values())
+    if sys.byteorder == "big":
+        rates.byteswap()
+    return RatesHistory(
+        timestamp=snapshot.timestamp,
+        base=snapshot.base,
+        symbols=",".join(snapshot.rates),
+        rates=rates.tobytes(),
+    )
+
+
+def unpack_rates(row: RatesHistory) -> Dict[str, float]:
+    """Returns the rates stored in a `rates_history` row, keyed by symbol.
+    """
+    rates = array("d")
+    rates.frombytes(row.rates)
+    if sys.byteorder == "big":
+        rates.byteswap()
+    return dict(zip(row.symbols.split(","), rates))
+
+
+class RatesHistoryIngester:
+    """Inserts snapshots passed to :meth:`record` into `rates_history` in the background.
+
+    At most `max_pending` snapshots wait to be inserted, newer ones are dropped until the database
+    catches up.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        max_pending: int = 100,
+    ) -> None:
+        self._session_factory = session_factory
+        self._max_pending = max_pending
+        self._queue: Optional["asyncio.Queue[RatesSnapshot]"] = None
+        self._task = BackgroundTask()
+
+    def record(self, snapshot: RatesSnapshot) -> None:
+        """Queues `snapshot` to be inserted. Can be used as a :class:`fx.rates.RatesStore` listener.
+        """
+        if self._queue is None:
+            logger.warning("Rates history ingester isn't running, dropping snapshot")
+            return
+        try:
+            self._queue.put_nowait(snapshot)
+        except asyncio.QueueFull:
+            logger.warning("Too many pending rates snapshots, dropping snapshot")
+
+    def start(self) -> None:
+        """Starts the ingestion task. Must be called from a running event loop.
+        """
+        if not self._task.running:
+            self._queue = asyncio.Queue(self._max_pending)
+            self._task.start(self._run, self._queue)
+
+    async def stop(self) -> None:
+        """Stops the ingestion task started by :meth:`start`, dropping pending snapshots.
+        """
+        await self._task.stop()
+        self._queue = None
+
+    async def join(self) -> None:
+        """Waits until all queued snapshots are inserted.
+        """
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def _run(self, queue: "asyncio.Queue[RatesSnapshot]") -> None:
+        while True:
+            snapshot = await queue.get()
+            try:
+                await run_db(self._insert, snapshot)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception(
+                    "Failed to record rates snapshot %s", snapshot.timestamp
+                )
+            finally:
+                queue.task_done()
+
+    def _insert(self, snapshot: RatesSnapshot) -> None:
+        db = self._session_factory()
+        try:
+            # The same snapshot may be fetched again after a restart
+            if db.query(RatesHistory).get(snapshot.timestamp) is None:
+                db.add(pack_snapshot(snapshot))
+                db.commit()
+        finally:
+            db.close()
+
+
+HISTORY_INGESTER = RatesHistoryIngester()
@@ -0,0 +1,107 @@
+"""Trade ID generators.
+
+IDs are "TR" followed by uppercase letters and digits. By default they're ULIDs (see
+https://github.com/ulid/spec): a millisecond timestamp followed by random bits, so IDs sort in
+the order they were generated and inserts land at the end of the `trades.trade_id` index. The
+generator can be changed with the environment variable FX_TRADE_IDS, set it to `random` to use the
+legacy 7 random characters.
+"""
+import os
+import random
+import string
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Iterator, Tuple
+
+PREFIX = "TR"
+
+# Crockford's base32 alphabet, which excludes I, L, O and U
+_CROCKFORD = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_ENTROPY_BITS = 80
+_MAX_ENTROPY = (1 << _ENTROPY_BITS) - 1
+
+
+class IdGenerator(ABC):
+    """Declares functionality which trade ID generators should implement.
+    """
+
+    @abstractmethod
+    def new_id(self) -> str:
+        """Returns a new trade ID. Must be safe to call from multiple threads.
+        """
+        raise NotImplementedError()
+
+
+class RandomIdGenerator(IdGenerator):
+    """"TR" followed by 7 random letters and digits.
+
+    IDs aren't ordered and collisions become likely as the number of trades grows.
+    """
+
+    def new_id(self) -> str:
+        return PREFIX + "".join(
+            random.choice(string.ascii_uppercase + string.digits) for _ in range(7)
+        )
+
+
+class UlidGenerator(IdGenerator):
+    """"TR" followed by a 26 characters ULID.
+
+    The first 10 characters encode the current time in milliseconds and the other 16 are 80 random
+    bits, drawn from :func:`os.urandom` so separate processes never share a sequence. IDs generated
+    within the same millisecond increment the random bits of the previous one, so IDs from a single
+    process are strictly increasing even if the clock goes backwards.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time) -> None:
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._last_ms = -1
+        self._last_entropy = 0
+
+    def new_id(self) -> str:
+        with self._lock:
+            timestamp_ms, entropy = self._next()
+        value = (timestamp_ms << _ENTROPY_BITS) | entropy
+        chars = []
+        for _ in range(26):
+            value, index = divmod(value, 32)
+            chars.append(_CROCKFORD[index])
+        return PREFIX + "".join(reversed(chars))
+
+    def _next(self) -> Tuple[int, int]:
+        pid = os.getpid()
+        if pid != self._pid:
+            # A forked worker must not continue the parent's sequence
+            self._pid = pid
+            self._last_ms = -1
+        now_ms = int(self._clock() * 1000)
+        if now_ms > self._last_ms:
+            self._last_ms = now_ms
+            # Leave headroom so the increments below rarely overflow into the timestamp
+            self._last_entropy = int.from_bytes(os.urandom(10), "big") >> 1
+        elif self._last_entropy < _MAX_ENTROPY:
+            self._last_entropy += 1
+        else:
+            self._last_ms += 1
+            self._last_entropy = int.from_bytes(os.urandom(10), "big") >> 1
+        return self._last_ms, self._last_entropy
+
+
+_GENERATORS = {
+    "ulid": UlidGenerator,
+    "random": RandomIdGenerator,
+}
+TRADE_IDS = os.environ.get("FX_TRADE_IDS", "ulid")
+if TRADE_IDS not in _GENERATORS:
+    raise ValueError(f"Unknown trade ID generator {TRADE_IDS!r} in FX_TRADE_IDS")
+
+_generator: IdGenerator = _GENERATORS[TRADE_IDS]()
+
+
+def get_id_generator() -> Iterator[IdGenerator]:
+    """Function for dependency injection with :class:`fastapi.Dependency`.
+    """
+    yield _generator
@@ -0,0 +1,439 @@
+"""Prometheus metrics.
+
+Metrics are kept in memory by each process and rendered in the Prometheus text format by
+/metrics. Recording a sample only takes a lock and a dict update, so metrics can be recorded on
+every request.
+
+When the server runs several worker processes, set FX_METRICS_DIR to an empty directory shared by
+the workers. Every worker then writes its samples to a file named after its pid in that directory
+every FX_METRICS_FLUSH_INTERVAL seconds (5 by default), and /metrics aggregates the files of all
+workers, so any worker can answer the scrape. Counters and histograms of exited workers are kept,
+gauges only count workers which are still running. The directory must be emptied before starting
+the server.
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from fx.tasks import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.environ.get("FX_METRICS_DIR")
+FLUSH_INTERVAL = float(os.environ.get("FX_METRICS_FLUSH_INTERVAL", "5"))
+
+# Bucket upper bounds in seconds, the defaults of the official Prometheus clients
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+# (name, ((label, value), ...), value) of a single sample
+Sample = Tuple[str, Tuple[Tuple[str, str], ...], float]
+
+
+class Family:
+    """Samples of a metric as collected by :meth:`Registry.collect`.
+    """
+
+    def __init__(
+        self, name: str, kind: str, documentation: str, samples: List[Sample]
+    ) -> None:
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.samples = samples
+
+
+class Metric:
+    """Base class of metrics, identified by `name` and with one value per combination of values of
+    `labels`.
+
+    A `function` returning the current values keyed by label values can be passed to expose values
+    maintained elsewhere instead of recording them through the metric.
+    """
+
+    kind = ""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        function: Optional[Callable[[], Dict[LabelValues, float]]] = None,
+        registry: Optional["Registry"] = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._function = function
+        self._values: Dict[LabelValues, float] = {}
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def _add(self, label_values: LabelValues, amount: float) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def collect(self) -> Family:
+        """Returns the current samples of the metric.
+        """
+        if self._function is not None:
+            values = self._function()
+        else:
+            with self._lock:
+                values = dict(self._values)
+        samples = [
+            (self.name, tuple(zip(self.labels, key)), float(value))
+            for key, value in values.items()
+        ]
+        return Family(self.name, self.kind, self.documentation, samples)
+
+
+class Counter(Metric):
+    """Monotonically increasing value.
+    """
+
+    kind = "counter"
+
+    def inc(self, label_values: LabelValues = (), amount: float = 1.0) -> None:
+        """Increments the counter of `label_values` by `amount`.
+        """
+        self._add(label_values, amount)
+
+
+class Gauge(Metric):
+    """Value which goes up and down.
+    """
+
+    kind = "gauge"
+
+    def inc(self, label_values: LabelValues = (), amount: float = 1.0) -> None:
+        """Increments the gauge of `label_values` by `amount`.
+        """
+        self._add(label_values, amount)
+
+    def dec(self, label_values: LabelValues = (), amount: float = 1.0) -> None:
+        """Decrements the gauge of `label_values` by `amount`.
+        """
+        self._add(label_values, -amount)
+
+    def set(self, value: float, label_values: LabelValues = ()) -> None:
+        """Sets the gauge of `label_values` to `value`.
+        """
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram:
+    """Distribution of observed values, counted in cumulative buckets with upper bounds `buckets`.
+    """
+
+    kind = "histogram"
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        registry: Optional["Registry"] = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label values: count of each bucket (not cumulative) plus +Inf, then the sum
+        self._values: Dict[LabelValues, List[float]] = {}
+        self._lock = threading.Lock()
+        (REGISTRY if registry is None else registry).register(self)
+
+    def observe(self, value: float, label_values: LabelValues = ()) -> None:
+        """Records `value` for `label_values`.
+        """
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [0.0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def collect(self) -> Family:
+        """Returns the current samples of the histogram.
+        """
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        samples: List[Sample] = []
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for key, counts in values.items():
+            labels = tuple(zip(self.labels, key))
+            total = 0.0
+            for bound, count in zip(bounds, counts):
+                total += count
+                samples.append((f"{self.name}_bucket", labels + (("le", bound),), total))
+            samples.append((f"{self.name}_sum", labels, counts[-1]))
+            samples.append((f"{self.name}_count", labels, total))
+        return Family(self.name, self.kind, self.documentation, samples)
+
+
+class Registry:
+    """Set of metrics rendered together.
+
+    If `directory` is set, samples are aggregated with those written to it by other processes, see
+    the module documentation.
+    """
+
+    def __init__(self, directory: Optional[str] = None) -> None:
+        self.directory = directory
+        self._metrics: Dict[str, Any] = {}
+        self._task = BackgroundTask()
+
+    def register(self, metric: Any) -> None:
+        """Adds `metric` to the registry, its name must be unique.
+        """
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric {metric.name}")
+        self._metrics[metric.name] = metric
+
+    def collect(self) -> List[Family]:
+        """Returns the samples of all metrics of this process.
+        """
+        return [metric.collect() for metric in self._metrics.values()]
+
+    def render(self) -> str:
+        """Renders the metrics in the Prometheus text exposition format.
+        """
+        if self.directory is None:
+            families = self.collect()
+        else:
+            self.flush()
+            families = self._collect_directory()
+        lines = []
+        for family in families:
+            lines.append(f"# HELP {family.name} {_escape_help(family.documentation)}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for name, labels, value in family.samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def flush(self) -> None:
+        """Writes the samples of this process to the metrics directory.
+        """
+        if self.directory is None:
+            return
+        data = [
+            [family.name, family.kind, family.documentation, family.samples]
+            for family in self.collect()
+        ]
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        # Write to a temporary file first so other processes never read a partial file
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(f"{path}.tmp", path)
+
+    def start(self) -> None:
+        """Starts flushing samples periodically if a directory is set. Must be called from a
+        running event loop.
+        """
+        if self.directory is not None:
+            self._task.start(self._run)
+
+    async def stop(self) -> None:
+        """Stops the task started by :meth:`start` and flushes samples a last time.
+        """
+        if await self._task.stop():
+            self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError:
+                logger.exception("Failed to write metrics to %s", self.directory)
+
+    def _collect_directory(self) -> List[Family]:
+        families: Dict[str, Family] = {}
+        totals: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+        for alive, data in self._read_directory():
+            for name, kind, documentation, samples in data:
+                # Gauges of exited workers are stale, their counters still count
+                if kind == "gauge" and not alive:
+                    continue
+                family = families.setdefault(
+                    name, Family(name, kind, documentation, [])
+                )
+                for sample_name, labels, value in samples:
+                    key = (sample_name, tuple(tuple(pair) for pair in labels))
+                    if key not in totals:
+                        family.samples.append((key[0], key[1], 0.0))
+                    totals[key] = totals.get(key, 0.0) + value
+        for family in families.values():
+            family.samples = [
+                (name, labels, totals[name, labels]) for name, labels, _ in family.samples
+            ]
+        return list(families.values())
+
+    def _read_directory(self) -> Iterator[Tuple[bool, List[Any]]]:
+        # Yields whether each worker is alive and the samples it wrote
+        assert self.directory is not None
+        for entry in sorted(os.listdir(self.directory)):
+            pid, ext = os.path.splitext(entry)
+            if ext != ".json" or not pid.isdigit():
+                continue
+            try:
+                with open(os.path.join(self.directory, entry), encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                logger.warning("Skipping unreadable metrics file %s", entry)
+                continue
+            yield _is_alive(int(pid)), data
+
+
+def _is_alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _escape_help(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'),
+        )
+        for name, value in labels
+    )
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    if value != value:  # pylint: disable=comparison-with-itself
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 2 ** 53:
+        return f"{int(value)}.0"
+    return repr(value)
+
+
+REGISTRY = Registry(METRICS_DIR)
+
+HTTP_REQUESTS = Counter(
+    "fx_http_requests_total",
+    "HTTP requests handled, by route template, method and status code.",
+    ("method", "route", "status"),
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "fx_http_request_duration_seconds",
+    "Time spent handling HTTP requests until the response is sent, by route template and method.",
+    ("method", "route"),
+)
+HTTP_IN_FLIGHT = Gauge(
+    "fx_http_requests_in_flight", "HTTP requests currently being handled."
+)
+DB_QUERY_SECONDS = Histogram(
+    "fx_db_query_duration_seconds", "Time spent executing SQL statements."
+)
+FIXER_REQUESTS = Counter(
+    "fx_fixer_requests_total",
+    "Requests to fixer.io, by endpoint and HTTP status code, or error for requests which got no "
+    "response.",
+    ("endpoint", "status"),
+)
+FIXER_REQUEST_SECONDS = Histogram(
+    "fx_fixer_request_duration_seconds",
+    "Latency of requests to fixer.io, by endpoint.",
+    ("endpoint",),
+)
+HTTP_SHED_REQUESTS = Counter(
+    "fx_http_shed_requests_total",
+    "HTTP requests rejected by admission control, by method, route and reason: queue_full, "
+    "queue_timeout or loop_lag.",
+    ("method", "route", "reason"),
+)
+
+RATES_PROVIDER_SECONDS = Histogram(
+    "fx_rates_provider_duration_seconds",
+    "Latency of requests to rates providers, by provider and result: ok, error, or cancelled "
+    "after another provider answered first.",
+    ("provider", "result"),
+)
+RATES_HEDGED_REQUESTS = Counter(
+    "fx_rates_hedged_requests_total",
+    "Requests for rates sent to another provider because the previous one was slow.",
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording HTTP request metrics.
+
+    Requests are labelled with the path template of the route which handled them, such as
+    `/trades/{trade_id}`, so the number of label values stays bounded. Requests which matched no
+    route are labelled `<unmatched>`.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self._routes: Dict[Any, str] = {}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = self._route(scope)
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - start, (scope["method"], route)
+            )
+            HTTP_REQUESTS.inc((scope["method"], route, str(status)))
+
+    def _route(self, scope: Scope) -> str:
+        # The router sets the endpoint of the matched route in the scope
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "<unmatched>"
+        route = self._routes.get(endpoint)
+        if route is None:
+            route = next(
+                (
+                    r.path
+                    for r in scope["app"].routes
+                    if getattr(r, "endpoint", None) is endpoint
+                ),
+                "<unmatched>",
+            )
+            self._routes[endpoint] = route
+        return route
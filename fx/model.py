@@ -1,6 +1,9 @@
 """Common code for REST API models.
 """
+import operator
+from array import array
 from math import floor
+from typing import Iterable, Iterator, List, Sequence, Union
 
 import pydantic
 
@@ -65,6 +68,104 @@ class Currency:
         return f"Currency({self})"
 
 
+class CurrencyArray:
+    """A column of currency amounts, the batch counterpart of :class:`Currency`.
+
+    Amounts are stored in a signed 64 bits :class:`array.array`, or in a list of integers when one
+    of them doesn't fit in 64 bits, and follow the same rules as :class:`Currency`: they can't be
+    negative and multiplications are truncated to two decimal places. Arrays can be multiplied by
+    a scalar or element-wise by a sequence of scalars of the same length, without allocating a
+    :class:`Currency` per amount.
+
+    Like :class:`Currency` it can be used as a field in :mod:`pydantic` models, and it's serialized
+    to JSON as a list of integers.
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values: Iterable[int]) -> None:
+        data: Union["array[int]", List[int]]
+        if isinstance(values, array):
+            data = values
+        else:
+            data = values if isinstance(values, list) else list(values)
+            try:
+                data = array("q", data)
+            except OverflowError:
+                # Amounts as large as Currency accepts, at the cost of the compact storage
+                pass
+        if data and min(data) < 0:
+            raise ValueError(f"Currency can't be negative, got {min(data)!r}")
+        self.values = data
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls._validate
+
+    @classmethod
+    def _validate(cls, v) -> "CurrencyArray":
+        if isinstance(v, CurrencyArray):
+            return v
+        if isinstance(v, (list, tuple)) and all(isinstance(x, int) for x in v):
+            return CurrencyArray(v)
+        raise TypeError("must be a list of integers")
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __iter__(self) -> Iterator[Currency]:
+        return map(Currency, self.values)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[Currency, "CurrencyArray"]:
+        if isinstance(index, slice):
+            return CurrencyArray(self.values[index])
+        return Currency(self.values[index])
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, CurrencyArray):
+            return NotImplemented
+        if type(self.values) is type(other.values):
+            return self.values == other.values
+        return self.tolist() == other.tolist()
+
+    def __mul__(self, other: object) -> "CurrencyArray":
+        if isinstance(other, (int, float)):
+            if other < 0:
+                raise ValueError(
+                    f"Can't multiply currency with negative numbers, got {other!r}"
+                )
+            if isinstance(other, int):
+                # Integer products need no rounding
+                return CurrencyArray([v * other for v in self.values])
+            products: Iterable = map(other.__mul__, self.values)
+        elif isinstance(other, Sequence):
+            if len(other) != len(self.values):
+                raise ValueError(
+                    f"Can't multiply {len(self.values)} amounts by {len(other)} scalars"
+                )
+            if other and min(other) < 0:
+                raise ValueError(
+                    f"Can't multiply currency with negative numbers, got {min(other)!r}"
+                )
+            products = map(operator.mul, self.values, other)
+        else:
+            return NotImplemented
+        return CurrencyArray(list(map(floor, products)))
+
+    def __rmul__(self, other: object) -> "CurrencyArray":
+        return self * other
+
+    def tolist(self) -> List[int]:
+        """Returns the amounts as integers.
+        """
+        if isinstance(self.values, list):
+            return list(self.values)
+        return self.values.tolist()
+
+    def __repr__(self) -> str:
+        return f"CurrencyArray({[str(c) for c in self]})"
+
+
 class BaseModel(pydantic.BaseModel):
     """Use this base class instead of the default :class:`pydantic.BaseModel`, it configures common
     JSON encoders for the application's types.
@@ -73,4 +174,5 @@ class BaseModel(pydantic.BaseModel):
     class Config:
         json_encoders = {
             Currency: lambda c: c.value,
+            CurrencyArray: lambda a: a.tolist(),
         }
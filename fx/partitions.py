@@ -0,0 +1,324 @@
+"""Monthly partitions of the trades table and archival of old months.
+
+On Postgres, `trades` is partitioned by month of `timestamp` into tables named `trades_YYYY_MM`,
+plus `trades_default` holding trades of months without a partition. Queries filtering or paging
+on `timestamp` only scan the matching partitions, and each partition has its own, smaller
+indexes. Partitions for the current month and the next FX_PARTITIONS_AHEAD months (3 by default)
+are created when the server starts, ``python -m fx.partitions create`` creates them ahead of time.
+Other databases keep a single table.
+
+A trades table created on Postgres before trades were partitioned isn't converted: the server
+refuses to start until it's recreated as a partitioned table and its rows copied over.
+
+``python -m fx.partitions archive --before YYYY-MM`` moves trades of earlier months out of the
+database to gzip-compressed NDJSON files in FX_ARCHIVE_DIR (./archive by default), one file per
+month in the format of /trades/export. Archived months are served by /trades/archive and still
+count towards positions (see :func:`archived_legs`). Archiving a month drops its partition on
+Postgres. Add ``--vacuum`` to give the freed space back to the filesystem on SQLite.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+from datetime import datetime
+from typing import Iterator, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, func, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from fx.database import TRADE_COLUMNS, Base, SessionLocal, Trade, engine
+from fx.export import encode_ndjson
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.environ.get("FX_ARCHIVE_DIR", "./archive")
+PARTITIONS_AHEAD = int(os.environ.get("FX_PARTITIONS_AHEAD", "3"))
+
+MONTH_RE = re.compile(r"^(\d{4})-(0[1-9]|1[0-2])$")
+# Trades archived at a time
+ARCHIVE_CHUNK_SIZE = 10_000
+
+
+def parse_month(month: str) -> datetime:
+    """Returns the first instant of `month`, formatted as `YYYY-MM`.
+
+    Raises
+    ------
+    ValueError
+        When `month` isn't formatted as `YYYY-MM`.
+    """
+    match = MONTH_RE.match(month)
+    if match is None:
+        raise ValueError(f"Invalid month {month!r}, expected YYYY-MM")
+    return datetime(int(match.group(1)), int(match.group(2)), 1)
+
+
+def next_month(start: datetime) -> datetime:
+    """Returns the first instant of the month following the month starting at `start`.
+    """
+    if start.month == 12:
+        return datetime(start.year + 1, 1, 1)
+    return datetime(start.year, start.month + 1, 1)
+
+
+def partition_name(start: datetime) -> str:
+    """Returns the name of the partition of the month starting at `start`.
+    """
+    return f"trades_{start:%Y_%m}"
+
+
+def partition_ddl(start: datetime) -> str:
+    """Returns the statement creating the Postgres partition of the month starting at `start`.
+    """
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(start)} PARTITION OF trades "
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{next_month(start):%Y-%m-%d}')"
+    )
+
+
+class UnpartitionedTrades(Exception):
+    """Raised on Postgres when the trades table exists but isn't partitioned.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(
+            "The trades table isn't partitioned, it was created before trades were partitioned "
+            "by month. Rename it, start the server to create the partitioned table, then copy "
+            "the trades over with INSERT INTO trades SELECT * FROM <renamed table>"
+        )
+
+
+def is_partitioned(bind: Engine) -> bool:
+    """Returns whether the trades table of `bind` is partitioned, which only happens on Postgres.
+    """
+    if bind.dialect.name != "postgresql":
+        return False
+    # relkind is 'p' for partitioned tables and 'r' for plain ones
+    query = text("SELECT relkind FROM pg_class WHERE oid = to_regclass('trades')")
+    return bind.execute(query).scalar() == "p"
+
+
+def create_partitions(
+    bind: Engine, ahead: int = PARTITIONS_AHEAD, now: Optional[datetime] = None
+) -> List[str]:
+    """Creates the partitions of the current month and the next `ahead` months if they don't
+    exist, and returns their names. Does nothing on databases other than Postgres.
+
+    Raises
+    ------
+    UnpartitionedTrades
+        When the trades table isn't partitioned on Postgres.
+    """
+    if bind.dialect.name != "postgresql":
+        return []
+    if not is_partitioned(bind):
+        raise UnpartitionedTrades()
+    now = now or datetime.utcnow()
+    start = datetime(now.year, now.month, 1)
+    names = []
+    with bind.begin() as conn:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS trades_default PARTITION OF trades DEFAULT"
+        )
+        for _ in range(ahead + 1):
+            if _has_default_rows(conn, start):
+                # Postgres refuses to create a partition for rows already in the default one
+                logger.warning(
+                    "Trades of %s are in trades_default, not creating %s",
+                    f"{start:%Y-%m}",
+                    partition_name(start),
+                )
+            else:
+                conn.execute(partition_ddl(start))
+                names.append(partition_name(start))
+            start = next_month(start)
+    return names
+
+
+def create_schema(bind: Engine = engine) -> None:
+    """Creates the missing tables of `bind`, then the partitions of trades on Postgres.
+
+    Raises
+    ------
+    UnpartitionedTrades
+        When the trades table isn't partitioned on Postgres.
+    """
+    Base.metadata.create_all(bind=bind, checkfirst=True)
+    create_partitions(bind)
+
+
+def _has_default_rows(conn: Connection, start: datetime) -> bool:
+    query = text(
+        "SELECT 1 FROM trades_default WHERE timestamp >= :start AND timestamp < :end LIMIT 1"
+    )
+    return conn.execute(query, start=start, end=next_month(start)).first() is not None
+
+
+def archive_path(month: str, directory: str = ARCHIVE_DIR) -> str:
+    """Returns the path of the archive of `month`, formatted as `YYYY-MM`.
+    """
+    return os.path.join(directory, f"trades-{month}.ndjson.gz")
+
+
+def archived_months(directory: str = ARCHIVE_DIR) -> List[str]:
+    """Returns the archived months, formatted as `YYYY-MM`, in ascending order.
+    """
+    if not os.path.isdir(directory):
+        return []
+    months = []
+    for entry in os.listdir(directory):
+        if entry.startswith("trades-") and entry.endswith(".ndjson.gz"):
+            month = entry[len("trades-") : -len(".ndjson.gz")]
+            if MONTH_RE.match(month):
+                months.append(month)
+    return sorted(months)
+
+
+def read_archive(month: str, directory: str = ARCHIVE_DIR) -> Iterator[dict]:
+    """Yields the trades archived for `month`, as exported by /trades/export.
+    """
+    with gzip.open(archive_path(month, directory), "rt") as archive:
+        for line in archive:
+            yield json.loads(line)
+
+
+def archived_legs(
+    directory: str = ARCHIVE_DIR
+) -> Iterator[Tuple[str, int, str, float]]:
+    """Yields `(sell_ccy, sell_amount, buy_ccy, rate)` of all archived trades, to account for them
+    in positions.
+    """
+    for month in archived_months(directory):
+        for trade in read_archive(month, directory):
+            yield (
+                trade["sell_ccy"],
+                trade["sell_amount"],
+                trade["buy_ccy"],
+                trade["rate"],
+            )
+
+
+def archive_trades(
+    db: Session, before: datetime, directory: str = ARCHIVE_DIR
+) -> List[str]:
+    """Moves trades booked before `before`, which must be the start of a month, to archives and
+    returns the archived months.
+
+    Each month is written to its archive before its trades are deleted, so an interrupted run
+    loses nothing and can be run again: trades already in an archive aren't archived twice.
+    """
+    first = db.query(func.min(Trade.timestamp)).scalar()
+    if first is None:
+        return []
+    os.makedirs(directory, exist_ok=True)
+    months = []
+    start = datetime(first.year, first.month, 1)
+    while start < before:
+        if _archive_month(db, start, directory):
+            months.append(f"{start:%Y-%m}")
+        start = next_month(start)
+    return months
+
+
+def _archive_month(db: Session, start: datetime, directory: str) -> bool:
+    # Returns False if there were no trades to archive
+    end = next_month(start)
+    in_month = and_(Trade.timestamp >= start, Trade.timestamp < end)
+    if db.query(Trade.trade_id).filter(in_month).first() is None:
+        return False
+    path = archive_path(f"{start:%Y-%m}", directory)
+    archived: Set[str] = set()
+    if os.path.exists(path):
+        archived = {trade["id"] for trade in read_archive(f"{start:%Y-%m}", directory)}
+
+    rows = (
+        db.query(*TRADE_COLUMNS)
+        .filter(in_month)
+        .order_by(Trade.timestamp, Trade.trade_id)
+        .yield_per(ARCHIVE_CHUNK_SIZE)
+    )
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as tmp:
+        if archived:
+            # Gzip files can be concatenated, the new trades are appended as another member
+            with open(path, "rb") as existing:
+                tmp.write(existing.read())
+        with gzip.GzipFile(fileobj=tmp, mode="wb") as archive:
+            chunk = []
+            for row in rows:
+                if row[0] not in archived:
+                    chunk.append(row)
+                if len(chunk) == ARCHIVE_CHUNK_SIZE:
+                    archive.write(encode_ndjson(chunk))
+                    chunk = []
+            archive.write(encode_ndjson(chunk))
+        tmp.flush()
+        os.fsync(tmp.fileno())
+    os.replace(tmp_path, path)
+
+    if is_partitioned(db.get_bind()):
+        name = partition_name(start)
+        if db.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+            db.execute(f"ALTER TABLE trades DETACH PARTITION {name}")
+            db.execute(f"DROP TABLE {name}")
+    db.query(Trade).filter(in_month).delete(synchronize_session=False)
+    db.commit()
+    logger.info("Archived trades of %s to %s", f"{start:%Y-%m}", path)
+    return True
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point for ``python -m fx.partitions``.
+    """
+    parser = argparse.ArgumentParser(
+        description="Create trades partitions or archive old trades."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser(
+        "create", help="create partitions of the coming months (Postgres only)"
+    )
+    create.add_argument(
+        "--ahead",
+        type=int,
+        default=PARTITIONS_AHEAD,
+        help="number of months after the current one",
+    )
+    archive = commands.add_parser(
+        "archive", help="move trades of old months to compressed files"
+    )
+    archive.add_argument(
+        "--before", type=parse_month, required=True, help="first month to keep, YYYY-MM"
+    )
+    archive.add_argument(
+        "--vacuum", action="store_true", help="compact the database afterwards (SQLite)"
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "create":
+        try:
+            names = create_partitions(engine, args.ahead)
+        except UnpartitionedTrades as exc:
+            print(exc, file=sys.stderr)
+            return 1
+        for name in names:
+            print(name)
+        return 0
+
+    db = SessionLocal()
+    try:
+        months = archive_trades(db, args.before)
+    finally:
+        db.close()
+    for month in months:
+        print(f"{month}: {archive_path(month)}")
+    if args.vacuum and engine.dialect.name == "sqlite":
+        engine.execute("VACUUM")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,175 @@
+"""Net positions per currency.
+
+The `positions` table holds the totals bought and sold of each currency. Every code path booking
+trades calls :func:`apply_trades` before committing, so positions can be read without summing all
+trades.
+
+Run ``python -m fx.positions`` to check the stored positions against the trades table, and
+``python -m fx.positions --rebuild`` to recompute them from scratch. Trades moved to archives by
+:mod:`fx.partitions` are accounted for.
+"""
+import argparse
+import sys
+from collections import defaultdict
+from itertools import chain, islice
+from math import trunc
+from typing import DefaultDict, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from fx.database import Position, SessionLocal, Trade
+from fx.model import CurrencyArray
+from fx.partitions import archived_legs
+from fx.rates import ClientException, RatesSnapshot
+
+# (sell_ccy, sell_amount, buy_ccy, rate) of a booked trade
+TradeLegs = Tuple[str, int, str, float]
+# (bought, sold) totals of a currency
+Totals = Tuple[int, int]
+
+# Largest amount the BIGINT columns of the positions table hold
+MAX_AMOUNT = 2 ** 63 - 1
+
+
+class PositionOverflow(Exception):
+    """Raised when booking trades would push the total bought or sold of `ccy` past
+    :data:`MAX_AMOUNT`.
+    """
+
+    def __init__(self, ccy: str) -> None:
+        super().__init__(f"Position in {ccy} would exceed {MAX_AMOUNT}")
+        self.ccy = ccy
+
+
+def _totals(trades: Iterable[TradeLegs], chunk_size: int = 10_000) -> Dict[str, Totals]:
+    totals: DefaultDict[str, List[int]] = defaultdict(lambda: [0, 0])
+    trades = iter(trades)
+    while True:
+        chunk = list(islice(trades, chunk_size))
+        if not chunk:
+            break
+        bought = CurrencyArray(t[1] for t in chunk) * [t[3] for t in chunk]
+        for (sell_ccy, sell_amount, buy_ccy, _), buy_amount in zip(
+            chunk, bought.tolist()
+        ):
+            totals[sell_ccy][1] += sell_amount
+            totals[buy_ccy][0] += buy_amount
+    return {ccy: (bought, sold) for ccy, (bought, sold) in totals.items()}
+
+
+# Inserts the row of a new currency or adds to the existing one in a single statement, so
+# transactions booking the first trades of a currency concurrently don't conflict. Supported by
+# Postgres and SQLite 3.24+. Rows whose totals would exceed :data:`MAX_AMOUNT` aren't updated:
+# Postgres would fail and SQLite would silently turn them into floats. The comparisons are
+# written so they can't overflow themselves.
+_UPSERT = text(
+    "INSERT INTO positions (ccy, bought, sold) VALUES (:ccy, :bought, :sold) "
+    "ON CONFLICT (ccy) DO UPDATE SET bought = positions.bought + excluded.bought, "
+    "sold = positions.sold + excluded.sold "
+    "WHERE positions.bought <= :max_amount - excluded.bought "
+    "AND positions.sold <= :max_amount - excluded.sold"
+)
+
+
+def apply_trades(db: Session, trades: Iterable[TradeLegs]) -> None:
+    """Adds `trades` to the positions in the current transaction of `db`.
+
+    Currencies are updated in a fixed order so concurrent transactions don't deadlock.
+
+    Raises
+    ------
+    PositionOverflow
+        When a total bought or sold would exceed :data:`MAX_AMOUNT`, in which case the
+        transaction must be rolled back.
+    """
+    for ccy, (bought, sold) in sorted(_totals(trades).items()):
+        if bought > MAX_AMOUNT or sold > MAX_AMOUNT:
+            raise PositionOverflow(ccy)
+        params = {"ccy": ccy, "bought": bought, "sold": sold, "max_amount": MAX_AMOUNT}
+        # The upsert changes no row when the checked sums fail
+        if db.execute(_UPSERT, params).rowcount == 0:
+            raise PositionOverflow(ccy)
+
+
+def net_value(
+    ccy: str, net: int, snapshot: RatesSnapshot, valuation_ccy: str
+) -> Optional[int]:
+    """Returns `net` cents of `ccy` converted to `valuation_ccy` at the rates of `snapshot`, or
+    None if there's no rate for `ccy`: trades aren't checked against the rates source.
+
+    Values are truncated towards zero like :class:`fx.model.Currency`, so short positions aren't
+    rounded away from it.
+    """
+    try:
+        rate = snapshot.get_rate(ccy, valuation_ccy)
+    except ClientException:
+        return None
+    return trunc(net * rate)
+
+
+def compute_positions(db: Session) -> Dict[str, Totals]:
+    """Computes positions from all trades, including archived trades.
+    """
+    rows = (
+        db.query(Trade.sell_ccy, Trade.sell_amount, Trade.buy_ccy, Trade.rate)
+        .execution_options(stream_results=True)
+        .yield_per(10_000)
+    )
+    return _totals(chain(rows, archived_legs()))
+
+
+def check_positions(db: Session) -> Dict[str, Tuple[Optional[Totals], Totals]]:
+    """Returns the currencies whose stored positions don't match the trades, mapped to their
+    stored totals (None if missing) and the totals computed from trades.
+    """
+    stored = {p.ccy: (p.bought, p.sold) for p in db.query(Position)}
+    expected = compute_positions(db)
+    return {
+        ccy: (stored.get(ccy), expected.get(ccy, (0, 0)))
+        for ccy in set(stored) | set(expected)
+        if stored.get(ccy, (0, 0)) != expected.get(ccy, (0, 0))
+    }
+
+
+def rebuild_positions(db: Session) -> None:
+    """Replaces all stored positions by positions computed from trades and commits.
+    """
+    expected = compute_positions(db)
+    db.query(Position).delete()
+    db.bulk_insert_mappings(
+        Position,
+        [
+            {"ccy": ccy, "bought": bought, "sold": sold}
+            for ccy, (bought, sold) in expected.items()
+        ],
+    )
+    db.commit()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Entry point for ``python -m fx.positions``.
+    """
+    parser = argparse.ArgumentParser(
+        description="Check positions against trades, optionally rebuilding them."
+    )
+    parser.add_argument(
+        "--rebuild", action="store_true", help="recompute positions from trades"
+    )
+    args = parser.parse_args(argv)
+
+    db = SessionLocal()
+    try:
+        if args.rebuild:
+            rebuild_positions(db)
+        mismatches = check_positions(db)
+    finally:
+        db.close()
+
+    for ccy, (stored, expected) in sorted(mismatches.items()):
+        print(f"{ccy}: stored (bought, sold) {stored}, expected {expected}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
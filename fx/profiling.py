@@ -0,0 +1,374 @@
+"""On-demand profiling of requests.
+
+A request is profiled when its `X-Fx-Profile` header holds the admin token set in FX_PROFILE_TOKEN,
+or at random with probability FX_PROFILE_SAMPLE_RATE (0 by default). Profiled requests get an
+`X-Fx-Profile-Id` response header and their profile is kept in a ring buffer of the last
+FX_PROFILE_BUFFER_SIZE profiles (50 by default), served by the /admin/profiles endpoints to
+requests carrying the admin token.
+
+A profile holds the time spent in each phase of the request:
+
+- `db`: waiting for database calls made with :func:`fx.database.run_db`.
+- `upstream`: waiting for rates providers.
+- `endpoint`: running the endpoint, including the `db` and `upstream` phases.
+- `model`: building response models, where endpoints time it.
+- `response`: validating and serialising the value returned by the endpoint.
+
+It also holds a cProfile profile of the event loop thread while the request was handled, which
+includes other requests handled concurrently and excludes work done in thread pools. Only one
+request is run under cProfile at a time, other requests profiled meanwhile only time their phases.
+
+When no request is profiled, hooks cost a context variable lookup.
+"""
+import asyncio
+import cProfile
+import functools
+import hmac
+import itertools
+import marshal
+import os
+import pstats
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Counter, Deque, Dict, Iterator, List, Optional
+
+from fastapi.routing import APIRoute
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+PROFILE_TOKEN = os.environ.get("FX_PROFILE_TOKEN")
+PROFILE_SAMPLE_RATE = float(os.environ.get("FX_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_BUFFER_SIZE = int(os.environ.get("FX_PROFILE_BUFFER_SIZE", "50"))
+PROFILE_HEADER = "X-Fx-Profile"
+
+# Call graph edges cheaper than this many seconds are left out of collapsed stacks
+COLLAPSED_MIN_TIME = 1e-6
+COLLAPSED_MAX_DEPTH = 200
+
+
+@dataclass
+class RequestProfile:  # pylint: disable=too-many-instance-attributes
+    """Profile of a request, see the module documentation.
+    """
+
+    profile_id: int
+    method: str
+    path: str
+    started_at: float
+    duration: float = 0.0
+    status: int = 0
+    phases: Dict[str, float] = field(default_factory=dict)
+    stats: Optional[pstats.Stats] = None
+    # When the endpoint returned, according to time.perf_counter()
+    endpoint_end: Optional[float] = None
+
+    def add(self, phase_name: str, seconds: float) -> None:
+        """Adds `seconds` to the time spent in `phase_name`.
+        """
+        self.phases[phase_name] = self.phases.get(phase_name, 0.0) + seconds
+
+    def summary(self) -> Dict[str, Any]:
+        """Returns the profile without the cProfile statistics, for JSON responses.
+        """
+        return {
+            "id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "started_at": self.started_at,
+            "duration": self.duration,
+            "phases": self.phases,
+            "has_stats": self.stats is not None,
+        }
+
+    def dump_stats(self) -> bytes:
+        """Returns the cProfile statistics in the format of :meth:`pstats.Stats.dump_stats`.
+
+        Raises
+        ------
+        ValueError
+            When the request wasn't run under cProfile.
+        """
+        if self.stats is None:
+            raise ValueError(f"Profile {self.profile_id} has no cProfile statistics")
+        return marshal.dumps(self.stats.stats)  # type: ignore
+
+    def collapsed(self) -> str:
+        """Returns the cProfile statistics as collapsed stacks, one `frame;frame;... microseconds`
+        line per stack, as read by flamegraph.pl and speedscope.
+
+        cProfile only records callers and callees, stacks are rebuilt from them by splitting the
+        time of each function between its callers.
+
+        Raises
+        ------
+        ValueError
+            When the request wasn't run under cProfile.
+        """
+        if self.stats is None:
+            raise ValueError(f"Profile {self.profile_id} has no cProfile statistics")
+        return collapse_stats(self.stats)
+
+
+_CURRENT: ContextVar[Optional[RequestProfile]] = ContextVar(
+    "fx_profile", default=None
+)
+
+
+def current_profile() -> Optional[RequestProfile]:
+    """Returns the profile of the request being handled, None if it isn't profiled.
+    """
+    return _CURRENT.get()
+
+
+class _Phase:
+    # Context manager adding the time spent within it to a phase of `profile`
+    __slots__ = ("_profile", "_name", "_start")
+
+    def __init__(self, profile: Optional[RequestProfile], name: str) -> None:
+        self._profile = profile
+        self._name = name
+        self._start = 0.0
+
+    def __enter__(self) -> None:
+        if self._profile is not None:
+            self._start = time.perf_counter()
+
+    def __exit__(self, *_exc) -> None:
+        if self._profile is not None:
+            self._profile.add(self._name, time.perf_counter() - self._start)
+
+
+# Shared by requests which aren't profiled, it does nothing
+_NO_PHASE = _Phase(None, "")
+
+
+def phase(name: str) -> _Phase:
+    """Returns a context manager timing its block in phase `name` of the current request if it's
+    profiled.
+    """
+    profile = _CURRENT.get()
+    if profile is None:
+        return _NO_PHASE
+    return _Phase(profile, name)
+
+
+def _timed_endpoint(call: Callable) -> Callable:
+    # FastAPI runs coroutine functions in the event loop and others in a thread pool
+    if asyncio.iscoroutinefunction(call):
+
+        @functools.wraps(call)
+        async def timed_async(*args, **kwargs):
+            profile = _CURRENT.get()
+            if profile is None:
+                return await call(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await call(*args, **kwargs)
+            finally:
+                profile.endpoint_end = time.perf_counter()
+                profile.add("endpoint", profile.endpoint_end - start)
+
+        return timed_async
+
+    @functools.wraps(call)
+    def timed(*args, **kwargs):
+        profile = _CURRENT.get()
+        if profile is None:
+            return call(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return call(*args, **kwargs)
+        finally:
+            profile.endpoint_end = time.perf_counter()
+            profile.add("endpoint", profile.endpoint_end - start)
+
+    return timed
+
+
+class ProfiledRoute(APIRoute):
+    """Route timing the `endpoint` and `response` phases of profiled requests.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        # The request handler looks the endpoint up on each call
+        self.dependant.call = _timed_endpoint(self.dependant.call)
+
+
+class Profiler:
+    """Chooses which requests to profile and keeps the last `buffer_size` profiles.
+    """
+
+    def __init__(
+        self,
+        token: Optional[str] = PROFILE_TOKEN,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        buffer_size: int = PROFILE_BUFFER_SIZE,
+    ) -> None:
+        self.token = token
+        self.sample_rate = sample_rate
+        self._profiles: Deque[RequestProfile] = deque(maxlen=buffer_size)
+        self._ids = itertools.count(1)
+        self._profiling = False
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any request may be profiled.
+        """
+        return self.token is not None or self.sample_rate > 0
+
+    def is_admin(self, header: Optional[str]) -> bool:
+        """Returns whether the value of the `X-Fx-Profile` header, decoded as latin-1 like ASGI
+        servers do, is the admin token.
+        """
+        if self.token is None or header is None:
+            return False
+        try:
+            value = header.encode("latin-1")
+        except UnicodeEncodeError:
+            return False
+        # compare_digest only takes ASCII strings, compare the raw bytes instead
+        return hmac.compare_digest(value, self.token.encode())
+
+    def profiles(self) -> List[RequestProfile]:
+        """Returns the kept profiles, most recent first.
+        """
+        return list(reversed(self._profiles))
+
+    def get(self, profile_id: int) -> Optional[RequestProfile]:
+        """Returns the kept profile `profile_id`, None if there's none.
+        """
+        return next((p for p in self._profiles if p.profile_id == profile_id), None)
+
+    def should_profile(self, scope: Scope) -> bool:
+        """Returns whether to profile the request of `scope`.
+        """
+        if scope["path"].startswith("/admin/"):
+            return False
+        if self.token is not None:
+            header = PROFILE_HEADER.lower().encode()
+            for name, value in scope["headers"]:
+                if name == header:
+                    return self.is_admin(value.decode("latin-1"))
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextmanager
+    def profile(self, scope: Scope) -> Iterator[RequestProfile]:
+        """Profiles the request of `scope` within the block and keeps its profile.
+        """
+        profile = RequestProfile(
+            next(self._ids), scope["method"], scope["path"], time.time()
+        )
+        token = _CURRENT.set(profile)
+        profiler = None
+        if not self._profiling:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self._profiling = True
+            except ValueError:
+                # Another profiler is active in this thread
+                profiler = None
+        start = time.perf_counter()
+        try:
+            yield profile
+        finally:
+            profile.duration = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                profile.stats = pstats.Stats(profiler)
+            _CURRENT.reset(token)
+            self._profiles.append(profile)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling requests chosen by `profiler`.
+    """
+
+    def __init__(self, app: ASGIApp, profiler: Profiler) -> None:
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope["type"] != "http"
+            or not self.profiler.enabled
+            or not self.profiler.should_profile(scope)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        with self.profiler.profile(scope) as profile:
+
+            async def send_wrapper(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    profile.status = message["status"]
+                    if profile.endpoint_end is not None:
+                        elapsed = time.perf_counter() - profile.endpoint_end
+                        profile.add("response", elapsed)
+                    message = {
+                        **message,
+                        "headers": [
+                            *message.get("headers", []),
+                            (b"x-fx-profile-id", str(profile.profile_id).encode()),
+                        ],
+                    }
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
+
+
+def _label(func: tuple) -> str:
+    filename, lineno, name = func
+    if filename == "~":
+        # Built-in functions
+        label = name
+    else:
+        label = f"{name} ({os.path.basename(filename)}:{lineno})"
+    return label.replace(";", ",")
+
+
+def collapse_stats(stats: pstats.Stats) -> str:
+    """Returns `stats` as collapsed stacks, see :meth:`RequestProfile.collapsed`.
+    """
+    entries = stats.stats  # type: ignore
+    # func -> [(callee, time in callee itself, total time in callee), ...] when called by func
+    callees: Dict[tuple, List[tuple]] = {func: [] for func in entries}
+    for func, (_cc, _nc, _tt, _ct, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[2], edge[3]))
+
+    samples: Counter[str] = Counter()
+
+    def visit(func: tuple, stack: List[tuple], self_time: float, total: float) -> None:
+        stack = stack + [func]
+        if self_time >= COLLAPSED_MIN_TIME:
+            samples[";".join(_label(f) for f in stack)] += self_time
+        if len(stack) >= COLLAPSED_MAX_DEPTH:
+            return
+        func_total = entries[func][3] if func in entries else 0.0
+        if func_total <= 0:
+            return
+        # Share of the time spent in func which was spent on this stack
+        share = min(1.0, total / func_total)
+        for callee, callee_self, callee_total in callees.get(func, []):
+            if callee not in stack and callee_total * share >= COLLAPSED_MIN_TIME:
+                visit(callee, stack, callee_self * share, callee_total * share)
+
+    for func, (_cc, _nc, tt, ct, callers) in entries.items():
+        if not callers:
+            visit(func, [], tt, ct)
+
+    return "".join(
+        f"{stack} {round(seconds * 1_000_000)}\n"
+        for stack, seconds in sorted(samples.items())
+        if round(seconds * 1_000_000) > 0
+    )
+
+
+PROFILER = Profiler()
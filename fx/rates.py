@@ -2,17 +2,46 @@
 
 By default the application uses dummy fixed values for exchange rates. The fixer.io API can be used
 by setting the environment variable FX_FIXER_TOKEN to your API key (see
-https://fixer.io/documentation).
+https://fixer.io/documentation). FX_RATES_PROVIDERS lists the providers to query, see
+:class:`HedgedRatesApi`.
 """
+# pylint: disable=too-many-lines
 
+import asyncio
+import json
 import logging
 import os
+import random
+import time
 from abc import ABC, abstractmethod
-from dataclasses import dataclass
-from typing import Any, Dict, Iterator, List, Optional
+from array import array
+from collections import deque
+from dataclasses import dataclass, field
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+)
 
 import aiohttp
 
+from fx.metrics import (
+    FIXER_REQUEST_SECONDS,
+    FIXER_REQUESTS,
+    RATES_HEDGED_REQUESTS,
+    RATES_PROVIDER_SECONDS,
+)
+from fx.profiling import phase
+from fx.shared import SHARED_DIR, SHARED_STORE, LeaderLock, SharedStore
+from fx.tasks import BackgroundTask
+
 logger = logging.getLogger(__name__)
 
 
@@ -28,22 +57,155 @@ class ClientException(Exception):
     """
 
 
+class CircuitOpen(ApiException):
+    """The remote API failed too many times in a row and isn't called until its circuit breaker
+    lets a trial request through.
+    """
+
+
 FIXER_TOKEN = os.environ.get("FX_FIXER_TOKEN")
 if FIXER_TOKEN is None:
     logger.warning(
         "FX_FIXER_TOKEN environment variable not set, defaulting to dummy API."
     )
 
+# How long (in seconds) fetched rates are served from memory, and how long before they expire the
+# background task refreshes them.
+RATES_TTL = float(os.environ.get("FX_RATES_TTL", "60"))
+RATES_REFRESH_AHEAD = float(os.environ.get("FX_RATES_REFRESH_AHEAD", "10"))
+
+# Timeouts (in seconds) for connecting to fixer.io and for each read from it, and how many times
+# failed requests are retried.
+FIXER_CONNECT_TIMEOUT = float(os.environ.get("FX_FIXER_CONNECT_TIMEOUT", "2"))
+FIXER_READ_TIMEOUT = float(os.environ.get("FX_FIXER_READ_TIMEOUT", "5"))
+FIXER_RETRIES = int(os.environ.get("FX_FIXER_RETRIES", "2"))
+# Number of consecutive failures opening the circuit breaker in front of fixer.io, and how long (in
+# seconds) it stays open before a trial request is let through.
+FIXER_BREAKER_THRESHOLD = int(os.environ.get("FX_FIXER_BREAKER_THRESHOLD", "5"))
+FIXER_BREAKER_RESET = float(os.environ.get("FX_FIXER_BREAKER_RESET", "30"))
+# Connection pool of the HTTP client calling fixer.io: maximum number of connections, how long (in
+# seconds) idle connections are kept open and DNS lookups are cached, and whether responses are
+# requested gzip-compressed.
+FIXER_POOL_SIZE = int(os.environ.get("FX_FIXER_POOL_SIZE", "10"))
+FIXER_KEEPALIVE = float(os.environ.get("FX_FIXER_KEEPALIVE", "30"))
+FIXER_DNS_TTL = int(os.environ.get("FX_FIXER_DNS_TTL", "300"))
+FIXER_COMPRESSION = os.environ.get("FX_FIXER_COMPRESSION", "1") != "0"
+# Comma-separated providers queried for rates in order of preference, out of fixer, mirror and
+# dummy, and the file or URL the mirror provider reads rates from.
+RATES_PROVIDERS = os.environ.get("FX_RATES_PROVIDERS", "fixer")
+RATES_MIRROR = os.environ.get("FX_RATES_MIRROR")
+# Percentile of a provider's latency after which the next provider is queried as well, and the
+# delay (in seconds) used until enough latencies are known.
+HEDGE_PERCENTILE = float(os.environ.get("FX_HEDGE_PERCENTILE", "95"))
+HEDGE_DELAY = float(os.environ.get("FX_HEDGE_DELAY", "0.5"))
+
 
 def get_rates() -> Iterator["RatesApi"]:
     """Function for dependency injection with :class:`fastapi.Dependency`.
     """
-    # We check for FIXER_TOKEN here instead of at the toplevel because then mypy undertands that
-    # FIXER_TOKEN can't be None when we instantiate FixerApi
-    if FIXER_TOKEN is None:
+    if RATES_STORE is None:
         yield DummyRatesApi()
     else:
-        yield FixerApi(FIXER_TOKEN)
+        yield RATES_STORE
+
+
+class RateMatrix:
+    """Dense matrix of cross rates between `symbols`.
+
+    Rates are stored row-major in an :class:`array.array` where row `i` and column `j` hold the rate
+    from `symbols[i]` to `symbols[j]`, so looking up a pair costs two dict lookups and an array
+    read.
+    """
+
+    __slots__ = ("symbols", "_index", "_data")
+
+    def __init__(self, symbols: List[str], data: "array[float]") -> None:
+        if len(data) != len(symbols) ** 2:
+            raise ValueError(
+                f"Expected {len(symbols) ** 2} rates for {len(symbols)} symbols, "
+                f"got {len(data)}"
+            )
+        self.symbols = symbols
+        self._index = {s: i for i, s in enumerate(symbols)}
+        self._data = data
+
+    @classmethod
+    def from_base_rates(cls, rates: Dict[str, float]) -> "RateMatrix":
+        """Builds the matrix from rates quoted against a common base currency, where the rate from
+        `a` to `b` is `rates[b] / rates[a]`.
+        """
+        symbols = list(rates)
+        values = [rates[s] for s in symbols]
+        return cls(
+            symbols, array("d", (to / from_ for from_ in values for to in values))
+        )
+
+    def _ordinal(self, symbol: str) -> int:
+        try:
+            return self._index[symbol]
+        except KeyError:
+            raise ClientException(f"Unknown symbol {symbol!r}") from None
+
+    def get_rate(self, from_symbol: str, to_symbol: str) -> float:
+        """Returns the exchange rate from `from_symbol` to `to_symbol`.
+
+        Raises
+        ------
+        ClientException
+            When `from_symbol` or `to_symbol` is invalid.
+        """
+        from_ordinal = self._ordinal(from_symbol)
+        return self._data[from_ordinal * len(self.symbols) + self._ordinal(to_symbol)]
+
+    def rows(self, symbols: Optional[List[str]] = None) -> List[List[float]]:
+        """Returns the matrix restricted to `symbols`, or all symbols if `symbols` is None, as a
+        list of rows.
+
+        Raises
+        ------
+        ClientException
+            When any of `symbols` is invalid.
+        """
+        size = len(self.symbols)
+        if symbols is None:
+            return [
+                self._data[i : i + size].tolist() for i in range(0, size * size, size)
+            ]
+        ordinals = [self._ordinal(s) for s in symbols]
+        return [[self._data[i * size + j] for j in ordinals] for i in ordinals]
+
+
+@dataclass(frozen=True)
+class RatesSnapshot:
+    """Exchange rates relative to `base` as published at `timestamp`, along with the cross rates
+    between all of them.
+    """
+
+    base: str
+    timestamp: int
+    rates: Dict[str, float]
+    matrix: RateMatrix = field(repr=False, compare=False)
+
+    @classmethod
+    def from_response(cls, data: Dict[str, Any]) -> "RatesSnapshot":
+        """Builds a snapshot from the body of a fixer.io `latest` response.
+        """
+        return cls(
+            base=data["base"],
+            timestamp=data["timestamp"],
+            rates=data["rates"],
+            matrix=RateMatrix.from_base_rates(data["rates"]),
+        )
+
+    def get_rate(self, from_symbol: str, to_symbol: str) -> float:
+        """Returns the exchange rate from `from_symbol` to `to_symbol` in this snapshot.
+
+        Raises
+        ------
+        ClientException
+            When `from_symbol` or `to_symbol` is invalid.
+        """
+        return self.matrix.get_rate(from_symbol, to_symbol)
 
 
 class RatesApi(ABC):
@@ -67,6 +229,36 @@ class RatesApi(ABC):
         """
         raise NotImplementedError()
 
+    @abstractmethod
+    async def get_snapshot(self) -> RatesSnapshot:
+        """Returns the current rates for all symbols.
+        """
+        raise NotImplementedError()
+
+    async def open(self) -> None:
+        """Acquires the resources needed to make requests, such as HTTP sessions. Must be called
+        from the event loop serving requests.
+        """
+
+    async def close(self) -> None:
+        """Releases the resources acquired by :meth:`open`.
+        """
+
+    def max_age(self) -> int:
+        """Returns for how many seconds the current rates can still be served by HTTP caches.
+        """
+        return 0
+
+    def age(self) -> int:
+        """Returns how many seconds ago the current rates were fetched.
+        """
+        return 0
+
+    def is_stale(self) -> bool:
+        """Returns whether the current rates expired but couldn't be refreshed.
+        """
+        return False
+
 
 class DummyRatesApi(RatesApi):
     """Dummy API with fixed rates defined in `DummyRatesApi.RATES`.
@@ -78,23 +270,155 @@ class DummyRatesApi(RatesApi):
         "USD": 1.00,
     }
 
+    _snapshot: Optional[RatesSnapshot] = None
+
     async def get_symbols(self) -> List[str]:
         return list(self.RATES)
 
     async def get_rate(self, from_symbol: str, to_symbol: str) -> float:
         return self.sync_get_rate(from_symbol, to_symbol)
 
+    async def get_snapshot(self) -> RatesSnapshot:
+        return self.sync_get_snapshot()
+
+    def max_age(self) -> int:
+        return int(RATES_TTL)
+
     @classmethod
     def sync_get_rate(cls, from_symbol: str, to_symbol: str) -> float:
         """Can be used instead of `get_rate` to ease unit testing.
         """
-        if from_symbol not in cls.RATES:
-            raise ClientException(f"Unknown symbol {from_symbol!r}")
-        if to_symbol not in cls.RATES:
-            raise ClientException(f"Unknown symbol {to_symbol!r}")
-        from_rate = cls.RATES[from_symbol]
-        to_rate = cls.RATES[to_symbol]
-        return from_rate / to_rate
+        return cls.sync_get_snapshot().get_rate(from_symbol, to_symbol)
+
+    @classmethod
+    def sync_get_snapshot(cls) -> RatesSnapshot:
+        """Can be used instead of `get_snapshot` to ease unit testing.
+
+        `RATES` are quoted in USD, so the rate from `a` to `b` is `RATES[a] / RATES[b]`.
+        """
+        if cls._snapshot is None:
+            symbols = list(cls.RATES)
+            values = [cls.RATES[s] for s in symbols]
+            cls._snapshot = RatesSnapshot(
+                base="USD",
+                timestamp=0,
+                rates={s: 1 / cls.RATES[s] for s in symbols},
+                matrix=RateMatrix(
+                    symbols,
+                    array("d", (from_ / to for from_ in values for to in values)),
+                ),
+            )
+        return cls._snapshot
+
+
+class CircuitBreaker:
+    """Stops calling a failing service.
+
+    The circuit opens after `threshold` consecutive failures and :meth:`allow` rejects calls for
+    `reset_timeout` seconds. Then a single trial call is allowed every `reset_timeout` seconds until
+    one succeeds and closes the circuit.
+    """
+
+    def __init__(
+        self,
+        threshold: int = FIXER_BREAKER_THRESHOLD,
+        reset_timeout: float = FIXER_BREAKER_RESET,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._threshold = threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._opened_at: Optional[float] = None
+        self.failures = 0
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls are currently being rejected.
+        """
+        return (
+            self._opened_at is not None
+            and self._clock() - self._opened_at < self._reset_timeout
+        )
+
+    def allow(self) -> bool:
+        """Returns whether the service can be called.
+        """
+        if self._opened_at is None:
+            return True
+        if self.is_open:
+            return False
+        # Let a trial call through and keep rejecting others until it's done
+        self._opened_at = self._clock()
+        return True
+
+    def record_success(self) -> None:
+        """Closes the circuit.
+        """
+        self.failures = 0
+        self._opened_at = None
+
+    def record_failure(self) -> None:
+        """Counts a failed call, opening the circuit if there were too many in a row.
+        """
+        self.failures += 1
+        if self.failures >= self._threshold:
+            self._opened_at = self._clock()
+
+
+@dataclass
+class HttpPoolStats:  # pylint: disable=too-many-instance-attributes
+    """Connection pool usage of the HTTP client owned by :class:`FixerApi`.
+
+    `in_flight` counts current requests, including those waiting for a connection, and
+    `max_in_flight` the most concurrent requests seen. `queued` counts requests currently waiting
+    for a free connection, `waits` all requests which had to wait and `wait_seconds` the total time
+    they waited. The pool is too small for the request rate if `waits` keeps growing.
+    """
+
+    limit: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    queued: int = 0
+    waits: int = 0
+    wait_seconds: float = 0.0
+    connections_created: int = 0
+    connections_reused: int = 0
+
+
+def _trace_pool(stats: HttpPoolStats) -> aiohttp.TraceConfig:
+    # pylint: disable=unused-argument
+    trace = aiohttp.TraceConfig()
+
+    async def request_start(session, ctx, params) -> None:
+        stats.in_flight += 1
+        stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+
+    async def request_end(session, ctx, params) -> None:
+        stats.in_flight -= 1
+
+    async def queued_start(session, ctx, params) -> None:
+        ctx.queued_at = time.monotonic()
+        stats.queued += 1
+
+    async def queued_end(session, ctx, params) -> None:
+        stats.queued -= 1
+        stats.waits += 1
+        stats.wait_seconds += time.monotonic() - ctx.queued_at
+
+    async def connection_created(session, ctx, params) -> None:
+        stats.connections_created += 1
+
+    async def connection_reused(session, ctx, params) -> None:
+        stats.connections_reused += 1
+
+    trace.on_request_start.append(request_start)
+    trace.on_request_end.append(request_end)
+    trace.on_request_exception.append(request_end)
+    trace.on_connection_queued_start.append(queued_start)
+    trace.on_connection_queued_end.append(queued_end)
+    trace.on_connection_create_end.append(connection_created)
+    trace.on_connection_reuseconn.append(connection_reused)
+    return trace
 
 
 @dataclass
@@ -107,61 +431,778 @@ class _CachedResponse:
     date: str
 
 
-class FixerApi(RatesApi):
+class FixerApi(RatesApi):  # pylint: disable=too-many-instance-attributes
     """Implementation of :class:`RatesApi` using the fixer.io API.
+
+    The HTTP client session is created by :meth:`open` and closed by :meth:`close`, which must be
+    called from the event loop serving requests. Alternatively the API can be used as an async
+    context manager, or a `session` owned by the caller can be passed instead.
+
+    Requests time out according to `timeout`. Requests failing with network errors, timeouts or
+    HTTP errors are retried up to `retries` times, waiting a random delay up to
+    `RETRY_BACKOFF * 2 ** attempt` seconds between attempts. Failures are counted by `breaker`,
+    which fails requests with :class:`CircuitOpen` without calling fixer.io while it's open.
     """
 
     BASE_URL = "http://data.fixer.io/api/"
-    _session: Optional[aiohttp.ClientSession] = None
+    RETRY_BACKOFF = 0.1
 
-    def __init__(self, access_key: str) -> None:
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        access_key: str,
+        base_url: str = BASE_URL,
+        session: Optional[aiohttp.ClientSession] = None,
+        timeout: Optional[aiohttp.ClientTimeout] = None,
+        retries: int = FIXER_RETRIES,
+        breaker: Optional[CircuitBreaker] = None,
+    ) -> None:
         self._key = access_key
+        self._base_url = base_url
+        self._session = session
+        self._owns_session = False
+        self.pool_stats = HttpPoolStats()
+        self._timeout = timeout or aiohttp.ClientTimeout(
+            sock_connect=FIXER_CONNECT_TIMEOUT, sock_read=FIXER_READ_TIMEOUT
+        )
+        self._retries = retries
+        self.breaker = breaker or CircuitBreaker()
         self._cached_responses: Dict[str, _CachedResponse] = {}
+        self._inflight: Dict[str, "asyncio.Future[Dict[str, Any]]"] = {}
+        self._snapshot: Optional[RatesSnapshot] = None
+        self._snapshot_response: Optional[Dict[str, Any]] = None
 
-    @classmethod
-    def _cached_session(cls) -> aiohttp.ClientSession:
-        if cls._session is None:
-            cls._session = aiohttp.ClientSession()
-        return cls._session
+    async def open(self) -> None:
+        """Creates the HTTP client session, configured by the FX_FIXER_* environment variables.
+        Does nothing if a session was passed to the constructor or is already open.
+        """
+        if self._session is not None:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=FIXER_POOL_SIZE,
+            keepalive_timeout=FIXER_KEEPALIVE,
+            use_dns_cache=True,
+            ttl_dns_cache=FIXER_DNS_TTL,
+        )
+        self.pool_stats = HttpPoolStats(limit=FIXER_POOL_SIZE)
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers={
+                "Accept-Encoding": "gzip, deflate" if FIXER_COMPRESSION else "identity"
+            },
+            trace_configs=[_trace_pool(self.pool_stats)],
+        )
+        self._owns_session = True
+
+    async def close(self) -> None:
+        """Closes the HTTP client session created by :meth:`open`.
+        """
+        if self._owns_session and self._session is not None:
+            await self._session.close()
+            self._session = None
+            self._owns_session = False
+
+    async def __aenter__(self) -> "FixerApi":
+        await self.open()
+        return self
+
+    async def __aexit__(self, *_exc) -> None:
+        await self.close()
 
     async def get_symbols(self) -> List[str]:
         data = await self._get("symbols")
         return list(data["symbols"].keys())
 
     async def get_rate(self, from_symbol: str, to_symbol: str) -> float:
+        snapshot = await self.get_snapshot()
+        return snapshot.get_rate(from_symbol, to_symbol)
+
+    async def get_snapshot(self) -> RatesSnapshot:
+        """Fetches the latest rates from fixer.io.
+        """
         data = await self._get("latest")
-        rates = data["rates"]
-        if from_symbol not in rates:
-            raise ClientException(f"Unknown symbol {from_symbol!r}")
-        if to_symbol not in rates:
-            raise ClientException(f"Unknown symbol {to_symbol!r}")
-        return rates[to_symbol] / rates[from_symbol]
+        # Only build a new snapshot when fixer.io sends new data instead of revalidating the last
+        # response, since computing the cross rates isn't free.
+        if self._snapshot is None or data is not self._snapshot_response:
+            self._snapshot = RatesSnapshot.from_response(data)
+            self._snapshot_response = data
+        return self._snapshot
 
     async def _get(self, endpoint: str) -> Dict[str, Any]:
+        # Concurrent callers share a single in-flight request per endpoint, so a burst of requests
+        # on a cold cache results in only one call to fixer.io.
+        inflight = self._inflight.get(endpoint)
+        if inflight is None:
+            inflight = asyncio.ensure_future(self._fetch(endpoint))
+            self._inflight[endpoint] = inflight
+            inflight.add_done_callback(lambda _: self._inflight.pop(endpoint, None))
+        # Shield the shared request so one caller being cancelled doesn't fail all others
+        with phase("upstream"):
+            return await asyncio.shield(inflight)
+
+    async def _fetch(self, endpoint: str) -> Dict[str, Any]:
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpen(
+                    f"Not calling fixer.io after {self.breaker.failures} failures"
+                )
+            try:
+                data = await self._fetch_once(endpoint)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+                self.breaker.record_failure()
+                if attempt >= self._retries:
+                    raise ApiException(f"Request to fixer.io failed: {exc!r}") from exc
+                backoff = self.RETRY_BACKOFF * 2 ** attempt
+                await asyncio.sleep(random.uniform(0, backoff))
+                attempt += 1
+            except ApiException:
+                self.breaker.record_failure()
+                raise
+            except ClientException:
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_success()
+                return data
+
+    async def _fetch_once(self, endpoint: str) -> Dict[str, Any]:
         headers = {}
         cached = self._cached_responses.get(endpoint)
         if cached:
             headers["If-None-Match"] = cached.etag
             headers["If-Modified-Since"] = cached.date
-        async with self._cached_session().get(
-            f"{self.BASE_URL}{endpoint}",
-            params={"access_key": self._key},
-            headers=headers,
-        ) as resp:
-            # If the content wasn't modified since the lest fetched etag, just resend it
-            if resp.status == 304:
-                assert cached
-                return cached.resp
-
-            data = await resp.json()
-            if data["success"]:
-                if "ETag" in resp.headers and "Date" in resp.headers:
-                    self._cached_responses[endpoint] = _CachedResponse(
-                        resp=data, etag=resp.headers["ETag"], date=resp.headers["Date"],
+        session = self._session
+        if session is None:
+            raise RuntimeError("FixerApi.open() must be called before making requests")
+        start = time.perf_counter()
+        status = "error"
+        try:
+            async with session.get(
+                f"{self._base_url}{endpoint}",
+                params={"access_key": self._key},
+                headers=headers,
+                timeout=self._timeout,
+            ) as resp:
+                status = str(resp.status)
+                # If the content wasn't modified since the lest fetched etag, just resend it
+                if resp.status == 304:
+                    assert cached
+                    return cached.resp
+                resp.raise_for_status()
+
+                data = await resp.json()
+                if data["success"]:
+                    if "ETag" in resp.headers and "Date" in resp.headers:
+                        self._cached_responses[endpoint] = _CachedResponse(
+                            resp=data, etag=resp.headers["ETag"], date=resp.headers["Date"],
+                        )
+                    return data
+                if data["error"]["code"] == 202:
+                    # 202 is the error code for invalid symbols
+                    # See https://fixer.io/documentation
+                    raise ClientException("You have provided invalid symbols")
+                raise ApiException(data["error"])
+        finally:
+            FIXER_REQUESTS.inc((endpoint, status))
+            FIXER_REQUEST_SECONDS.observe(time.perf_counter() - start, (endpoint,))
+
+
+class MirrorRatesApi(RatesApi):
+    """Rates read from a mirror of the fixer.io `latest` endpoint: a JSON file at `source`, or an
+    HTTP(S) URL serving the same document. Symbols are the symbols of the rates.
+
+    The HTTP client session is created by :meth:`open` and closed by :meth:`close`.
+    """
+
+    def __init__(
+        self, source: str, timeout: Optional[aiohttp.ClientTimeout] = None
+    ) -> None:
+        self._source = source
+        self._is_url = source.startswith(("http://", "https://"))
+        self._timeout = timeout or aiohttp.ClientTimeout(
+            sock_connect=FIXER_CONNECT_TIMEOUT, sock_read=FIXER_READ_TIMEOUT
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._snapshot: Optional[RatesSnapshot] = None
+
+    async def open(self) -> None:
+        if self._is_url and self._session is None:
+            self._session = aiohttp.ClientSession()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def get_symbols(self) -> List[str]:
+        snapshot = await self.get_snapshot()
+        return list(snapshot.rates)
+
+    async def get_rate(self, from_symbol: str, to_symbol: str) -> float:
+        snapshot = await self.get_snapshot()
+        return snapshot.get_rate(from_symbol, to_symbol)
+
+    async def get_snapshot(self) -> RatesSnapshot:
+        """Reads the latest rates from the mirror.
+
+        Raises
+        ------
+        ApiException
+            When the mirror can't be read or doesn't hold valid rates.
+        """
+        data = await self._load()
+        try:
+            # Rebuilding the cross rates isn't free, only do it when the mirror changed
+            snapshot = self._snapshot
+            if (
+                snapshot is None
+                or snapshot.timestamp != data["timestamp"]
+                or snapshot.base != data["base"]
+            ):
+                snapshot = self._snapshot = RatesSnapshot.from_response(data)
+            return snapshot
+        except (KeyError, TypeError, ValueError) as exc:
+            raise ApiException(f"Invalid rates in mirror {self._source}") from exc
+
+    async def _load(self) -> Dict[str, Any]:
+        with phase("upstream"):
+            return await self._read()
+
+    async def _read(self) -> Dict[str, Any]:
+        try:
+            if self._is_url:
+                if self._session is None:
+                    raise RuntimeError(
+                        "MirrorRatesApi.open() must be called before making requests"
                     )
-                return data
-            if data["error"]["code"] == 202:
-                # 202 is the error code for invalid symbols
-                # See https://fixer.io/documentation
-                raise ClientException("You have provided invalid symbols")
-            raise ApiException(data["error"])
+                async with self._session.get(
+                    self._source, timeout=self._timeout
+                ) as resp:
+                    resp.raise_for_status()
+                    data = await resp.json(content_type=None)
+            else:
+                loop = asyncio.get_event_loop()
+                data = await loop.run_in_executor(None, self._read_file)
+        except (OSError, ValueError, aiohttp.ClientError) as exc:
+            raise ApiException(f"Failed to read mirror {self._source}: {exc!r}") from exc
+        if not isinstance(data, dict) or not data.get("success", True):
+            raise ApiException(f"Mirror {self._source} returned an error")
+        return data
+
+    def _read_file(self) -> Any:
+        with open(self._source, "rb") as mirror:
+            return json.load(mirror)
+
+
+class ProviderLatency:
+    """Latencies (in seconds) of the last `window` requests to a rates provider.
+    """
+
+    def __init__(self, window: int = 100) -> None:
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, latency: float) -> None:
+        """Records the latency of a request.
+        """
+        self._samples.append(latency)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Returns the `p`-th percentile of the recorded latencies, None if there are none.
+        """
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+
+T = TypeVar("T")
+
+
+class HedgedRatesApi(RatesApi):
+    """Queries several rates `providers` and returns the first answer.
+
+    Providers are ranked by their median latency, unranked providers keeping the order of
+    `providers`. Requests go to the best ranked provider first. If it hasn't answered after the
+    `hedge_percentile`-th percentile of its latency (`initial_delay` until `min_samples` latencies
+    are known) or if it fails, the request is also sent to the next provider, and so on. The first
+    successful answer is returned and the other requests are cancelled.
+
+    Failed requests are counted as taking at least `FAILURE_LATENCY` seconds and cancelled ones as
+    taking as long as they ran, so slow or failing providers drop in the ranking.
+    """
+
+    FAILURE_LATENCY = 10.0
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        providers: Dict[str, RatesApi],
+        hedge_percentile: float = HEDGE_PERCENTILE,
+        initial_delay: float = HEDGE_DELAY,
+        min_samples: int = 10,
+        window: int = 100,
+    ) -> None:
+        if not providers:
+            raise ValueError("At least one rates provider is required")
+        self._providers = dict(providers)
+        self._hedge_percentile = hedge_percentile
+        self._initial_delay = initial_delay
+        self._min_samples = min_samples
+        self.latencies = {name: ProviderLatency(window) for name in providers}
+        self.hedged = 0
+
+    async def open(self) -> None:
+        for provider in self._providers.values():
+            await provider.open()
+
+    async def close(self) -> None:
+        for provider in self._providers.values():
+            await provider.close()
+
+    def ranking(self) -> List[str]:
+        """Returns the names of the providers in the order they're queried.
+        """
+
+        def median(name: str) -> float:
+            latency = self.latencies[name].percentile(50)
+            return float("inf") if latency is None else latency
+
+        return sorted(self._providers, key=median)
+
+    async def get_symbols(self) -> List[str]:
+        return await self._hedge(lambda provider: provider.get_symbols())
+
+    async def get_rate(self, from_symbol: str, to_symbol: str) -> float:
+        snapshot = await self.get_snapshot()
+        return snapshot.get_rate(from_symbol, to_symbol)
+
+    async def get_snapshot(self) -> RatesSnapshot:
+        return await self._hedge(lambda provider: provider.get_snapshot())
+
+    def _hedge_delay(self, name: str) -> float:
+        latency = self.latencies[name]
+        if len(latency) < self._min_samples:
+            return self._initial_delay
+        return latency.percentile(self._hedge_percentile) or 0.0
+
+    async def _hedge(self, call: Callable[[RatesApi], Awaitable[T]]) -> T:
+        loop = asyncio.get_event_loop()
+        queued = self.ranking()
+        # Requests in flight, with the name of their provider and when they were sent
+        pending: Dict["asyncio.Future[T]", Tuple[str, float]] = {}
+        errors: List[str] = []
+
+        def send() -> str:
+            name = queued.pop(0)
+            task = asyncio.ensure_future(call(self._providers[name]))
+            pending[task] = (name, loop.time())
+            return name
+
+        last = send()
+        try:
+            while pending:
+                timeout = self._hedge_delay(last) if queued else None
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    self.hedged += 1
+                    RATES_HEDGED_REQUESTS.inc()
+                    last = send()
+                    continue
+                for task in done:
+                    name, sent_at = pending.pop(task)
+                    elapsed = loop.time() - sent_at
+                    exc = task.exception()
+                    if exc is None:
+                        self._record(name, elapsed, "ok")
+                        return task.result()
+                    self._record(name, max(elapsed, self.FAILURE_LATENCY), "error")
+                    RATES_PROVIDER_SECONDS.observe(elapsed, (name, "error"))
+                    logger.warning("Rates provider %s failed: %r", name, exc)
+                    errors.append(f"{name}: {exc!r}")
+                if queued:
+                    last = send()
+            raise ApiException(f"All rates providers failed: {'; '.join(errors)}")
+        finally:
+            for task, (name, sent_at) in pending.items():
+                task.cancel()
+                self._record(name, loop.time() - sent_at, "cancelled")
+
+    def _record(self, name: str, latency: float, result: str) -> None:
+        self.latencies[name].record(latency)
+        if result != "error":
+            RATES_PROVIDER_SECONDS.observe(latency, (name, result))
+
+
+@dataclass
+class RatesStoreStats:
+    """Counters reported by :class:`RatesStore`.
+
+    `hits` and `misses` count lookups served from memory and lookups which had to wait on fixer.io,
+    `refreshes` counts successful fetches and `errors` failed background refreshes. `stale` counts
+    lookups served expired rates because fixer.io failed.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    refreshes: int = 0
+    errors: int = 0
+    stale: int = 0
+
+
+@dataclass
+class _StoreEntry:
+    """Rates and symbols fetched by :class:`RatesStore` at `fetched_at`, held until `expires_at`.
+    """
+
+    snapshot: RatesSnapshot
+    symbols: List[str]
+    fetched_at: float
+    expires_at: float
+
+
+class RatesStore(RatesApi):  # pylint: disable=too-many-instance-attributes
+    """Process-wide in-memory cache in front of a :class:`RatesApi` calling fixer.io or other
+    providers.
+
+    Fetched rates and symbols are served from memory for `ttl` seconds. Once :meth:`start` is
+    called, a background task refreshes them `refresh_ahead` seconds before they expire, so
+    requests don't wait on fixer.io unless the cache is cold or the refresh keeps failing.
+    Refreshes go through the same :class:`FixerApi` instance, so they're revalidated with its
+    cached `ETag` and `Date`.
+
+    Expired rates keep being served if they can't be refreshed, :meth:`is_stale` tells when that's
+    the case. Concurrent cache misses and the background refresh share a single in-flight refresh,
+    so the API is called once however many requests are waiting.
+
+    Functions registered with :meth:`add_listener` are called with each new snapshot.
+    """
+
+    RETRY_DELAY = 1.0
+
+    def __init__(
+        self,
+        api: RatesApi,
+        ttl: float = RATES_TTL,
+        refresh_ahead: float = RATES_REFRESH_AHEAD,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._api = api
+        self._ttl = ttl
+        self._refresh_ahead = min(refresh_ahead, ttl)
+        self._clock = clock
+        self._entry: Optional[_StoreEntry] = None
+        self._inflight: Optional["asyncio.Future[_StoreEntry]"] = None
+        self._task = BackgroundTask()
+        # Listeners and whether they're called by all workers, see SharedRatesStore
+        self._listeners: List[Tuple[Callable[[RatesSnapshot], None], bool]] = []
+        self.stats = RatesStoreStats()
+
+    async def get_symbols(self) -> List[str]:
+        entry = await self._get_entry()
+        return list(entry.symbols)
+
+    async def get_rate(self, from_symbol: str, to_symbol: str) -> float:
+        snapshot = await self.get_snapshot()
+        return snapshot.get_rate(from_symbol, to_symbol)
+
+    async def get_snapshot(self) -> RatesSnapshot:
+        """Returns the cached snapshot, fetching it if it's missing or expired.
+        """
+        entry = await self._get_entry()
+        return entry.snapshot
+
+    def max_age(self) -> int:
+        entry = self._entry
+        if entry is None:
+            return 0
+        return max(int(entry.expires_at - self._clock()), 0)
+
+    def age(self) -> int:
+        entry = self._entry
+        if entry is None:
+            return 0
+        return int(self._clock() - entry.fetched_at)
+
+    def is_stale(self) -> bool:
+        entry = self._entry
+        return entry is not None and self._clock() >= entry.expires_at
+
+    async def refresh(self) -> None:
+        """Fetches rates and symbols from fixer.io regardless of the cached entry's age.
+        """
+        await self._refresh()
+
+    def add_listener(
+        self, listener: Callable[[RatesSnapshot], None], all_workers: bool = True
+    ) -> None:
+        """Calls `listener` whenever a snapshot with a new timestamp is fetched. Listeners are
+        called from the event loop, so they must not block.
+
+        When workers share rates through a :class:`SharedRatesStore`, listeners with `all_workers`
+        set to False are only called by the worker fetching rates from fixer.io.
+        """
+        self._listeners.append((listener, all_workers))
+
+    def start(self) -> None:
+        """Starts refreshing the cache in the background. Must be called from a running event loop.
+        """
+        self._task.start(self._refresh_loop)
+
+    async def stop(self) -> None:
+        """Stops the background refresh task started by :meth:`start`.
+        """
+        await self._task.stop()
+
+    async def _get_entry(self) -> _StoreEntry:
+        entry = self._entry
+        if entry is not None and self._clock() < entry.expires_at:
+            self.stats.hits += 1
+            return entry
+        self.stats.misses += 1
+        try:
+            return await self._refresh()
+        except (ApiException, aiohttp.ClientError, asyncio.TimeoutError):
+            if entry is None:
+                raise
+            self.stats.stale += 1
+            logger.warning(
+                "Failed to refresh exchange rates, serving rates fetched %.0fs ago",
+                self._clock() - entry.fetched_at,
+                exc_info=True,
+            )
+            return entry
+
+    async def _refresh(self) -> _StoreEntry:
+        inflight = self._inflight
+        if inflight is None:
+            inflight = self._inflight = asyncio.ensure_future(self._fetch_entry())
+            inflight.add_done_callback(self._refreshed)
+        # Shield the shared refresh so one caller being cancelled doesn't fail all others
+        return await asyncio.shield(inflight)
+
+    def _refreshed(self, inflight: "asyncio.Future[_StoreEntry]") -> None:
+        if self._inflight is inflight:
+            self._inflight = None
+        if not inflight.cancelled():
+            # Retrieve the error in case every caller was cancelled, waiting callers still get it
+            inflight.exception()
+
+    async def _fetch_entry(self) -> _StoreEntry:
+        calls = [
+            asyncio.ensure_future(self._api.get_snapshot()),
+            asyncio.ensure_future(self._api.get_symbols()),
+        ]
+        try:
+            snapshot, symbols = await asyncio.gather(*calls)
+        except BaseException:
+            # gather leaves the other call running when one fails
+            for call in calls:
+                call.cancel()
+            raise
+        previous = self._entry
+        now = self._clock()
+        entry = self._entry = _StoreEntry(
+            snapshot=snapshot,
+            symbols=symbols,
+            fetched_at=now,
+            expires_at=now + self._ttl,
+        )
+        self.stats.refreshes += 1
+        logger.debug("Refreshed exchange rates: %s", self.stats)
+        if previous is None or previous.snapshot.timestamp != snapshot.timestamp:
+            self._notify(snapshot, leader=True)
+        return entry
+
+    def _notify(self, snapshot: RatesSnapshot, leader: bool) -> None:
+        for listener, all_workers in self._listeners:
+            if not (leader or all_workers):
+                continue
+            try:
+                listener(snapshot)
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Rates listener %r failed", listener)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            entry = self._entry
+            if entry is not None:
+                delay = entry.expires_at - self._refresh_ahead - self._clock()
+                await asyncio.sleep(max(delay, 0))
+            try:
+                await self._refresh()
+            except Exception:  # pylint: disable=broad-except
+                self.stats.errors += 1
+                logger.exception("Failed to refresh exchange rates")
+                await asyncio.sleep(self.RETRY_DELAY)
+
+
+class SharedRatesStore(RatesStore):
+    """:class:`RatesStore` sharing rates with the other workers of the server through `store`.
+
+    Only the worker holding `leader` fetches rates from fixer.io and publishes them to `store`.
+    The other workers serve the published rates and keep trying to acquire `leader` every
+    `FOLLOW_INTERVAL` seconds, so a new leader takes over when the current one exits. Listeners
+    are called by every worker when it sees a new snapshot, except those registered with
+    `all_workers` set to False, which are only called by the leader.
+    """
+
+    FOLLOW_INTERVAL = 1.0
+    # How long (in seconds) a request waits for the leader to publish the first rates
+    COLD_START_TIMEOUT = 10.0
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        api: RatesApi,
+        store: SharedStore,
+        leader: LeaderLock,
+        ttl: float = RATES_TTL,
+        refresh_ahead: float = RATES_REFRESH_AHEAD,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        super().__init__(api, ttl, refresh_ahead, clock)
+        self._store = store
+        self._leader = leader
+        self._published: Optional[bytes] = None
+
+    @property
+    def is_leader(self) -> bool:
+        """Whether this worker fetches rates from fixer.io.
+        """
+        return self._leader.is_leader
+
+    async def refresh(self) -> None:
+        if self._leader.acquire():
+            await self._refresh()
+        else:
+            self._follow()
+
+    async def stop(self) -> None:
+        """Stops the background task started by :meth:`start` and gives up leadership, letting
+        another worker take over.
+        """
+        await super().stop()
+        self._leader.release()
+
+    async def _get_entry(self) -> _StoreEntry:
+        if self._leader.is_leader:
+            return await super()._get_entry()
+        entry = self._follow()
+        if entry is None:
+            entry = await self._wait_for_leader()
+        if self._clock() < entry.expires_at:
+            self.stats.hits += 1
+        else:
+            self.stats.stale += 1
+        return entry
+
+    async def _wait_for_leader(self) -> _StoreEntry:
+        deadline = self._clock() + self.COLD_START_TIMEOUT
+        while self._clock() < deadline:
+            if self._leader.acquire():
+                self.stats.misses += 1
+                return await self._refresh()
+            await asyncio.sleep(0.05)
+            entry = self._follow()
+            if entry is not None:
+                return entry
+        raise ApiException("No exchange rates were published by the leader worker")
+
+    async def _fetch_entry(self) -> _StoreEntry:
+        entry = await super()._fetch_entry()
+        self._publish(entry)
+        return entry
+
+    def _publish(self, entry: _StoreEntry) -> None:
+        # Monotonic clocks are shared by all processes of the host, so times can be compared
+        data = json.dumps(
+            {
+                "base": entry.snapshot.base,
+                "timestamp": entry.snapshot.timestamp,
+                "rates": entry.snapshot.rates,
+                "symbols": entry.symbols,
+                "fetched_at": entry.fetched_at,
+                "expires_at": entry.expires_at,
+            }
+        ).encode()
+        self._store.set("rates", data)
+        self._published = self._store.get("rates")
+
+    def _follow(self) -> Optional[_StoreEntry]:
+        # Loads the rates published by the leader if they changed since they were last loaded
+        published = self._store.get("rates")
+        if published is None or published is self._published:
+            return self._entry
+        data = json.loads(published)
+        previous = self._entry
+        if previous is not None and previous.snapshot.timestamp == data["timestamp"]:
+            snapshot = previous.snapshot
+        else:
+            snapshot = RatesSnapshot.from_response(data)
+        self._entry = _StoreEntry(
+            snapshot=snapshot,
+            symbols=data["symbols"],
+            fetched_at=data["fetched_at"],
+            expires_at=data["expires_at"],
+        )
+        self._published = published
+        if snapshot is not getattr(previous, "snapshot", None):
+            self._notify(snapshot, leader=False)
+        return self._entry
+
+    async def _refresh_loop(self) -> None:
+        while not self._leader.acquire():
+            self._follow()
+            await asyncio.sleep(self.FOLLOW_INTERVAL)
+        logger.info("Worker %d is now refreshing exchange rates", os.getpid())
+        await super()._refresh_loop()
+
+
+FIXER_API: Optional[FixerApi] = (
+    None
+    if FIXER_TOKEN is None
+    else FixerApi(FIXER_TOKEN, os.environ.get("FX_FIXER_URL", FixerApi.BASE_URL))
+)
+
+
+def _providers() -> Dict[str, RatesApi]:
+    providers: Dict[str, RatesApi] = {}
+    for name in RATES_PROVIDERS.split(","):
+        name = name.strip()
+        if name == "fixer":
+            if FIXER_API is not None:
+                providers[name] = FIXER_API
+        elif name == "mirror":
+            if RATES_MIRROR is None:
+                logger.warning("FX_RATES_MIRROR not set, not using the mirror provider")
+            else:
+                providers[name] = MirrorRatesApi(RATES_MIRROR)
+        elif name == "dummy":
+            providers[name] = DummyRatesApi()
+        elif name:
+            raise ValueError(f"Unknown rates provider {name!r} in FX_RATES_PROVIDERS")
+    return providers
+
+
+_PROVIDERS = _providers()
+# API the shared rates cache fetches rates from, None if no provider is configured
+RATES_API: Optional[RatesApi]
+if not _PROVIDERS:
+    RATES_API = None
+elif len(_PROVIDERS) == 1:
+    RATES_API = next(iter(_PROVIDERS.values()))
+else:
+    RATES_API = HedgedRatesApi(_PROVIDERS)
+RATES_STORE: Optional[RatesStore]
+if RATES_API is None:
+    RATES_STORE = None
+elif SHARED_DIR is None:
+    RATES_STORE = RatesStore(RATES_API)
+else:
+    RATES_STORE = SharedRatesStore(
+        RATES_API, SHARED_STORE, LeaderLock(os.path.join(SHARED_DIR, "leader.lock"))
+    )
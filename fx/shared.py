@@ -0,0 +1,186 @@
+"""State shared between the worker processes of a server.
+
+By default the server is expected to run a single worker and state lives in memory. To run several
+workers (e.g. ``uvicorn fx:app --workers 4``), set FX_SHARED_DIR to a directory shared by the
+workers, preferably on a memory-backed filesystem such as ``/dev/shm/fx``. Workers then share
+state through small files in that directory, and one of them is elected to refresh exchange rates
+by locking a file (see :class:`LeaderLock`).
+"""
+import fcntl
+import os
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, ContextManager, Dict, Iterator, Optional, Tuple
+
+SHARED_DIR = os.environ.get("FX_SHARED_DIR")
+
+
+class SharedStore(ABC):
+    """Key-value store of small byte strings.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        """Returns the value of `key`, or None if it isn't set.
+
+        The same object is returned as long as the value doesn't change, so callers can cache
+        data derived from it by identity.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def set(self, key: str, value: bytes) -> None:
+        """Sets the value of `key`.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def update(self, key: str, func: Callable[[Optional[bytes]], bytes]) -> bytes:
+        """Atomically sets the value of `key` to `func(value)` and returns it.
+        """
+        raise NotImplementedError()
+
+    @abstractmethod
+    def lock(self, name: str) -> ContextManager[None]:
+        """Returns a context manager holding the lock `name`, excluding all other users of the
+        store while it's active.
+        """
+        raise NotImplementedError()
+
+
+class LocalStore(SharedStore):
+    """In-process store, for servers running a single worker.
+    """
+
+    def __init__(self) -> None:
+        self._values: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self._values.get(key)
+
+    def set(self, key: str, value: bytes) -> None:
+        with self._lock:
+            self._values[key] = value
+
+    def update(self, key: str, func: Callable[[Optional[bytes]], bytes]) -> bytes:
+        with self._lock:
+            value = self._values[key] = func(self._values.get(key))
+            return value
+
+    @contextmanager
+    def lock(self, name: str) -> Iterator[None]:
+        with self._lock:
+            yield
+
+
+class FileStore(SharedStore):
+    """Store keeping each value in a file of `directory`, shared by all processes using it.
+
+    Values are replaced atomically, so readers never see partial writes. Reads are cached until the
+    file changes, so reading an unchanged value only costs a `stat` call.
+    """
+
+    def __init__(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        # Per key: (inode, mtime, size) of the file when it was read, and its contents
+        self._cache: Dict[str, Tuple[Tuple[int, int, int], bytes]] = {}
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        # The inode changes whenever the value is replaced
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+                version = _file_version(f.fileno())
+        except FileNotFoundError:
+            return None
+        self._cache[key] = (version, value)
+        return value
+
+    def set(self, key: str, value: bytes) -> None:
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(value)
+        os.replace(tmp_path, path)
+
+    def update(self, key: str, func: Callable[[Optional[bytes]], bytes]) -> bytes:
+        with self.lock(key):
+            value = func(self.get(key))
+            self.set(key, value)
+            return value
+
+    @contextmanager
+    def lock(self, name: str) -> Iterator[None]:
+        with open(f"{self._path(name)}.lock", "wb") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+
+def _file_version(fd: int) -> Tuple[int, int, int]:
+    stat = os.fstat(fd)
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+class LeaderLock:
+    """Elects a single leader among the processes using the lock file `path`.
+
+    The leader is the process holding an exclusive lock on the file. The lock is released by the
+    operating system when the leader exits, so another process can take over by calling
+    :meth:`acquire`.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def is_leader(self) -> bool:
+        """Whether this process holds the lock.
+        """
+        return self._fd is not None
+
+    def acquire(self) -> bool:
+        """Tries to become the leader without blocking, returns whether this process is the
+        leader.
+        """
+        if self._fd is not None:
+            return True
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self) -> None:
+        """Gives up leadership.
+        """
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+
+
+SHARED_STORE: SharedStore = (
+    LocalStore() if SHARED_DIR is None else FileStore(SHARED_DIR)
+)
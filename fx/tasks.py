@@ -0,0 +1,46 @@
+"""Background tasks started and stopped with the application.
+"""
+import asyncio
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Optional
+
+
+class BackgroundTask:
+    """Runs a coroutine in the background of the event loop until :meth:`stop` is called.
+
+    Services owning a background task start it from their own `start` method and stop it from
+    their `stop` method, the task is started at most once at a time.
+    """
+
+    def __init__(self) -> None:
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def running(self) -> bool:
+        """Whether the task was started and neither stopped nor finished since.
+        """
+        return self._task is not None and not self._task.done()
+
+    def start(self, func: Callable[..., Awaitable[Any]], *args: Any) -> bool:
+        """Runs `func(*args)` in a task unless one is already running. Must be called from a
+        running event loop.
+
+        Returns whether the task was started.
+        """
+        if self.running:
+            return False
+        self._task = asyncio.ensure_future(func(*args))
+        return True
+
+    async def stop(self) -> bool:
+        """Cancels the task started by :meth:`start` and waits for it to finish.
+
+        Returns whether a task was started and not stopped since, even if it finished.
+        """
+        if self._task is None:
+            return False
+        task, self._task = self._task, None
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+        return True
@@ -0,0 +1,158 @@
+"""Group commit of trades booked by POST /trades.
+
+Each commit waits for the database to flush it to disk, and SQLite only lets one transaction write
+at a time, so committing every booked trade on its own caps bookings per second. Once started,
+:data:`TRADE_WRITER` queues trades from concurrent requests and commits them in groups, a single
+transaction per group through a session of its own. Requests still only get their response once
+their trade is committed.
+
+A group holds the trades queued while the previous group was being committed, plus those arriving
+within FX_GROUP_COMMIT_WINDOW seconds (0 by default) of its first trade, up to FX_GROUP_COMMIT_SIZE
+trades (500 by default). Setting FX_GROUP_COMMIT_SIZE to 1 disables grouping.
+"""
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import Session
+
+from fx.database import SessionLocal, Trade, run_db
+from fx.positions import apply_trades
+from fx.tasks import BackgroundTask
+
+logger = logging.getLogger(__name__)
+
+GROUP_COMMIT_WINDOW = float(os.environ.get("FX_GROUP_COMMIT_WINDOW", "0"))
+GROUP_COMMIT_SIZE = int(os.environ.get("FX_GROUP_COMMIT_SIZE", "500"))
+
+# Values of the columns of a trade
+TradeRow = Dict[str, Any]
+# A trade and the future resolved once it's committed
+_Pending = Tuple[TradeRow, "asyncio.Future[None]"]
+
+_TRADES = inspect(Trade).local_table
+
+
+def insert_trades(db: Session, rows: List[TradeRow]) -> None:
+    """Inserts `rows` into trades, updates positions and commits, all in one transaction.
+    """
+    try:
+        # Passing a list of parameters makes SQLAlchemy use executemany
+        db.execute(_TRADES.insert(), rows)
+        apply_trades(
+            db,
+            ((r["sell_ccy"], r["sell_amount"], r["buy_ccy"], r["rate"]) for r in rows),
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+
+class TradeWriter:
+    """Commits trades passed to :meth:`book` in groups, see the module documentation.
+
+    Each group is committed through a new session from `session_factory`, closed once the group
+    is committed. If a group fails, its trades are retried one by one so a single failing trade
+    doesn't fail the others. `groups` and `trades` count the committed groups and the trades they
+    held.
+    """
+
+    def __init__(
+        self,
+        window: float = GROUP_COMMIT_WINDOW,
+        max_size: int = GROUP_COMMIT_SIZE,
+        session_factory: Callable[[], Session] = SessionLocal,
+    ) -> None:
+        self._window = window
+        self._max_size = max_size
+        self._session_factory = session_factory
+        self._queue: Optional["asyncio.Queue[_Pending]"] = None
+        self._task = BackgroundTask()
+        self.groups = 0
+        self.trades = 0
+
+    async def book(self, db: Session, row: TradeRow) -> None:
+        """Inserts the trade `row`, returning once it's committed.
+
+        Trades are committed right away through `db` if the writer isn't running, otherwise `db`
+        isn't used.
+        """
+        if self._queue is None:
+            await run_db(insert_trades, db, [row])
+            return
+        future = asyncio.get_event_loop().create_future()
+        self._queue.put_nowait((row, future))
+        await future
+
+    def start(self) -> None:
+        """Starts committing trades in groups. Must be called from a running event loop.
+        """
+        if not self._task.running and self._max_size > 1:
+            self._queue = asyncio.Queue()
+            self._task.start(self._run, self._queue)
+
+    async def stop(self) -> None:
+        """Waits for queued trades to be committed and stops the task started by :meth:`start`.
+        """
+        if self._queue is not None:
+            queue, self._queue = self._queue, None
+            await queue.join()
+            await self._task.stop()
+
+    async def _run(self, queue: "asyncio.Queue[_Pending]") -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            group = [await queue.get()]
+            deadline = loop.time() + self._window
+            while len(group) < self._max_size:
+                if not queue.empty():
+                    group.append(queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    group.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self._commit(group)
+            finally:
+                for _ in group:
+                    queue.task_done()
+
+    async def _commit(self, group: List[_Pending]) -> None:
+        try:
+            await run_db(self._insert, [row for row, _ in group])
+        except Exception as exc:  # pylint: disable=broad-except
+            if len(group) == 1:
+                if not group[0][1].done():
+                    group[0][1].set_exception(exc)
+                return
+            logger.warning(
+                "Failed to commit a group of %d trades, committing them one by one",
+                len(group),
+                exc_info=True,
+            )
+            for pending in group:
+                await self._commit([pending])
+            return
+        self.groups += 1
+        self.trades += len(group)
+        for _, future in group:
+            # The request may have been cancelled, its trade is booked anyway
+            if not future.done():
+                future.set_result(None)
+
+    def _insert(self, rows: List[TradeRow]) -> None:
+        db = self._session_factory()
+        try:
+            insert_trades(db, rows)
+        finally:
+            db.close()
+
+
+TRADE_WRITER = TradeWriter()
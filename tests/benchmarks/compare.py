@@ -0,0 +1,31 @@
+"""Compares two benchmark results files recorded with FX_BENCHMARK_RESULTS.
+
+Usage: ``python -m tests.benchmarks.compare BASELINE.json RESULTS.json``
+"""
+import json
+import sys
+from typing import List, Optional
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Prints every metric found in both files, with its relative change.
+    """
+    args = sys.argv[1:] if argv is None else argv
+    if len(args) != 2:
+        print(__doc__.strip(), file=sys.stderr)
+        return 2
+    with open(args[0]) as baseline_file, open(args[1]) as results_file:
+        baseline, results = json.load(baseline_file), json.load(results_file)
+    print(f"{baseline['commit'][:10]} -> {results['commit'][:10]}")
+    for name, metrics in sorted(results["benchmarks"].items()):
+        for metric, value in sorted(metrics.items()):
+            before = baseline["benchmarks"].get(name, {}).get(metric)
+            if before is None:
+                continue
+            change = (value - before) / before * 100 if before else 0.0
+            print(f"{name}.{metric}: {before:.6g} -> {value:.6g} ({change:+.1f}%)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
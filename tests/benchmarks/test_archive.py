@@ -0,0 +1,89 @@
+"""Measures recent-trade queries on a table holding years of history, before and after archiving
+all but the last months, and how long archiving takes.
+
+The table is seeded with FX_BENCHMARK_TRADES trades (500000 by default) spread over three years.
+"""
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict
+
+from sqlalchemy.orm import sessionmaker
+
+from fx import TradeFilter, _query_trades
+from fx.database import TRADE_COLUMNS, Trade
+from fx.partitions import archive_trades
+from tests.benchmarks.utils import benchmark, percentile, report, sqlite_engine
+
+TRADES = int(os.environ.get("FX_BENCHMARK_TRADES", "500000"))
+START = datetime(2017, 1, 1)
+END = datetime(2020, 1, 1)
+KEEP_FROM = datetime(2019, 10, 1)
+
+
+def _seed(engine) -> None:
+    step = (END - START) / TRADES
+    for offset in range(0, TRADES, 50_000):
+        engine.execute(
+            Trade.__table__.insert(),
+            [
+                {
+                    "trade_id": f"TR{i:026d}",
+                    "sell_ccy": ("EUR", "USD", "GBP")[i % 3],
+                    "sell_amount": 100 + i % 1000,
+                    "buy_ccy": ("USD", "GBP", "EUR")[i % 3],
+                    "rate": 1.1,
+                    "timestamp": START + step * i,
+                }
+                for i in range(offset, min(offset + 50_000, TRADES))
+            ],
+        )
+
+
+def _time(query: Callable[[], object], repeat: int = 200) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        query()
+        timings.append(time.perf_counter() - start)
+    return percentile(timings, 50) * 1000
+
+
+def _recent_queries(db) -> Dict[str, float]:
+    eur = TradeFilter(sell_ccy="EUR", buy_ccy=None, since=None, until=None)
+    last_week = TradeFilter(
+        sell_ccy=None, buy_ccy=None, since=END - timedelta(days=7), until=None
+    )
+    return {
+        "first_page_ms": _time(lambda: _query_trades(db, eur, None, 100)),
+        "last_week_ms": _time(
+            lambda: last_week.apply(db.query(*TRADE_COLUMNS)).all(), repeat=20
+        ),
+    }
+
+
+@benchmark
+def test_archive(tmp_path) -> None:
+    engine = sqlite_engine(str(tmp_path / "fx.db"))
+    _seed(engine)
+    db = sessionmaker(bind=engine)()
+    try:
+        before = _recent_queries(db)
+        start = time.perf_counter()
+        months = archive_trades(db, KEEP_FROM, str(tmp_path / "archive"))
+        elapsed = time.perf_counter() - start
+        after = _recent_queries(db)
+        remaining = db.query(Trade).count()
+    finally:
+        db.close()
+
+    report(
+        "archive",
+        trades=TRADES,
+        archived_months=len(months),
+        archive_seconds=elapsed,
+        remaining_trades=remaining,
+        **{f"before_{k}": v for k, v in before.items()},
+        **{f"after_{k}": v for k, v in after.items()},
+    )
+    assert len(months) == 33
@@ -0,0 +1,52 @@
+"""Compares booking throughput of POST /trades and POST /trades/batch.
+"""
+import asyncio
+import time
+
+import aiohttp
+
+from tests.benchmarks.utils import benchmark, report, serve, sqlite_engine, use_database
+
+TRADES = 5000
+CLIENTS = 20
+BATCH_SIZE = 1000
+
+TRADE = {"sell_ccy": "BRL", "sell_amount": 100, "buy_ccy": "GBP", "rate": 1.0}
+
+
+async def _book_single(url: str) -> None:
+    queue: asyncio.Queue = asyncio.Queue()
+    for _ in range(TRADES):
+        queue.put_nowait(TRADE)
+
+    async def client(session: aiohttp.ClientSession) -> None:
+        while not queue.empty():
+            async with session.post(f"{url}/trades", json=queue.get_nowait()) as resp:
+                assert resp.status == 200
+
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(client(session) for _ in range(CLIENTS)))
+
+
+async def _book_batches(url: str) -> None:
+    async with aiohttp.ClientSession() as session:
+        for _ in range(TRADES // BATCH_SIZE):
+            async with session.post(
+                f"{url}/trades/batch", json={"trades": [TRADE] * BATCH_SIZE}
+            ) as resp:
+                assert resp.status == 200
+                results = (await resp.json())["results"]
+                assert all(r["trade"] is not None for r in results)
+
+
+@benchmark
+def test_batch_throughput(tmp_path) -> None:
+    engine = sqlite_engine(str(tmp_path / "fx.db"))
+    throughput = {}
+    with use_database(engine), serve() as url:
+        for name, book in (("single", _book_single), ("batch", _book_batches)):
+            start = time.perf_counter()
+            asyncio.run(book(url))
+            throughput[name] = TRADES / (time.perf_counter() - start)
+            report(f"batch.{name}", trades_per_s=throughput[name])
+    assert throughput["batch"] > throughput["single"]
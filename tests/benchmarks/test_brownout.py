@@ -0,0 +1,67 @@
+"""Measures rates lookup latency while fixer.io is slow or failing.
+
+Rates expire every 100ms, so most lookups have to refresh them. Lookups must stay fast once the
+circuit breaker opens and the last fetched rates are served.
+"""
+import asyncio
+import time
+from dataclasses import asdict
+from typing import Tuple
+
+import aiohttp
+
+from fx.rates import CircuitBreaker, FixerApi, RatesStore, RatesStoreStats
+from tests.benchmarks.utils import benchmark, percentile, report
+from tests.fake_fixer import FakeFixer
+
+LOOKUPS = 2000
+CONCURRENCY = 50
+
+
+async def _lookups(store: RatesStore) -> list:
+    latencies: list = []
+
+    async def client() -> None:
+        for _ in range(LOOKUPS // CONCURRENCY):
+            start = time.perf_counter()
+            await store.get_rate("USD", "GBP")
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.005)
+
+    await asyncio.gather(*(client() for _ in range(CONCURRENCY)))
+    return latencies
+
+
+async def _run() -> Tuple[dict, RatesStoreStats]:
+    results = {}
+    async with FakeFixer() as fixer, aiohttp.ClientSession() as session:
+        api = FixerApi(
+            "token",
+            base_url=fixer.url,
+            session=session,
+            timeout=aiohttp.ClientTimeout(sock_connect=0.1, sock_read=0.2),
+            retries=1,
+            breaker=CircuitBreaker(threshold=3, reset_timeout=1.0),
+        )
+        store = RatesStore(api, ttl=0.1, refresh_ahead=0)
+        results["healthy"] = await _lookups(store)
+        fixer.delay = 5.0
+        results["slow"] = await _lookups(store)
+        fixer.delay = 0.0
+        fixer.failures = 1_000_000
+        results["failing"] = await _lookups(store)
+    return results, store.stats
+
+
+@benchmark
+def test_brownout_latency() -> None:
+    results, stats = asyncio.run(_run())
+    report("brownout.store", **asdict(stats))
+    for name, latencies in results.items():
+        report(
+            f"brownout.{name}",
+            p50_ms=percentile(latencies, 50) * 1000,
+            p99_ms=percentile(latencies, 99) * 1000,
+        )
+        # A lookup waits at most for one request and one retry to time out
+        assert max(latencies) < 1.0
@@ -0,0 +1,81 @@
+"""Measures /rate latency while trades are being booked against a slow database.
+"""
+import asyncio
+import time
+from typing import List
+
+import aiohttp
+from sqlalchemy import event
+
+from fx import app
+from fx.rates import DummyRatesApi, get_rates
+from tests.benchmarks.utils import (
+    benchmark,
+    percentile,
+    report,
+    serve,
+    sqlite_engine,
+    use_database,
+)
+
+# Simulated fsync time on every commit
+COMMIT_DELAY = 0.02
+DURATION = 3.0
+WRITERS = 20
+
+TRADE = {"sell_ccy": "BRL", "sell_amount": 100, "buy_ccy": "GBP", "rate": 1.0}
+
+
+async def _sample_rate_latency(
+    session: aiohttp.ClientSession, url: str, until: float
+) -> List[float]:
+    latencies = []
+    while time.monotonic() < until:
+        start = time.perf_counter()
+        async with session.get(
+            f"{url}/rate", params={"from_symbol": "USD", "to_symbol": "GBP"}
+        ) as resp:
+            assert resp.status == 200
+            await resp.read()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+async def _book_trades(session: aiohttp.ClientSession, url: str, until: float) -> int:
+    booked = 0
+    while time.monotonic() < until:
+        async with session.post(f"{url}/trades", json=TRADE) as resp:
+            assert resp.status == 200
+            booked += 1
+    return booked
+
+
+async def _run(url: str, writers: int) -> None:
+    async with aiohttp.ClientSession() as session:
+        until = time.monotonic() + DURATION
+        latencies, *booked = await asyncio.gather(
+            _sample_rate_latency(session, url, until),
+            *(_book_trades(session, url, until) for _ in range(writers)),
+        )
+    p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+    report(
+        f"db_concurrency.writers_{writers}",
+        rate_p50_ms=p50 * 1000,
+        rate_p99_ms=p99 * 1000,
+        trades=sum(booked),
+    )
+    # Rate requests must not wait for commits to finish
+    assert p50 < COMMIT_DELAY
+
+
+@benchmark
+def test_rate_latency_under_write_load(tmp_path) -> None:
+    engine = sqlite_engine(str(tmp_path / "fx.db"))
+    event.listen(engine, "commit", lambda _conn: time.sleep(COMMIT_DELAY))
+    app.dependency_overrides[get_rates] = DummyRatesApi
+    try:
+        with use_database(engine), serve() as url:
+            for writers in (0, WRITERS):
+                asyncio.run(_run(url, writers))
+    finally:
+        app.dependency_overrides = {}
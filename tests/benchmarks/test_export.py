@@ -0,0 +1,102 @@
+"""Exports a large synthetic blotter through /trades/export while tracking the process' RSS.
+"""
+import asyncio
+import os
+import random
+import resource
+import threading
+import time
+from datetime import datetime, timedelta
+
+import aiohttp
+
+from fx.database import Trade
+from tests.benchmarks.utils import benchmark, report, serve, sqlite_engine, use_database
+
+TRADES = int(os.environ.get("FX_BENCHMARK_EXPORT_TRADES", "1000000"))
+INSERT_CHUNK_SIZE = 10_000
+MAX_RSS_GROWTH = 64 * 1024 * 1024
+
+
+def _rss() -> int:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # Only the peak is available outside Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _PeakRss:
+    def __init__(self) -> None:
+        self.peak = _rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, _rss())
+
+    def __enter__(self) -> "_PeakRss":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+def _insert_trades(engine) -> None:
+    start = datetime(2020, 1, 1)
+    symbols = ["USD", "GBP", "BRL", "EUR"]
+    for offset in range(0, TRADES, INSERT_CHUNK_SIZE):
+        rows = []
+        for i in range(offset, offset + INSERT_CHUNK_SIZE):
+            sell_ccy, buy_ccy = random.sample(symbols, 2)
+            rows.append(
+                {
+                    "trade_id": f"TR{i:07d}",
+                    "sell_ccy": sell_ccy,
+                    "sell_amount": random.randrange(1, 10_000_000),
+                    "buy_ccy": buy_ccy,
+                    "rate": random.uniform(0.1, 10),
+                    "timestamp": start + timedelta(seconds=i),
+                }
+            )
+        engine.execute(Trade.__table__.insert(), rows)
+
+
+async def _download(url: str, fmt: str) -> int:
+    lines = 0
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        async with session.get(
+            f"{url}/trades/export", params={"format": fmt}
+        ) as resp:
+            assert resp.status == 200
+            async for chunk in resp.content.iter_chunked(64 * 1024):
+                lines += chunk.count(b"\n")
+    return lines
+
+
+@benchmark
+def test_export_memory(tmp_path) -> None:
+    engine = sqlite_engine(str(tmp_path / "fx.db"))
+    _insert_trades(engine)
+    with use_database(engine), serve() as url:
+        for fmt, expected_lines in (("ndjson", TRADES), ("csv", TRADES + 1)):
+            baseline = _rss()
+            start = time.perf_counter()
+            with _PeakRss() as rss:
+                lines = asyncio.run(_download(url, fmt))
+            elapsed = time.perf_counter() - start
+            growth = rss.peak - baseline
+            report(
+                f"export.{fmt}",
+                trades=TRADES,
+                seconds=elapsed,
+                rows_per_s=TRADES / elapsed,
+                rss_growth_mib=growth / 2 ** 20,
+            )
+            assert lines == expected_lines
+            assert growth < MAX_RSS_GROWTH
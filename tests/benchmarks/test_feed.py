@@ -0,0 +1,77 @@
+"""Measures how long trades take to reach thousands of /feed subscribers.
+
+The number of subscribers is set by FX_BENCHMARK_FEED_SUBSCRIBERS (2000 by default).
+"""
+import asyncio
+import os
+import time
+
+import aiohttp
+
+from tests.benchmarks.utils import (
+    benchmark,
+    percentile,
+    report,
+    serve,
+    sqlite_engine,
+    use_database,
+)
+
+SUBSCRIBERS = int(os.environ.get("FX_BENCHMARK_FEED_SUBSCRIBERS", "2000"))
+TRADES = 10
+
+TRADE = {"sell_ccy": "BRL", "sell_amount": 100, "buy_ccy": "GBP", "rate": 1.0}
+
+
+async def _subscriber(
+    session: aiohttp.ClientSession,
+    url: str,
+    connected: asyncio.Queue,
+    booked: dict,
+    latencies: list,
+) -> None:
+    async with session.ws_connect(f"{url}/feed") as websocket:
+        assert (await websocket.receive_json())["type"] == "rates"
+        connected.put_nowait(None)
+        for _ in range(TRADES):
+            event = await websocket.receive_json()
+            assert event["type"] == "trades"
+            latencies.append(time.perf_counter() - booked[event["data"][0]["id"]])
+
+
+async def _run(url: str) -> list:
+    booked: dict = {}
+    latencies: list = []
+    connected: asyncio.Queue = asyncio.Queue()
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        subscribers = [
+            asyncio.ensure_future(
+                _subscriber(session, url, connected, booked, latencies)
+            )
+            for _ in range(SUBSCRIBERS)
+        ]
+        for _ in range(SUBSCRIBERS):
+            await connected.get()
+        for _ in range(TRADES):
+            start = time.perf_counter()
+            async with session.post(f"{url}/trades", json=TRADE) as resp:
+                booked[(await resp.json())["id"]] = start
+            await asyncio.sleep(0.1)
+        await asyncio.gather(*subscribers)
+    return latencies
+
+
+@benchmark
+def test_feed_fan_out(tmp_path) -> None:
+    engine = sqlite_engine(str(tmp_path / "fx.db"))
+    with use_database(engine), serve() as url:
+        latencies = asyncio.run(_run(url))
+    assert len(latencies) == SUBSCRIBERS * TRADES
+    # Time from booking a trade to each subscriber receiving it
+    report(
+        "feed.fan_out",
+        subscribers=SUBSCRIBERS,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p99_ms=percentile(latencies, 99) * 1000,
+    )
@@ -0,0 +1,81 @@
+"""Measures POST /trades bookings per second with and without group commit, at 1, 50 and 500
+concurrent clients, against an SQLite database on disk.
+
+Each run lasts FX_BENCHMARK_DURATION seconds (5 by default). Requests failing because the
+database is locked are counted as errors.
+"""
+import asyncio
+import os
+import time
+from typing import Dict, List
+
+import aiohttp
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+import fx
+from fx.database import Trade
+from fx.writes import GROUP_COMMIT_SIZE, TradeWriter
+from tests.benchmarks.test_macro import TRADE
+from tests.benchmarks.utils import (
+    benchmark,
+    latency_stats,
+    report,
+    serve,
+    sqlite_engine,
+    use_database,
+)
+
+DURATION = float(os.environ.get("FX_BENCHMARK_DURATION", "5"))
+
+
+async def _drive(url: str, concurrency: int) -> Dict[str, float]:
+    latencies: List[float] = []
+    errors = 0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        until = time.monotonic() + DURATION
+
+        async def client() -> None:
+            nonlocal errors
+            while time.monotonic() < until:
+                start = time.perf_counter()
+                async with session.post(f"{url}/trades", json=TRADE) as resp:
+                    await resp.read()
+                if resp.status == 200:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {
+        **latency_stats(latencies, elapsed),
+        "booked": len(latencies),
+        "errors": errors,
+    }
+
+
+@benchmark
+@pytest.mark.parametrize("grouped", [False, True], ids=["single", "grouped"])
+@pytest.mark.parametrize("concurrency", [1, 50, 500])
+def test_bookings(tmp_path, monkeypatch, grouped: bool, concurrency: int) -> None:
+    engine = sqlite_engine(str(tmp_path / "fx.db"))
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    writer = TradeWriter(
+        max_size=GROUP_COMMIT_SIZE if grouped else 1, session_factory=session_factory
+    )
+    monkeypatch.setattr(fx, "TRADE_WRITER", writer)
+    with use_database(engine), serve() as url:
+        stats = asyncio.run(_drive(url, concurrency))
+
+    name = "grouped" if grouped else "single"
+    report(
+        f"group_commit.{name}.{concurrency}",
+        bookings_per_second=stats.pop("throughput"),
+        groups=writer.groups,
+        **stats,
+    )
+    # Every trade acknowledged was committed
+    assert engine.execute(Trade.__table__.count()).scalar() == stats["booked"]
@@ -0,0 +1,140 @@
+"""Drives the API served by uvicorn, with rates fetched from a local fake fixer.io and trades stored
+in SQLite.
+
+Each workload runs FX_BENCHMARK_CONCURRENCY clients (20 by default) sending requests back to back
+for FX_BENCHMARK_DURATION seconds (5 by default).
+"""
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterator, List
+
+import aiohttp
+import pytest
+
+from fx import app
+from fx.database import Trade
+from fx.rates import FixerApi, RatesStore, get_rates
+from tests.benchmarks.utils import (
+    benchmark,
+    fake_fixer,
+    latency_stats,
+    report,
+    serve,
+    sqlite_engine,
+    use_database,
+)
+
+CONCURRENCY = int(os.environ.get("FX_BENCHMARK_CONCURRENCY", "20"))
+DURATION = float(os.environ.get("FX_BENCHMARK_DURATION", "5"))
+SEEDED_TRADES = 10_000
+
+TRADE = {"sell_ccy": "EUR", "sell_amount": 100, "buy_ccy": "GBP", "rate": 0.9}
+
+Request = Callable[[aiohttp.ClientSession, str], Awaitable[None]]
+
+
+async def _get_rate(session: aiohttp.ClientSession, url: str) -> None:
+    async with session.get(
+        f"{url}/rate", params={"from_symbol": "USD", "to_symbol": "GBP"}
+    ) as resp:
+        assert resp.status == 200
+        await resp.read()
+
+
+async def _get_trades(session: aiohttp.ClientSession, url: str) -> None:
+    async with session.get(f"{url}/trades", params={"limit": 100}) as resp:
+        assert resp.status == 200
+        await resp.read()
+
+
+async def _post_trade(session: aiohttp.ClientSession, url: str) -> None:
+    async with session.post(f"{url}/trades", json=TRADE) as resp:
+        assert resp.status == 200
+        await resp.read()
+
+
+async def _mixed(session: aiohttp.ClientSession, url: str) -> None:
+    request = random.choices(
+        [_get_rate, _get_trades, _post_trade], weights=[80, 15, 5]
+    )[0]
+    await request(session, url)
+
+
+WORKLOADS: Dict[str, Request] = {
+    "rate": _get_rate,
+    "get_trades": _get_trades,
+    "post_trade": _post_trade,
+    "mixed": _mixed,
+}
+
+
+async def _drive(url: str, request: Request) -> Dict[str, float]:
+    latencies: List[float] = []
+    connector = aiohttp.TCPConnector(limit=CONCURRENCY)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        # Warm up connections and caches
+        await asyncio.gather(*(request(session, url) for _ in range(CONCURRENCY)))
+
+        until = time.monotonic() + DURATION
+
+        async def client() -> None:
+            while time.monotonic() < until:
+                start = time.perf_counter()
+                await request(session, url)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(CONCURRENCY)))
+        elapsed = time.perf_counter() - start
+    return latency_stats(latencies, elapsed)
+
+
+def _seed_trades(engine) -> None:
+    start = datetime(2020, 1, 1)
+    engine.execute(
+        Trade.__table__.insert(),
+        [
+            {
+                "trade_id": f"TR{i:026d}",
+                "sell_ccy": "EUR",
+                "sell_amount": 100 + i,
+                "buy_ccy": "USD",
+                "rate": 1.1,
+                "timestamp": start + timedelta(seconds=i),
+            }
+            for i in range(SEEDED_TRADES)
+        ],
+    )
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory) -> Iterator[str]:
+    engine = sqlite_engine(str(tmp_path_factory.mktemp("macro") / "fx.db"))
+    _seed_trades(engine)
+    with fake_fixer() as fixer:
+        api = FixerApi("token", base_url=fixer.url)
+        store = RatesStore(api)
+
+        async def rates() -> RatesStore:
+            # Opened from the server's event loop on the first request
+            await api.open()
+            return store
+
+        app.dependency_overrides[get_rates] = rates
+        app.router.on_shutdown.append(api.close)
+        try:
+            with use_database(engine), serve() as url:
+                yield url
+        finally:
+            app.router.on_shutdown.remove(api.close)
+            app.dependency_overrides.pop(get_rates, None)
+
+
+@benchmark
+@pytest.mark.parametrize("workload", list(WORKLOADS))
+def test_workload(server: str, workload: str) -> None:
+    stats = asyncio.run(_drive(server, WORKLOADS[workload]))
+    report(f"macro.{workload}", concurrency=CONCURRENCY, **stats)
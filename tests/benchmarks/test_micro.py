@@ -0,0 +1,76 @@
+"""Micro-benchmarks of the code run for every request, reported in nanoseconds per operation.
+"""
+import timeit
+from datetime import datetime
+from typing import Callable
+
+from fx import TradeModel, TradesResponse
+from fx.model import Currency, CurrencyArray
+from fx.profiling import phase
+from fx.rates import DummyRatesApi
+from tests.benchmarks.utils import benchmark, report
+
+TRADE = TradeModel(
+    id="TR01E8X5Q2X3R6Y7Z8A9B0C1D2",
+    sell_ccy="BRL",
+    sell_amount=Currency(12345),
+    buy_ccy="GBP",
+    buy_amount=Currency(1563),
+    rate=0.1266,
+    timestamp=datetime(2020, 5, 1, 12, 30),
+)
+PAGE = TradesResponse(trades=[TRADE] * 100, next_cursor=None)
+AMOUNTS = CurrencyArray(range(10_000))
+RATES = [1.2345] * 10_000
+
+
+def _ns_per_op(func: Callable[[], object], ops: int = 1) -> float:
+    # Best of 5 runs of about 0.2s each
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(5, number)) / number / ops * 1e9
+
+
+@benchmark
+def test_currency_arithmetic() -> None:
+    amount = Currency(12345)
+    report(
+        "micro.currency",
+        mul_ns=_ns_per_op(lambda: amount * 1.2345),
+        array_mul_ns=_ns_per_op(lambda: AMOUNTS * RATES, len(AMOUNTS)),
+    )
+
+
+@benchmark
+def test_sync_get_rate() -> None:
+    report(
+        "micro.sync_get_rate",
+        ns=_ns_per_op(lambda: DummyRatesApi.sync_get_rate("GBP", "BRL")),
+    )
+
+
+@benchmark
+def test_model_serialization() -> None:
+    report(
+        "micro.serialization",
+        trade_json_ns=_ns_per_op(TRADE.json),
+        page_json_ns=_ns_per_op(PAGE.json),
+        page_validation_ns=_ns_per_op(
+            lambda: TradesResponse(trades=PAGE.trades, next_cursor=None)
+        ),
+    )
+
+
+def _in_phase() -> None:
+    with phase("db"):
+        pass
+
+
+@benchmark
+def test_profiling_disabled() -> None:
+    # What a phase costs when the request isn't profiled
+    report(
+        "micro.profiling",
+        no_phase_ns=_ns_per_op(lambda: None),
+        phase_ns=_ns_per_op(_in_phase),
+    )
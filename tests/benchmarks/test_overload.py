@@ -0,0 +1,75 @@
+"""Measures latencies of cheap (/symbols) and expensive (/trades?limit=1000) requests when the
+server is overloaded with expensive ones, with and without admission control.
+
+FX_BENCHMARK_OVERLOAD clients (200 by default) request /trades back to back while 10 clients
+request /symbols, for FX_BENCHMARK_DURATION seconds (5 by default). Requests rejected with a 503
+are counted apart.
+"""
+import asyncio
+import os
+import time
+from typing import Dict, List
+
+import aiohttp
+import pytest
+
+import fx
+from tests.benchmarks.test_macro import _seed_trades
+from tests.benchmarks.utils import (
+    benchmark,
+    percentile,
+    report,
+    serve,
+    sqlite_engine,
+    use_database,
+)
+
+DURATION = float(os.environ.get("FX_BENCHMARK_DURATION", "5"))
+OVERLOAD = int(os.environ.get("FX_BENCHMARK_OVERLOAD", "200"))
+CHEAP_CLIENTS = 10
+
+
+async def _drive(url: str) -> Dict[str, float]:
+    latencies: Dict[str, List[float]] = {"symbols": [], "trades": []}
+    rejected = {"symbols": 0, "trades": 0}
+    connector = aiohttp.TCPConnector(limit=OVERLOAD + CHEAP_CLIENTS)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        until = time.monotonic() + DURATION
+
+        async def client(name: str, path: str) -> None:
+            while time.monotonic() < until:
+                start = time.perf_counter()
+                async with session.get(f"{url}{path}") as resp:
+                    await resp.read()
+                if resp.status == 503:
+                    rejected[name] += 1
+                    # Clients honour Retry-After, without it they'd just hammer the server
+                    await asyncio.sleep(float(resp.headers["Retry-After"]))
+                else:
+                    assert resp.status == 200
+                    latencies[name].append(time.perf_counter() - start)
+
+        await asyncio.gather(
+            *(client("trades", "/trades?limit=1000") for _ in range(OVERLOAD)),
+            *(client("symbols", "/symbols") for _ in range(CHEAP_CLIENTS)),
+        )
+    stats: Dict[str, float] = {}
+    for name, values in latencies.items():
+        stats[f"{name}_served"] = len(values)
+        stats[f"{name}_rejected"] = rejected[name]
+        stats[f"{name}_p50_ms"] = percentile(values, 50) * 1000
+        stats[f"{name}_p99_ms"] = percentile(values, 99) * 1000
+    return stats
+
+
+@benchmark
+@pytest.mark.parametrize("enabled", [False, True], ids=["unlimited", "admission"])
+def test_overload(tmp_path, monkeypatch, enabled: bool) -> None:
+    engine = sqlite_engine(str(tmp_path / "fx.db"))
+    _seed_trades(engine)
+    monkeypatch.setattr(fx.ADMISSION, "enabled", enabled)
+    with use_database(engine), serve() as url:
+        stats = asyncio.run(_drive(url))
+
+    report(f"overload.{'admission' if enabled else 'unlimited'}", **stats)
+    assert stats["symbols_rejected"] == 0
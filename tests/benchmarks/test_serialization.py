@@ -0,0 +1,63 @@
+"""Compares encoding /trades pages through pydantic models and with FX_FAST_JSON.
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute, serialize_response
+
+from fx import _trades_response, app
+from fx.export import encode_trades_json
+from tests.benchmarks.utils import benchmark, report
+
+
+def _rows(count: int) -> list:
+    start = datetime(2020, 5, 1)
+    return [
+        (
+            f"TR{i:026d}",
+            "BRL",
+            100 + i,
+            "GBP",
+            1.0 + i / count,
+            start + timedelta(seconds=i),
+        )
+        for i in range(count)
+    ]
+
+
+def _pydantic_path(rows: list) -> bytes:
+    # Same steps as FastAPI: build the models, validate them against the response model and
+    # render them as JSON
+    route = next(
+        r
+        for r in app.routes
+        if isinstance(r, APIRoute) and r.path == "/trades" and "GET" in r.methods
+    )
+    content = asyncio.run(
+        serialize_response(
+            field=route.secure_cloned_response_field,
+            response_content=_trades_response(rows, None),
+        )
+    )
+    return JSONResponse(content).body
+
+
+@benchmark
+@pytest.mark.parametrize("count", [10_000, 100_000])
+def test_serialization(count: int) -> None:
+    rows = _rows(count)
+    timings = {}
+    bodies = {}
+    for name, encode in (
+        ("pydantic", _pydantic_path),
+        ("fast", lambda rows: encode_trades_json(rows, None)),
+    ):
+        start = time.perf_counter()
+        bodies[name] = encode(rows)
+        timings[name] = time.perf_counter() - start
+        report(f"serialization.{name}_{count}", ms=timings[name] * 1000)
+    assert bodies["fast"] == bodies["pydantic"]
+    assert timings["fast"] < timings["pydantic"]
@@ -0,0 +1,102 @@
+"""Measures how /rate throughput scales with the number of uvicorn worker processes sharing rates
+through FX_SHARED_DIR, and checks that fixer.io traffic doesn't grow with them.
+
+Workers are started with ``uvicorn --workers`` against a local fake fixer.io. Load is generated by
+one client process per worker, each running FX_BENCHMARK_CONCURRENCY clients for
+FX_BENCHMARK_DURATION seconds. The worker counts compared are FX_BENCHMARK_WORKERS
+(comma-separated), by default 1 and the number of CPUs.
+"""
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+import pytest
+
+from tests.benchmarks.test_macro import _drive, _get_rate
+from tests.benchmarks.utils import _free_port, benchmark, fake_fixer, report
+
+WORKERS = sorted(
+    {
+        int(n)
+        for n in os.environ.get(
+            "FX_BENCHMARK_WORKERS", f"1,{os.cpu_count() or 1}"
+        ).split(",")
+    }
+)
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@contextmanager
+def _serve_workers(workers: int, fixer_url: str, directory: str) -> Iterator[str]:
+    port = _free_port()
+    env = {
+        **os.environ,
+        "PYTHONPATH": ROOT,
+        "FX_FIXER_TOKEN": "token",
+        "FX_FIXER_URL": fixer_url,
+        "FX_SHARED_DIR": os.path.join(directory, "shared"),
+    }
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "fx:app",
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--log-level",
+            "warning",
+        ],
+        cwd=directory,
+        env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                with urllib.request.urlopen(f"{url}/symbols"):
+                    break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise
+                time.sleep(0.1)
+        yield url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def _drive_rate(url: str) -> Dict[str, float]:
+    return asyncio.run(_drive(url, _get_rate))
+
+
+@benchmark
+@pytest.mark.parametrize("workers", WORKERS)
+def test_workers(tmp_path, workers: int) -> None:
+    with fake_fixer() as fixer:
+        assert fixer.url is not None
+        with _serve_workers(workers, fixer.url, str(tmp_path)) as url:
+            with ProcessPoolExecutor(workers) as executor:
+                results: List[Dict[str, float]] = list(
+                    executor.map(_drive_rate, [url] * workers)
+                )
+        fixer_requests = sum(fixer.hits.values())
+
+    report(
+        f"workers.{workers}",
+        throughput=sum(r["throughput"] for r in results),
+        p50_ms=max(r["p50_ms"] for r in results),
+        p99_ms=max(r["p99_ms"] for r in results),
+        fixer_requests=fixer_requests,
+    )
+    # Only the leader calls fixer.io: once for the rates and once for the symbols
+    assert fixer_requests == 2
@@ -0,0 +1,152 @@
+"""Helpers shared by the benchmarks.
+
+Benchmarks are slow, so they only run when the environment variable FX_ENABLE_BENCHMARKS is set.
+Results are printed, and recorded in the JSON file FX_BENCHMARK_RESULTS if it's set so they can be
+compared between commits with ``python -m tests.benchmarks.compare``.
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Sequence
+
+import pytest
+import uvicorn
+from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from fx import app
+from fx.database import Base, get_db
+from tests.fake_fixer import FakeFixer
+
+ENABLE = "FX_ENABLE_BENCHMARKS" in os.environ
+RESULTS = os.environ.get("FX_BENCHMARK_RESULTS")
+
+benchmark = pytest.mark.skipif(not ENABLE, reason="FX_ENABLE_BENCHMARKS")
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    """Returns the `p`-th percentile of `values` (nearest-rank).
+    """
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def latency_stats(latencies: Sequence[float], elapsed: float) -> Dict[str, float]:
+    """Summarizes request latencies (in seconds) measured over `elapsed` seconds.
+    """
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "throughput": len(latencies) / elapsed,
+    }
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def report(name: str, **metrics: float) -> None:
+    """Prints the `metrics` measured by benchmark `name`, and records them in FX_BENCHMARK_RESULTS.
+
+    The results file maps benchmark names to their metrics, along with the commit they ran on.
+    """
+    print(f"{name}: " + ", ".join(f"{k}={v:.6g}" for k, v in metrics.items()))
+    if RESULTS is None:
+        return
+    results: dict = {"commit": _commit(), "benchmarks": {}}
+    if os.path.exists(RESULTS):
+        with open(RESULTS) as results_file:
+            results["benchmarks"] = json.load(results_file)["benchmarks"]
+    results["benchmarks"][name] = metrics
+    with open(RESULTS, "w") as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+
+def sqlite_engine(path: str) -> Engine:
+    """Creates an SQLite database with all tables under `path`.
+    """
+    engine = create_engine(
+        f"sqlite:///{path}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+
+@contextmanager
+def use_database(engine: Engine) -> Iterator[None]:
+    """Makes the app use a new session on `engine` for each request.
+    """
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_db() -> Iterator[Session]:
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_db
+    try:
+        yield
+    finally:
+        app.dependency_overrides.pop(get_db, None)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def serve() -> Iterator[str]:
+    """Runs the app with uvicorn in a background thread, yielding its base URL.
+    """
+    port = _free_port()
+    config = uvicorn.Config(
+        app, host="127.0.0.1", port=port, loop="asyncio", log_level="warning"
+    )
+    server = uvicorn.Server(config)
+    server.install_signal_handlers = lambda: None  # type: ignore
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+@contextmanager
+def fake_fixer() -> Iterator[FakeFixer]:
+    """Runs a :class:`FakeFixer` in its own event loop in a background thread.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    fixer = FakeFixer()
+    asyncio.run_coroutine_threadsafe(fixer.__aenter__(), loop).result()
+    try:
+        yield fixer
+    finally:
+        asyncio.run_coroutine_threadsafe(fixer.__aexit__(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
@@ -3,22 +3,34 @@ from typing import Iterator
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 from fx import app
 from fx.database import Base, get_db
 from fx.rates import DummyRatesApi, get_rates
+from fx.writes import TRADE_WRITER
 
 
-@pytest.yield_fixture()
-def test_client() -> Iterator[TestClient]:
-    engine = create_engine("sqlite://", connect_args={"check_same_thread": False})
+@pytest.fixture()
+def db() -> Iterator[Session]:
+    # Queries run in the database thread pool, so every thread must share the same in-memory DB
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
     Base.metadata.create_all(bind=engine)
-    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    session = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    yield session
+    session.close()
+    Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture()
+def test_client(db: Session, monkeypatch) -> Iterator[TestClient]:
+    # Trades booked through the group writer must reach the test database too
+    monkeypatch.setattr(TRADE_WRITER, "_session_factory", lambda: db)
     with TestClient(app) as client:
         app.dependency_overrides[get_db] = lambda: db
         app.dependency_overrides[get_rates] = lambda: DummyRatesApi()
         yield client  # type: ignore
-        db.close()
         app.dependency_overrides = {}
-    Base.metadata.drop_all(bind=engine)
@@ -0,0 +1,65 @@
+"""Local HTTP server mimicking the parts of the fixer.io API used by :class:`fx.rates.FixerApi`.
+"""
+import asyncio
+from collections import Counter
+from typing import Any, Dict, Optional
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+LATEST = {
+    "success": True,
+    "base": "EUR",
+    "timestamp": 1588000000,
+    "rates": {"EUR": 1.0, "USD": 1.1, "GBP": 0.9},
+}
+SYMBOLS = {
+    "success": True,
+    "symbols": {"EUR": "Euro", "USD": "US Dollar", "GBP": "British Pound"},
+}
+ETAG = '"fake-etag"'
+DATE = "Mon, 27 Apr 2020 15:06:40 GMT"
+
+
+class FakeFixer:
+    """Serves `responses` under `<url><endpoint>`, counting hits per endpoint in `hits`.
+
+    Each response is delayed by `delay` seconds. Successful responses carry an `ETag` and requests
+    revalidating it get a 304. The next `failures` requests are answered with a 500 error.
+    """
+
+    def __init__(self, delay: float = 0.0, failures: int = 0) -> None:
+        self.delay = delay
+        self.failures = failures
+        self.hits: Counter = Counter()
+        self.responses: Dict[str, Dict[str, Any]] = {
+            "latest": LATEST,
+            "symbols": SYMBOLS,
+        }
+        app = web.Application()
+        app.router.add_get("/{endpoint}", self._handle)
+        self._server = TestServer(app, host="127.0.0.1")
+        self.url: Optional[str] = None
+
+    async def __aenter__(self) -> "FakeFixer":
+        await self._server.start_server()
+        self.url = str(self._server.make_url("/"))
+        return self
+
+    async def __aexit__(self, *_exc) -> None:
+        await self._server.close()
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        endpoint = request.match_info["endpoint"]
+        self.hits[endpoint] += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            return web.Response(status=500, text="Internal Server Error")
+        data = self.responses[endpoint]
+        if not data["success"]:
+            return web.json_response(data)
+        if request.headers.get("If-None-Match") == ETAG:
+            return web.Response(status=304)
+        return web.json_response(data, headers={"ETag": ETAG, "Date": DATE})
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Tuple
+
+import pytest
+from fastapi import FastAPI
+
+from fx.admission import (
+    AdmissionController,
+    AdmissionMiddleware,
+    Limiter,
+    LoopLagMonitor,
+    Overloaded,
+    RouteLimit,
+)
+
+
+@pytest.mark.asyncio
+async def test_limiter() -> None:
+    limiter = Limiter(RouteLimit(concurrency=2, queue_size=2, queue_timeout=0.05))
+    await limiter.acquire()
+    await limiter.acquire()
+    waiters = [asyncio.ensure_future(limiter.acquire()) for _ in range(2)]
+    await asyncio.sleep(0)
+    assert (limiter.active, limiter.queued) == (2, 2)
+    with pytest.raises(Overloaded, match="queue_full"):
+        await limiter.acquire()
+
+    # Slots are handed over to waiters first come first served
+    limiter.release()
+    await asyncio.sleep(0.01)
+    assert waiters[0].done() and not waiters[1].done()
+    with pytest.raises(Overloaded, match="queue_timeout"):
+        await waiters[1]
+    assert (limiter.active, limiter.queued) == (2, 0)
+
+    for _ in range(2):
+        limiter.release()
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_limiter_cancelled_waiter() -> None:
+    limiter = Limiter(RouteLimit(concurrency=1, queue_size=2, queue_timeout=1.0))
+    await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.sleep(0.01)
+    assert limiter.queued == 0
+    limiter.release()
+    assert limiter.active == 0
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor() -> None:
+    monitor = LoopLagMonitor(interval=0.01)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        assert monitor.lag < 0.1
+        time.sleep(0.2)
+        # Lag is visible before the monitor wakes up
+        assert monitor.lag > 0.15
+        await asyncio.sleep(0.05)
+        assert monitor.lag < 0.1
+    finally:
+        await monitor.stop()
+
+
+def _app(controller: AdmissionController, release: asyncio.Event) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/slow/{n}")
+    async def slow(n: int):  # pylint: disable=unused-variable
+        await release.wait()
+        return {"n": n}
+
+    @app.get("/fast")
+    async def fast():  # pylint: disable=unused-variable
+        return {}
+
+    app.add_middleware(AdmissionMiddleware, controller=controller)
+    return app
+
+
+async def _request(app: FastAPI, path: str) -> Tuple[int, Dict[str, str]]:
+    messages: List[Dict[str, Any]] = []
+
+    async def receive() -> Dict[str, Any]:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message: Dict[str, Any]) -> None:
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "root_path": "",
+        "query_string": b"",
+        "headers": [],
+    }
+    await app(scope, receive, send)
+    start = messages[0]
+    return start["status"], {k.decode(): v.decode() for k, v in start["headers"]}
+
+
+@pytest.mark.asyncio
+async def test_middleware() -> None:
+    controller = AdmissionController(
+        {("GET", "/slow/{n}"): RouteLimit(concurrency=1, queue_size=1)}
+    )
+    release = asyncio.Event()
+    app = _app(controller, release)
+
+    pending = [asyncio.ensure_future(_request(app, f"/slow/{i}")) for i in range(2)]
+    await asyncio.sleep(0.01)
+    status, headers = await _request(app, "/slow/3")
+    assert (status, headers["retry-after"]) == (503, "1")
+    # Unlimited routes are still served
+    assert (await _request(app, "/fast"))[0] == 200
+
+    release.set()
+    assert [status for status, _ in await asyncio.gather(*pending)] == [200, 200]
+    assert controller.limiters[("GET", "/slow/{n}")].active == 0
+
+
+@pytest.mark.asyncio
+async def test_middleware_sheds_on_loop_lag() -> None:
+    controller = AdmissionController({("GET", "/slow/{n}"): RouteLimit()}, max_lag=0.1)
+    release = asyncio.Event()
+    release.set()
+    app = _app(controller, release)
+    controller.start()
+    try:
+        await asyncio.sleep(0.06)
+        time.sleep(0.2)
+        assert (await _request(app, "/slow/1"))[0] == 503
+        assert (await _request(app, "/fast"))[0] == 200
+        await asyncio.sleep(0.1)
+        assert (await _request(app, "/slow/1"))[0] == 200
+    finally:
+        await controller.stop()
+
+    controller.enabled = False
+    time.sleep(0.2)
+    assert (await _request(app, "/slow/1"))[0] == 200
@@ -1,9 +1,20 @@
+import csv
+import io
 import itertools
+import json
+import marshal
+import re
+from datetime import datetime
+from math import floor
 
 from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
 
-from fx import app
-from fx.rates import DummyRatesApi
+from fx.database import Trade
+from fx.history import pack_snapshot
+from fx.partitions import archive_trades, next_month, parse_month
+from fx.profiling import PROFILER
+from fx.rates import DummyRatesApi, RatesSnapshot, get_rates
 
 
 def test_get_symbols(test_client: TestClient) -> None:
@@ -22,6 +33,38 @@ def test_get_rate(test_client: TestClient) -> None:
         assert {"rate": DummyRatesApi.sync_get_rate(a, b)} == response.json()
 
 
+def test_get_rates_not_modified(test_client: TestClient) -> None:
+    for url in ("/symbols", "/rate?from_symbol=GBP&to_symbol=USD", "/rates/matrix"):
+        response = test_client.get(url)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert response.headers["Cache-Control"] == "public, max-age=60"
+
+        response = test_client.get(url, headers={"If-None-Match": f"W/{etag}"})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.headers["Cache-Control"] == "public, max-age=60"
+
+
+def test_get_rates_stale(test_client: TestClient) -> None:
+    class StaleRatesApi(DummyRatesApi):
+        def age(self) -> int:
+            return 90
+
+        def is_stale(self) -> bool:
+            return True
+
+        def max_age(self) -> int:
+            return 0
+
+    test_client.app.dependency_overrides[get_rates] = StaleRatesApi
+    response = test_client.get("/rate", params={"from_symbol": "GBP", "to_symbol": "USD"})
+    assert response.status_code == 200
+    assert response.headers["Age"] == "90"
+    assert response.headers["Warning"] == '110 - "Response is Stale"'
+    assert response.headers["Cache-Control"] == "public, max-age=0"
+
+
 def test_get_rate_invalid_symbols(test_client: TestClient) -> None:
     response = test_client.get(
         f"/rate", params={"from_symbol": "USD", "to_symbol": "FOO"}
@@ -44,7 +87,7 @@ def test_get_rate_invalid_symbols(test_client: TestClient) -> None:
 def test_api_trades(test_client: TestClient) -> None:
     response = test_client.get("/trades")
     assert response.status_code == 200
-    assert {"trades": []} == response.json()
+    assert {"trades": [], "next_cursor": None} == response.json()
 
     requests = [
         {"sell_ccy": "BRL", "sell_amount": 100, "buy_ccy": "GBP", "rate": 1.0,},
@@ -58,7 +101,102 @@ def test_api_trades(test_client: TestClient) -> None:
 
         response = test_client.get("/trades")
         assert response.status_code == 200
-        assert {"trades": trades} == response.json()
+        assert {"trades": trades, "next_cursor": None} == response.json()
+
+
+def _book_trades(test_client: TestClient) -> list:
+    requests = [
+        {"sell_ccy": "BRL", "sell_amount": 100, "buy_ccy": "GBP", "rate": 1.0,},
+        {"sell_ccy": "GBP", "sell_amount": 201, "buy_ccy": "USD", "rate": 2.3,},
+        {"sell_ccy": "BRL", "sell_amount": 302, "buy_ccy": "USD", "rate": 3.6,},
+        {"sell_ccy": "USD", "sell_amount": 403, "buy_ccy": "GBP", "rate": 0.7,},
+        {"sell_ccy": "BRL", "sell_amount": 504, "buy_ccy": "GBP", "rate": 1.2,},
+    ]
+    trades = [test_client.post("/trades", json=req).json() for req in requests]
+    trades.reverse()
+    return trades
+
+
+def test_get_trades_pagination(test_client: TestClient) -> None:
+    trades = _book_trades(test_client)
+
+    pages = []
+    params: dict = {"limit": 2}
+    while True:
+        response = test_client.get("/trades", params=params)
+        assert response.status_code == 200
+        body = response.json()
+        pages.append(body["trades"])
+        if body["next_cursor"] is None:
+            break
+        params["cursor"] = body["next_cursor"]
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert [t for page in pages for t in page] == trades
+
+
+def test_get_trades_fast_json(test_client: TestClient, monkeypatch) -> None:
+    _book_trades(test_client)
+
+    for params in ({}, {"limit": 2}, {"buy_ccy": "GBP"}, {"sell_ccy": "EUR"}):
+        expected = test_client.get("/trades", params=params)
+        monkeypatch.setattr("fx.FAST_JSON", True)
+        response = test_client.get("/trades", params=params)
+        monkeypatch.setattr("fx.FAST_JSON", False)
+        assert response.status_code == 200
+        assert response.headers["Content-Type"] == expected.headers["Content-Type"]
+        assert response.content == expected.content
+
+
+def test_get_trades_not_modified(test_client: TestClient, monkeypatch) -> None:
+    _book_trades(test_client)
+
+    response = test_client.get("/trades")
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    response = test_client.get("/trades", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["ETag"] == etag
+
+    monkeypatch.setattr("fx.FAST_JSON", True)
+    response = test_client.get("/trades", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    test_client.post(
+        "/trades",
+        json={"sell_ccy": "BRL", "sell_amount": 100, "buy_ccy": "GBP", "rate": 1.0},
+    )
+    response = test_client.get("/trades", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(response.json()["trades"]) == 6
+
+
+def test_get_trades_filters(test_client: TestClient) -> None:
+    trades = _book_trades(test_client)
+
+    response = test_client.get("/trades", params={"sell_ccy": "BRL"})
+    assert response.json()["trades"] == [t for t in trades if t["sell_ccy"] == "BRL"]
+
+    response = test_client.get("/trades", params={"buy_ccy": "GBP", "limit": 2})
+    body = response.json()
+    assert body["trades"] == [t for t in trades if t["buy_ccy"] == "GBP"][:2]
+    response = test_client.get(
+        "/trades", params={"buy_ccy": "GBP", "cursor": body["next_cursor"]}
+    )
+    assert response.json()["trades"] == [t for t in trades if t["buy_ccy"] == "GBP"][2:]
+
+    since, until = trades[3]["timestamp"], trades[1]["timestamp"]
+    response = test_client.get("/trades", params={"since": since, "until": until})
+    assert response.json()["trades"] == trades[2:4]
+
+
+def test_get_trades_invalid_params(test_client: TestClient) -> None:
+    assert test_client.get("/trades", params={"cursor": "foo"}).status_code == 400
+    assert test_client.get("/trades", params={"limit": 0}).status_code == 422
+    assert test_client.get("/trades", params={"sell_ccy": "foo"}).status_code == 422
 
 
 def test_post_trade_same_symbol(test_client: TestClient) -> None:
@@ -67,3 +205,412 @@ def test_post_trade_same_symbol(test_client: TestClient) -> None:
         json={"sell_ccy": "BRL", "sell_amount": 100, "buy_ccy": "BRL", "rate": 1.0,},
     )
     assert response.status_code == 422
+
+
+def test_post_trade_beyond_int64(test_client: TestClient, db: Session) -> None:
+    # Neither the sell nor the buy amount may exceed what the positions table holds
+    trade = {
+        "sell_ccy": "BRL",
+        "sell_amount": 10 ** 17,
+        "buy_ccy": "USD",
+        "rate": 1000.0,
+    }
+    too_large = {**trade, "sell_amount": 2 ** 64, "rate": 0.0}
+    for invalid in (trade, too_large):
+        assert test_client.post("/trades", json=invalid).status_code == 422
+        results = test_client.post("/trades/batch", json={"trades": [invalid]}).json()
+        assert results["results"][0]["errors"]
+
+    # Trades stored beforehand are still listed
+    db.add(Trade(trade_id="1", timestamp=datetime(2020, 1, 1), **trade))
+    db.commit()
+    response = test_client.get("/trades")
+    assert response.status_code == 200
+    assert response.json()["trades"][0]["buy_amount"] == 10 ** 20
+    response = test_client.get("/trades/export")
+    assert response.status_code == 200
+    assert json.loads(response.content)["buy_amount"] == 10 ** 20
+
+
+def test_export_trades_ndjson(test_client: TestClient) -> None:
+    trades = _book_trades(test_client)
+
+    response = test_client.get("/trades/export")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = response.content.decode().splitlines()
+    assert [json.loads(line) for line in lines] == trades[::-1]
+
+
+def test_export_trades_csv(test_client: TestClient) -> None:
+    trades = _book_trades(test_client)
+
+    response = test_client.get("/trades/export", params={"format": "csv"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.content.decode())))
+    assert [r["id"] for r in rows] == [t["id"] for t in trades[::-1]]
+    assert [int(r["buy_amount"]) for r in rows] == [
+        t["buy_amount"] for t in trades[::-1]
+    ]
+
+
+def test_export_trades_filters_gzip(test_client: TestClient) -> None:
+    trades = _book_trades(test_client)
+
+    since = trades[2]["timestamp"]
+    response = test_client.get("/trades/export", params={"since": since, "gzip": True})
+    assert response.status_code == 200
+    # The test client transparently decodes the gzip-encoded body
+    assert response.headers["content-encoding"] == "gzip"
+    lines = response.content.decode().splitlines()
+    assert [json.loads(line) for line in lines] == trades[2::-1]
+
+
+def test_post_trades_batch(test_client: TestClient) -> None:
+    requests = [
+        {"sell_ccy": "BRL", "sell_amount": 100, "buy_ccy": "GBP", "rate": 1.5,},
+        {"sell_ccy": "BRL", "sell_amount": 100, "buy_ccy": "BRL", "rate": 1.0,},
+        {"sell_ccy": "GBP", "sell_amount": -1, "buy_ccy": "USD", "rate": 2.3,},
+        {"sell_ccy": "GBP", "sell_amount": 201, "buy_ccy": "USD", "rate": 2.3,},
+    ]
+    response = test_client.post("/trades/batch", json={"trades": requests})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert len(results) == 4
+
+    booked = [results[0]["trade"], results[3]["trade"]]
+    for req, trade in zip([requests[0], requests[3]], booked):
+        assert {k: trade[k] for k in req} == req
+    assert [t["buy_amount"] for t in booked] == [150, 462]
+    assert results[0]["errors"] is None
+    assert results[1]["trade"] is None
+    assert results[1]["errors"][0]["msg"] == (
+        "buy_ccy and sell_ccy must not be the same symbol"
+    )
+    assert results[2]["trade"] is None
+    assert results[2]["errors"][0]["loc"] == ["sell_amount"]
+
+    response = test_client.get("/trades")
+    assert sorted(response.json()["trades"], key=lambda t: t["id"]) == sorted(
+        booked, key=lambda t: t["id"]
+    )
+
+
+def test_post_trades_batch_all_invalid(test_client: TestClient) -> None:
+    response = test_client.post(
+        "/trades/batch", json={"trades": [{"sell_ccy": "BRL"}]}
+    )
+    assert response.status_code == 200
+    assert response.json()["results"][0]["trade"] is None
+    assert test_client.get("/trades").json()["trades"] == []
+
+
+def test_post_trade_ids_are_ordered(test_client: TestClient) -> None:
+    trades = _book_trades(test_client)
+    ids = [t["id"] for t in trades]
+    assert all(re.match(r"^TR[0-9A-Z]{26}$", i) for i in ids)
+    assert ids == sorted(ids, reverse=True)
+
+
+def test_get_rate_matrix(test_client: TestClient) -> None:
+    all_symbols = list(DummyRatesApi.RATES.keys())
+    response = test_client.get("/rates/matrix")
+    assert response.status_code == 200
+    body = response.json()
+    assert body["symbols"] == all_symbols
+    assert body["rates"] == [
+        [DummyRatesApi.sync_get_rate(a, b) for b in all_symbols] for a in all_symbols
+    ]
+
+    response = test_client.get("/rates/matrix", params={"symbols": "USD,GBP"})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["symbols"] == ["USD", "GBP"]
+    assert body["rates"] == [
+        [1.0, DummyRatesApi.sync_get_rate("USD", "GBP")],
+        [DummyRatesApi.sync_get_rate("GBP", "USD"), 1.0],
+    ]
+
+
+def test_get_rate_matrix_invalid_symbols(test_client: TestClient) -> None:
+    response = test_client.get("/rates/matrix", params={"symbols": "USD,FOO"})
+    assert response.status_code == 400
+    response = test_client.get("/rates/matrix", params={"symbols": "USD,"})
+    assert response.status_code == 422
+
+
+def test_get_rates(test_client: TestClient) -> None:
+    all_symbols = list(DummyRatesApi.RATES.keys())
+    timestamp = DummyRatesApi.sync_get_snapshot().timestamp
+    for base in all_symbols:
+        response = test_client.get("/rates", params={"base": base})
+        assert response.status_code == 200
+        assert response.json() == {
+            "base": base,
+            "timestamp": timestamp,
+            "rates": {s: DummyRatesApi.sync_get_rate(base, s) for s in all_symbols},
+        }
+
+    response = test_client.get("/rates", params={"base": "USD", "symbols": "GBP,BRL"})
+    assert response.status_code == 200
+    assert response.json()["rates"] == {
+        "GBP": DummyRatesApi.sync_get_rate("USD", "GBP"),
+        "BRL": DummyRatesApi.sync_get_rate("USD", "BRL"),
+    }
+
+
+def test_get_rates_invalid_symbols(test_client: TestClient) -> None:
+    response = test_client.get("/rates", params={"base": "FOO"})
+    assert response.status_code == 400
+    response = test_client.get("/rates", params={"base": "USD", "symbols": "GBP,FOO"})
+    assert response.status_code == 400
+    response = test_client.get("/rates", params={"base": "USD", "symbols": "GBP;BRL"})
+    assert response.status_code == 422
+    response = test_client.get("/rates")
+    assert response.status_code == 422
+
+
+def test_post_rates(test_client: TestClient) -> None:
+    all_symbols = list(DummyRatesApi.RATES.keys())
+    pairs = [
+        {"from_symbol": a, "to_symbol": b}
+        for a, b in itertools.product(all_symbols, all_symbols)
+    ]
+    response = test_client.post("/rates", json={"pairs": pairs})
+    assert response.status_code == 200
+    assert response.json() == {
+        "timestamp": DummyRatesApi.sync_get_snapshot().timestamp,
+        "quotes": [
+            {**p, "rate": DummyRatesApi.sync_get_rate(p["from_symbol"], p["to_symbol"])}
+            for p in pairs
+        ],
+    }
+
+
+def test_post_rates_invalid_symbols(test_client: TestClient) -> None:
+    response = test_client.post(
+        "/rates", json={"pairs": [{"from_symbol": "USD", "to_symbol": "FOO"}]}
+    )
+    assert response.status_code == 400
+    response = test_client.post(
+        "/rates", json={"pairs": [{"from_symbol": "USD", "to_symbol": "foo"}]}
+    )
+    assert response.status_code == 422
+
+
+def test_get_rates_history(test_client: TestClient, db: Session) -> None:
+    for timestamp in (1588000000, 1588003600, 1588007200):
+        snapshot = RatesSnapshot.from_response(
+            {"base": "EUR", "timestamp": timestamp, "rates": {"USD": 1.1, "GBP": 0.9}}
+        )
+        db.add(pack_snapshot(snapshot))
+    db.commit()
+
+    response = test_client.get("/rates/history")
+    assert response.status_code == 200
+    history = response.json()["history"]
+    assert [h["timestamp"] for h in history] == [1588007200, 1588003600, 1588000000]
+    assert history[0] == {
+        "base": "EUR",
+        "timestamp": 1588007200,
+        "rates": {"USD": 1.1, "GBP": 0.9},
+    }
+
+    # Rates in effect at 2020-04-27T16:30:00Z
+    response = test_client.get(
+        "/rates/history",
+        params={"until": "2020-04-27T16:30:00", "limit": 1, "symbols": "GBP"},
+    )
+    assert response.json()["history"] == [
+        {"base": "EUR", "timestamp": 1588003600, "rates": {"GBP": 0.9}}
+    ]
+
+    response = test_client.get(
+        "/rates/history", params={"since": "2020-04-27T16:06:40"}
+    )
+    assert [h["timestamp"] for h in response.json()["history"]] == [
+        1588007200,
+        1588003600,
+    ]
+
+
+def test_get_positions(test_client: TestClient) -> None:
+    assert test_client.get("/positions").json() == {
+        "positions": [],
+        "valuation_ccy": None,
+        "timestamp": None,
+        "total_value": None,
+    }
+    _book_trades(test_client)
+    test_client.post(
+        "/trades/batch",
+        json={
+            "trades": [
+                {"sell_ccy": "GBP", "sell_amount": 1000, "buy_ccy": "BRL", "rate": 6.5}
+            ]
+        },
+    )
+
+    response = test_client.get("/positions")
+    assert response.status_code == 200
+    # See _book_trades for the booked amounts
+    assert response.json()["positions"] == [
+        {"ccy": "BRL", "bought": 6500, "sold": 906, "net": 5594, "value": None},
+        {"ccy": "GBP", "bought": 986, "sold": 1201, "net": -215, "value": None},
+        {"ccy": "USD", "bought": 1549, "sold": 403, "net": 1146, "value": None},
+    ]
+
+    response = test_client.get("/positions", params={"valuation_ccy": "USD"})
+    assert response.status_code == 200
+    body = response.json()
+    # Values are truncated towards zero: -215 GBP are worth -264.45 USD
+    values = [
+        floor(5594 * DummyRatesApi.sync_get_rate("BRL", "USD")),
+        -264,
+        1146,
+    ]
+    assert [p["value"] for p in body["positions"]] == values
+    assert body["total_value"] == sum(values)
+    assert body["valuation_ccy"] == "USD"
+
+    response = test_client.get("/positions", params={"valuation_ccy": "FOO"})
+    assert response.status_code == 400
+
+
+def test_get_positions_without_rate(test_client: TestClient) -> None:
+    # EUR has no rate in DummyRatesApi
+    trade = {"sell_ccy": "EUR", "sell_amount": 100, "buy_ccy": "USD", "rate": 1.1}
+    assert test_client.post("/trades", json=trade).status_code == 200
+
+    response = test_client.get("/positions", params={"valuation_ccy": "USD"})
+    assert response.status_code == 200
+    body = response.json()
+    assert [(p["ccy"], p["value"]) for p in body["positions"]] == [
+        ("EUR", None),
+        ("USD", 110),
+    ]
+    assert body["total_value"] == 110
+
+
+def test_post_trade_position_overflow(test_client: TestClient) -> None:
+    trade = {"sell_ccy": "BRL", "sell_amount": 2 ** 62, "buy_ccy": "USD", "rate": 1.0}
+    assert test_client.post("/trades", json=trade).status_code == 200
+    assert test_client.post("/trades", json=trade).status_code == 422
+    response = test_client.post("/trades/batch", json={"trades": [trade]})
+    assert response.status_code == 422
+
+    # Positions keep exact integers
+    positions = test_client.get("/positions").json()["positions"]
+    assert [(p["ccy"], p["bought"], p["sold"]) for p in positions] == [
+        ("BRL", 0, 2 ** 62),
+        ("USD", 2 ** 62, 0),
+    ]
+
+
+def test_feed(test_client: TestClient) -> None:
+    with test_client.websocket_connect("/feed") as websocket:
+        snapshot = DummyRatesApi.sync_get_snapshot()
+        assert websocket.receive_json() == {
+            "type": "rates",
+            "data": {
+                "base": snapshot.base,
+                "timestamp": snapshot.timestamp,
+                "rates": snapshot.rates,
+            },
+        }
+
+        response = test_client.post(
+            "/trades",
+            json={"sell_ccy": "BRL", "sell_amount": 100, "buy_ccy": "GBP", "rate": 1.5},
+        )
+        assert websocket.receive_json() == {"type": "trades", "data": [response.json()]}
+
+        response = test_client.post(
+            "/trades/batch",
+            json={
+                "trades": [
+                    {"sell_ccy": "BRL", "sell_amount": 1, "buy_ccy": "GBP", "rate": 1},
+                    {"sell_ccy": "BRL", "sell_amount": 1, "buy_ccy": "BRL", "rate": 1},
+                ]
+            },
+        )
+        assert websocket.receive_json() == {
+            "type": "trades",
+            "data": [response.json()["results"][0]["trade"]],
+        }
+
+
+
+def test_trades_archive(
+    test_client: TestClient, db: Session, tmp_path, monkeypatch
+) -> None:
+    monkeypatch.chdir(tmp_path)
+    assert test_client.get("/trades/archive").json() == {"months": []}
+    assert test_client.get("/trades/archive/2020-01").status_code == 404
+
+    trade = {"sell_ccy": "EUR", "sell_amount": 100, "buy_ccy": "USD", "rate": 1.1}
+    test_client.post("/trades", json=trade)
+    exported = test_client.get("/trades/export").text
+    month = exported.split('"timestamp":"', 1)[1][:7]
+    archive_trades(db, next_month(parse_month(month)))
+
+    assert test_client.get("/trades/archive").json() == {"months": [month]}
+    response = test_client.get(f"/trades/archive/{month}")
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.text == exported
+    assert test_client.get("/trades").json()["trades"] == []
+
+
+def test_metrics(test_client: TestClient) -> None:
+    test_client.get("/rate", params={"from_symbol": "GBP", "to_symbol": "USD"})
+    test_client.get("/not-a-route")
+    test_client.get("/trades")
+
+    response = test_client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/plain")
+    body = response.text
+    assert 'fx_http_requests_total{method="GET",route="/rate",status="200"}' in body
+    assert (
+        'fx_http_requests_total{method="GET",route="<unmatched>",status="404"}' in body
+    )
+    assert 'fx_http_request_duration_seconds_count{method="GET",route="/rate"}' in body
+    assert "# TYPE fx_http_requests_in_flight gauge" in body
+    assert "fx_db_query_duration_seconds_count " in body
+    assert "# TYPE fx_rates_cache_lookups_total counter" in body
+
+
+def test_profiles(test_client: TestClient, monkeypatch) -> None:
+    assert test_client.get("/admin/profiles").status_code == 404
+    monkeypatch.setattr(PROFILER, "token", "secret")
+    admin = {"X-Fx-Profile": "secret"}
+    assert test_client.get("/admin/profiles").status_code == 403
+    non_ascii = {"X-Fx-Profile": "café"}
+    assert test_client.get("/admin/profiles", headers=non_ascii).status_code == 403
+    assert test_client.get("/trades", headers=non_ascii).status_code == 200
+
+    assert "X-Fx-Profile-Id" not in test_client.get("/trades").headers
+    response = test_client.get("/trades", headers=admin)
+    assert response.status_code == 200
+    profile_id = int(response.headers["X-Fx-Profile-Id"])
+
+    profiles = test_client.get("/admin/profiles", headers=admin).json()["profiles"]
+    assert profiles[0]["id"] == profile_id
+    profile = test_client.get(f"/admin/profiles/{profile_id}", headers=admin).json()
+    assert (profile["method"], profile["path"], profile["status"]) == (
+        "GET",
+        "/trades",
+        200,
+    )
+    assert set(profile["phases"]) == {"db", "endpoint", "model", "response"}
+    assert profile["phases"]["endpoint"] <= profile["duration"]
+    assert profile["has_stats"]
+
+    response = test_client.get(f"/admin/profiles/{profile_id}/pstats", headers=admin)
+    assert any(func[2] == "get_trades" for func in marshal.loads(response.content))
+    response = test_client.get(f"/admin/profiles/{profile_id}/collapsed", headers=admin)
+    assert re.search(r"get_trades \(__init__\.py:\d+\).* \d+$", response.text, re.M)
+
+    assert test_client.get("/admin/profiles/0", headers=admin).status_code == 404
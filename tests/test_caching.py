@@ -0,0 +1,21 @@
+from fx.caching import VersionCounter, etag_matches
+
+
+def test_etag_matches() -> None:
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('W/"a"', '"a"')
+    assert etag_matches('"a"', 'W/"a"')
+    assert etag_matches('"b", "a"', '"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches(None, '"a"')
+    assert not etag_matches('"b"', '"a"')
+    assert not etag_matches('"ab"', '"a"')
+
+
+def test_version_counter() -> None:
+    counter = VersionCounter()
+    etag = counter.etag
+    assert counter.etag == etag
+    counter.bump()
+    assert counter.etag != etag
+    assert VersionCounter().etag != counter.etag
@@ -0,0 +1,87 @@
+import asyncio
+import json
+import sys
+import threading
+
+import pytest
+
+from fx.feed import FeedHub
+from fx.shared import LocalStore
+
+# fx.feed is shadowed by the /feed endpoint in the fx package
+FEED = sys.modules["fx.feed"]
+
+
+@pytest.mark.asyncio
+async def test_publish() -> None:
+    hub = FeedHub()
+    hub.publish("ignored", 0)
+    with hub.subscribe() as first, hub.subscribe() as second:
+        assert hub.subscribers == 2
+        hub.publish("trades", [{"id": "TR1"}])
+        for subscription in (first, second):
+            message = json.loads(await subscription.get())
+            assert message == {"type": "trades", "data": [{"id": "TR1"}]}
+    assert hub.subscribers == 0
+
+
+@pytest.mark.asyncio
+async def test_publish_from_other_thread() -> None:
+    hub = FeedHub()
+    with hub.subscribe() as subscription:
+        thread = threading.Thread(target=hub.publish, args=("rates", 1))
+        thread.start()
+        message = await asyncio.wait_for(subscription.get(), 1)
+        thread.join()
+    assert json.loads(message) == {"type": "rates", "data": 1}
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_is_dropped() -> None:
+    hub = FeedHub(max_pending=2)
+    with hub.subscribe() as slow, hub.subscribe() as fast:
+        for i in range(3):
+            hub.publish("rates", i)
+            assert json.loads(await fast.get())["data"] == i
+        assert slow.dropped
+        assert await slow.get() is None
+        assert hub.subscribers == 1
+        assert hub.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_relay_between_workers(monkeypatch) -> None:
+    monkeypatch.setattr(FEED, "RELAY_POLL_INTERVAL", 0.01)
+    store = LocalStore()
+    first, second = FeedHub(store=store), FeedHub(store=store)
+    # Published before anyone subscribed, never relayed
+    first.publish("trades", 0, all_workers=True)
+
+    with first.subscribe() as local, second.subscribe() as remote:
+        first.publish("trades", 1, all_workers=True)
+        first.publish("rates", 2)
+        assert json.loads(await local.get())["data"] == 1
+        assert json.loads(await local.get())["data"] == 2
+        message = await asyncio.wait_for(remote.get(), 1)
+        assert json.loads(message) == {"type": "trades", "data": 1}
+
+        # Events aren't relayed back to the worker which published them
+        second.publish("trades", 3, all_workers=True)
+        assert json.loads(await remote.get())["data"] == 3
+        assert json.loads(await asyncio.wait_for(local.get(), 1))["data"] == 3
+        await asyncio.sleep(0.05)
+        assert remote._queue.empty() and local._queue.empty()
+
+
+def test_relay_log_is_bounded(monkeypatch) -> None:
+    monkeypatch.setattr(FEED, "RELAY_MAX_EVENTS", 3)
+    store = LocalStore()
+    hub = FeedHub(store=store)
+    for i in range(5):
+        hub.publish("trades", i, all_workers=True)
+    lines = store.get("feed").splitlines()
+    assert [int(line.split(b" ")[0]) for line in lines] == [3, 4, 5]
+
+    monkeypatch.setattr(FEED, "RELAY_MAX_BYTES", 1)
+    hub.publish("trades", "x" * 100, all_workers=True)
+    assert len(store.get("feed").splitlines()) == 1
@@ -0,0 +1,40 @@
+import pytest
+from sqlalchemy.orm import Session
+
+from fx.database import RatesHistory
+from fx.history import RatesHistoryIngester, pack_snapshot, unpack_rates
+from fx.rates import RatesSnapshot
+from tests.fake_fixer import LATEST
+
+
+def _snapshot(timestamp: int) -> RatesSnapshot:
+    return RatesSnapshot.from_response({**LATEST, "timestamp": timestamp})
+
+
+def test_pack_roundtrip() -> None:
+    snapshot = _snapshot(1588000000)
+    row = pack_snapshot(snapshot)
+    assert (row.timestamp, row.base, row.symbols) == (1588000000, "EUR", "EUR,USD,GBP")
+    assert len(row.rates) == 8 * len(snapshot.rates)
+    assert unpack_rates(row) == snapshot.rates
+
+
+@pytest.mark.asyncio
+async def test_ingester(db: Session) -> None:
+    ingester = RatesHistoryIngester(lambda: db)
+    ingester.start()
+    try:
+        for timestamp in (1588000000, 1588003600, 1588000000):
+            ingester.record(_snapshot(timestamp))
+        await ingester.join()
+    finally:
+        await ingester.stop()
+
+    rows = db.query(RatesHistory).order_by(RatesHistory.timestamp).all()
+    assert [r.timestamp for r in rows] == [1588000000, 1588003600]
+    assert all(unpack_rates(r) == LATEST["rates"] for r in rows)
+
+
+def test_ingester_not_running(db: Session) -> None:
+    RatesHistoryIngester(lambda: db).record(_snapshot(1588000000))
+    assert db.query(RatesHistory).count() == 0
@@ -0,0 +1,85 @@
+import re
+import threading
+
+from fx.ids import RandomIdGenerator, UlidGenerator
+
+ULID_RE = re.compile(r"^TR[0-9A-HJKMNP-TV-Z]{26}$")
+
+
+class FakeClock:
+    def __init__(self, now: float) -> None:
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestUlidGenerator:
+    @staticmethod
+    def test_format():
+        ids = UlidGenerator()
+        assert all(ULID_RE.match(ids.new_id()) for _ in range(1000))
+
+    @staticmethod
+    def test_time_ordered():
+        clock = FakeClock(1588000000.0)
+        ids = UlidGenerator(clock)
+        first = ids.new_id()
+        clock.now += 0.001
+        second = ids.new_id()
+        # The timestamp is in the first 10 characters after the prefix
+        assert first[:12] < second[:12]
+
+        other = UlidGenerator(FakeClock(1588000000.0))
+        assert other.new_id()[:12] == first[:12]
+
+    @staticmethod
+    def test_monotonic_within_same_millisecond():
+        ids = UlidGenerator(FakeClock(1588000000.0))
+        generated = [ids.new_id() for _ in range(10000)]
+        assert generated == sorted(generated)
+        assert len(set(generated)) == len(generated)
+
+    @staticmethod
+    def test_monotonic_when_clock_goes_backwards():
+        clock = FakeClock(1588000000.0)
+        ids = UlidGenerator(clock)
+        first = ids.new_id()
+        clock.now -= 10
+        assert ids.new_id() > first
+
+    @staticmethod
+    def test_threads():
+        ids = UlidGenerator()
+        generated: list = []
+
+        def generate() -> None:
+            generated.extend(ids.new_id() for _ in range(1000))
+
+        threads = [threading.Thread(target=generate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(generated)) == 8000
+
+    @staticmethod
+    def test_fork_resets_sequence(monkeypatch):
+        random_bytes = iter([bytes(10), b"\xff" * 10])
+        monkeypatch.setattr("os.urandom", lambda _n: next(random_bytes))
+        ids = UlidGenerator(FakeClock(1588000000.0))
+        parent = ids.new_id()
+        assert parent.endswith("0" * 16)
+
+        monkeypatch.setattr("os.getpid", lambda: -1)
+        child = ids.new_id()
+        # The child draws new random bits instead of incrementing the parent's
+        assert child[:12] == parent[:12]
+        assert child[12:] == "F" + "Z" * 15
+
+
+class TestRandomIdGenerator:
+    @staticmethod
+    def test_format():
+        ids = RandomIdGenerator()
+        assert all(re.match(r"^TR[A-Z0-9]{7}$", ids.new_id()) for _ in range(1000))
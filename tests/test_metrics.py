@@ -0,0 +1,95 @@
+import json
+import os
+
+import pytest
+
+from fx.metrics import Counter, Gauge, Histogram, Registry
+
+
+def test_render() -> None:
+    registry = Registry()
+    counter = Counter("requests_total", "Requests.", ("route",), registry=registry)
+    gauge = Gauge("in_flight", "In flight.", registry=registry)
+    histogram = Histogram(
+        "latency_seconds", "Latency.", buckets=(0.1, 1.0), registry=registry
+    )
+    Counter(
+        "hits_total", "Hits.", function=lambda: {(): 3}, registry=registry,
+    )
+
+    counter.inc(("/a",))
+    counter.inc(("/a",), 2)
+    counter.inc(('say "hi"',))
+    gauge.inc()
+    gauge.inc()
+    gauge.dec()
+    for value in (0.05, 0.1, 0.5, 5):
+        histogram.observe(value)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{route="/a"} 3.0',
+        'requests_total{route="say \\"hi\\""} 1.0',
+        "# HELP in_flight In flight.",
+        "# TYPE in_flight gauge",
+        "in_flight 1.0",
+        "# HELP latency_seconds Latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 2.0',
+        'latency_seconds_bucket{le="1.0"} 3.0',
+        'latency_seconds_bucket{le="+Inf"} 4.0',
+        "latency_seconds_sum 5.65",
+        "latency_seconds_count 4.0",
+        "# HELP hits_total Hits.",
+        "# TYPE hits_total counter",
+        "hits_total 3.0",
+    ]
+
+
+def test_duplicate_name() -> None:
+    registry = Registry()
+    Counter("requests_total", "Requests.", registry=registry)
+    with pytest.raises(ValueError):
+        Gauge("requests_total", "Requests.", registry=registry)
+
+
+def test_multiprocess(tmp_path) -> None:
+    registry = Registry(str(tmp_path))
+    counter = Counter("requests_total", "Requests.", ("route",), registry=registry)
+    gauge = Gauge("in_flight", "In flight.", registry=registry)
+    histogram = Histogram(
+        "latency_seconds", "Latency.", buckets=(1.0,), registry=registry
+    )
+    counter.inc(("/a",))
+    gauge.set(2)
+    histogram.observe(0.5)
+
+    # A worker which has exited: its counters and histograms still count, its gauges don't
+    exited = [
+        ["requests_total", "counter", "Requests.", [["requests_total", [["route", "/a"]], 4]]],
+        ["in_flight", "gauge", "In flight.", [["in_flight", [], 5]]],
+        [
+            "latency_seconds",
+            "histogram",
+            "Latency.",
+            [
+                ["latency_seconds_bucket", [["le", "1.0"]], 0],
+                ["latency_seconds_bucket", [["le", "+Inf"]], 1],
+                ["latency_seconds_sum", [], 2.5],
+                ["latency_seconds_count", [], 1],
+            ],
+        ],
+    ]
+    # Pids are at most 2 ** 22 on Linux
+    (tmp_path / f"{2 ** 22 + 1}.json").write_text(json.dumps(exited))
+    (tmp_path / "unrelated.txt").write_text("")
+
+    lines = registry.render().splitlines()
+    assert (tmp_path / f"{os.getpid()}.json").exists()
+    assert 'requests_total{route="/a"} 5.0' in lines
+    assert "in_flight 2.0" in lines
+    assert 'latency_seconds_bucket{le="1.0"} 1.0' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 2.0' in lines
+    assert "latency_seconds_sum 3.0" in lines
+    assert "latency_seconds_count 2.0" in lines
@@ -6,7 +6,7 @@ from hypothesis import given
 from hypothesis import strategies as st
 from pydantic import ValidationError
 
-from fx.model import BaseModel, Currency
+from fx.model import BaseModel, Currency, CurrencyArray
 
 
 class TestCurrency:
@@ -104,3 +104,87 @@ class TestBaseModel:
         model = Model(c=Currency(i))
         serialized = json.loads(model.json())
         assert model == Model(**serialized)
+
+
+# Amounts and products around and beyond the 64 bits range are stored as Python integers
+AMOUNT = st.integers(min_value=0, max_value=10 ** 12) | st.integers(
+    min_value=2 ** 63 - 1000, max_value=2 ** 70
+)
+AMOUNTS = st.lists(AMOUNT, max_size=50)
+SCALARS = st.floats(min_value=0, max_value=1e12, allow_nan=False, allow_infinity=False)
+
+
+class TestCurrencyArray:
+    @staticmethod
+    @given(AMOUNTS)
+    def test_init_ok(values) -> None:
+        array = CurrencyArray(values)
+        assert array.tolist() == values
+        assert list(array) == [Currency(v) for v in values]
+
+    @staticmethod
+    @given(AMOUNTS, st.integers(min_value=-(2 ** 63), max_value=-1))
+    def test_init_negative(values, i: int) -> None:
+        with pytest.raises(ValueError):
+            CurrencyArray(values + [i])
+
+    @staticmethod
+    @given(AMOUNTS, SCALARS)
+    def test_multiplication_scalar(values, s: float) -> None:
+        expected = [(Currency(v) * s).value for v in values]
+        assert (CurrencyArray(values) * s).tolist() == expected
+        assert (s * CurrencyArray(values)).tolist() == expected
+
+    @staticmethod
+    @given(AMOUNTS, st.integers(min_value=0, max_value=2 ** 64))
+    def test_multiplication_integer(values, m: int) -> None:
+        expected = [(Currency(v) * m).value for v in values]
+        assert (CurrencyArray(values) * m).tolist() == expected
+
+    @staticmethod
+    @given(st.lists(st.tuples(AMOUNT, SCALARS)))
+    def test_multiplication_elementwise(pairs) -> None:
+        values = [v for v, _ in pairs]
+        rates = [r for _, r in pairs]
+        expected = [(Currency(v) * r).value for v, r in pairs]
+        assert (CurrencyArray(values) * rates).tolist() == expected
+
+    @staticmethod
+    def test_int64_overflow() -> None:
+        amounts = CurrencyArray([10 ** 17, 1])
+        assert (amounts * 1000.0).tolist() == [10 ** 20, 1000]
+        assert (amounts * [1000.0, 1.0]).tolist() == [10 ** 20, 1]
+        assert CurrencyArray([2 ** 63]) == CurrencyArray(iter([2 ** 63]))
+        assert (CurrencyArray([2 ** 63]) * 0.5) == CurrencyArray([2 ** 62])
+
+    @staticmethod
+    def test_multiplication_invalid() -> None:
+        with pytest.raises(ValueError):
+            CurrencyArray([1, 2]) * -1.0
+        with pytest.raises(ValueError):
+            CurrencyArray([1, 2]) * [1.0, -1.0]
+        with pytest.raises(ValueError):
+            CurrencyArray([1, 2]) * [1.0]
+
+    @staticmethod
+    @given(AMOUNTS)
+    def test_json_roundtrip(values) -> None:
+        class Model(BaseModel):
+            c: CurrencyArray
+
+        model = Model(c=values)
+        serialized = json.loads(model.json())
+        assert serialized == {"c": values}
+        assert model == Model(**serialized)
+
+    @staticmethod
+    @given(st.lists(st.floats() | st.text(), min_size=1))
+    def test_validation_wrong_type(x) -> None:
+        class Model(BaseModel):
+            c: CurrencyArray
+
+        with pytest.raises(ValidationError) as e:
+            Model(c=x)
+        assert e.value.errors() == [
+            {"loc": ("c",), "type": "type_error", "msg": "must be a list of integers"}
+        ]
@@ -0,0 +1,141 @@
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Iterator, List, Optional
+
+import pytest
+from sqlalchemy.orm import Session
+
+from fx.database import Trade
+from fx.partitions import (
+    UnpartitionedTrades,
+    archive_trades,
+    archived_legs,
+    archived_months,
+    create_partitions,
+    is_partitioned,
+    next_month,
+    parse_month,
+    partition_ddl,
+    read_archive,
+)
+from fx.positions import apply_trades, check_positions
+
+TRADES = [
+    ("TR1", datetime(2020, 1, 31, 23, 59), "EUR", 100, "USD", 1.1),
+    ("TR2", datetime(2020, 2, 1), "USD", 200, "GBP", 0.8),
+    ("TR3", datetime(2020, 4, 15), "GBP", 300, "EUR", 1.2),
+]
+
+
+def _trade(trade: tuple) -> Trade:
+    trade_id, timestamp, sell_ccy, sell_amount, buy_ccy, rate = trade
+    return Trade(
+        trade_id=trade_id,
+        sell_ccy=sell_ccy,
+        sell_amount=sell_amount,
+        buy_ccy=buy_ccy,
+        rate=rate,
+        timestamp=timestamp,
+    )
+
+
+def _insert_trades(db: Session) -> None:
+    db.add_all(_trade(t) for t in TRADES)
+    apply_trades(db, [t[2:] for t in TRADES])
+    db.commit()
+
+
+def test_months() -> None:
+    assert parse_month("2020-01") == datetime(2020, 1, 1)
+    assert next_month(datetime(2020, 1, 1)) == datetime(2020, 2, 1)
+    assert next_month(datetime(2020, 12, 1)) == datetime(2021, 1, 1)
+    for invalid in ("2020-13", "2020-1", "202001", "../2020-01"):
+        with pytest.raises(ValueError):
+            parse_month(invalid)
+
+
+def test_partition_ddl() -> None:
+    assert partition_ddl(datetime(2020, 12, 1)) == (
+        "CREATE TABLE IF NOT EXISTS trades_2020_12 PARTITION OF trades "
+        "FOR VALUES FROM ('2020-12-01') TO ('2021-01-01')"
+    )
+
+
+class _PostgresStub:
+    # Engine on a Postgres database whose trades table has the given pg_class.relkind
+    dialect = SimpleNamespace(name="postgresql")
+
+    def __init__(self, relkind: Optional[str]) -> None:
+        self.relkind = relkind
+        self.statements: List[str] = []
+
+    def execute(self, statement, *_args, **_kwargs) -> SimpleNamespace:
+        self.statements.append(str(statement))
+        return SimpleNamespace(scalar=lambda: self.relkind, first=lambda: None)
+
+    @contextmanager
+    def begin(self) -> Iterator["_PostgresStub"]:
+        yield self
+
+
+def test_create_partitions(db: Session) -> None:
+    # SQLite keeps a single table
+    assert not is_partitioned(db.get_bind())
+    assert create_partitions(db.get_bind()) == []
+
+    bind = _PostgresStub("p")
+    assert is_partitioned(bind)
+    names = create_partitions(bind, ahead=1, now=datetime(2020, 12, 15))
+    assert names == ["trades_2020_12", "trades_2021_01"]
+    assert partition_ddl(datetime(2021, 1, 1)) in bind.statements
+
+
+def test_create_partitions_unpartitioned() -> None:
+    # Trades table created before trades were partitioned
+    bind = _PostgresStub("r")
+    assert not is_partitioned(bind)
+    with pytest.raises(UnpartitionedTrades):
+        create_partitions(bind)
+    assert not any("PARTITION OF" in s for s in bind.statements)
+
+
+def test_archive_trades(db: Session, tmp_path) -> None:
+    directory = str(tmp_path)
+    _insert_trades(db)
+
+    assert archive_trades(db, datetime(2020, 4, 1), directory) == ["2020-01", "2020-02"]
+    assert archived_months(directory) == ["2020-01", "2020-02"]
+    assert [t.trade_id for t in db.query(Trade)] == ["TR3"]
+    assert list(read_archive("2020-01", directory)) == [
+        {
+            "id": "TR1",
+            "sell_ccy": "EUR",
+            "sell_amount": 100,
+            "buy_ccy": "USD",
+            "buy_amount": 110,
+            "rate": 1.1,
+            "timestamp": "2020-01-31T23:59:00",
+        }
+    ]
+    assert list(archived_legs(directory)) == [t[2:] for t in TRADES[:2]]
+
+
+def test_archive_is_idempotent(db: Session, tmp_path) -> None:
+    directory = str(tmp_path)
+    _insert_trades(db)
+    archive_trades(db, datetime(2020, 2, 1), directory)
+    # A trade which wasn't deleted by an interrupted run, and a new one
+    db.add_all([_trade(TRADES[0]), _trade(("TR4",) + TRADES[0][1:])])
+    db.commit()
+
+    assert archive_trades(db, datetime(2020, 2, 1), directory) == ["2020-01"]
+    assert [t["id"] for t in read_archive("2020-01", directory)] == ["TR1", "TR4"]
+    assert db.query(Trade).count() == 2
+
+
+def test_positions_include_archives(db: Session, tmp_path, monkeypatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    _insert_trades(db)
+    archive_trades(db, datetime(2020, 3, 1))
+    assert check_positions(db) == {}
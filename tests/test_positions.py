@@ -0,0 +1,94 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.orm import Session
+
+from fx.database import Position, Trade
+from fx.positions import (
+    MAX_AMOUNT,
+    PositionOverflow,
+    apply_trades,
+    check_positions,
+    main,
+    rebuild_positions,
+)
+
+TRADES = [
+    ("BRL", 100, "GBP", 1.0),
+    ("GBP", 201, "USD", 2.3),
+    ("BRL", 302, "USD", 3.6),
+]
+
+
+def _insert_trades(db: Session) -> None:
+    for i, (sell_ccy, sell_amount, buy_ccy, rate) in enumerate(TRADES):
+        db.add(
+            Trade(
+                trade_id=f"TR{i}",
+                sell_ccy=sell_ccy,
+                sell_amount=sell_amount,
+                buy_ccy=buy_ccy,
+                rate=rate,
+                timestamp=datetime(2020, 1, 1),
+            )
+        )
+
+
+def _positions(db: Session) -> dict:
+    return {p.ccy: (p.bought, p.sold) for p in db.query(Position)}
+
+
+def test_apply_trades(db: Session) -> None:
+    apply_trades(db, TRADES[:2])
+    apply_trades(db, TRADES[2:])
+    db.commit()
+    assert _positions(db) == {
+        "BRL": (0, 402),
+        "GBP": (100, 201),
+        "USD": (462 + 1087, 0),
+    }
+
+
+def test_apply_trades_overflow(db: Session) -> None:
+    apply_trades(db, [("EUR", 2 ** 62, "USD", 1.0)])
+    db.commit()
+    # Totals within a single call and summed with the stored ones are both checked
+    for trades in ([("EUR", 2 ** 62, "USD", 1.0)], [("GBP", 2 ** 62, "BRL", 1.0)] * 2):
+        with pytest.raises(PositionOverflow):
+            apply_trades(db, trades)
+        db.rollback()
+    assert _positions(db) == {"EUR": (0, 2 ** 62), "USD": (2 ** 62, 0)}
+
+    apply_trades(db, [("EUR", MAX_AMOUNT - 2 ** 62, "USD", 0.0)])
+    db.commit()
+    assert _positions(db) == {"EUR": (0, MAX_AMOUNT), "USD": (2 ** 62, 0)}
+
+
+def test_check_and_rebuild(db: Session) -> None:
+    _insert_trades(db)
+    apply_trades(db, TRADES)
+    db.commit()
+    assert check_positions(db) == {}
+
+    db.query(Position).filter(Position.ccy == "GBP").delete()
+    db.query(Position).filter(Position.ccy == "USD").update({"sold": 1})
+    db.commit()
+    assert check_positions(db) == {
+        "GBP": (None, (100, 201)),
+        "USD": ((1549, 1), (1549, 0)),
+    }
+
+    rebuild_positions(db)
+    assert check_positions(db) == {}
+    assert _positions(db) == {"BRL": (0, 402), "GBP": (100, 201), "USD": (1549, 0)}
+
+
+def test_main(db: Session, monkeypatch, capsys) -> None:
+    monkeypatch.setattr("fx.positions.SessionLocal", lambda: db)
+    _insert_trades(db)
+    db.commit()
+
+    assert main([]) == 1
+    assert "GBP" in capsys.readouterr().out
+    assert main(["--rebuild"]) == 0
+    assert main([]) == 0
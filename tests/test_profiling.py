@@ -0,0 +1,120 @@
+import asyncio
+import cProfile
+import pstats
+import time
+
+import pytest
+
+from fx.profiling import Profiler, collapse_stats, current_profile, phase
+
+
+def _scope(path: str = "/trades", headers=()) -> dict:
+    return {"type": "http", "method": "GET", "path": path, "headers": list(headers)}
+
+
+def test_phases_without_profile() -> None:
+    assert current_profile() is None
+    with phase("db"):
+        pass
+    assert current_profile() is None
+
+
+@pytest.mark.asyncio
+async def test_phases() -> None:
+    profiler = Profiler(token="secret")
+    with profiler.profile(_scope()) as profile:
+        assert current_profile() is profile
+        with phase("db"):
+            await asyncio.sleep(0.01)
+        # Tasks started by the request record phases in its profile
+        await asyncio.ensure_future(_upstream())
+        await asyncio.ensure_future(_upstream())
+    assert current_profile() is None
+    assert set(profile.phases) == {"db", "upstream"}
+    assert profile.phases["db"] >= 0.01
+    assert profile.phases["upstream"] >= 0.02
+    assert profile.duration >= 0.03
+    assert profile.stats is not None
+
+
+async def _upstream() -> None:
+    with phase("upstream"):
+        await asyncio.sleep(0.01)
+
+
+def test_should_profile(monkeypatch) -> None:
+    profiler = Profiler(token="secret", sample_rate=0)
+    assert profiler.should_profile(_scope(headers=[(b"x-fx-profile", b"secret")]))
+    assert not profiler.should_profile(_scope(headers=[(b"x-fx-profile", b"other")]))
+    assert not profiler.should_profile(_scope())
+    assert not profiler.should_profile(
+        _scope("/admin/profiles", headers=[(b"x-fx-profile", b"secret")])
+    )
+    # Non-ASCII values are compared as bytes
+    assert not profiler.should_profile(
+        _scope(headers=[(b"x-fx-profile", "café".encode())])
+    )
+    assert not profiler.is_admin("café\u20ac")
+    assert Profiler(token="café").should_profile(
+        _scope(headers=[(b"x-fx-profile", "café".encode())])
+    )
+
+    profiler = Profiler(token=None, sample_rate=0.5)
+    assert not profiler.is_admin("secret")
+    monkeypatch.setattr("random.random", lambda: 0.4)
+    assert profiler.should_profile(_scope())
+    monkeypatch.setattr("random.random", lambda: 0.6)
+    assert not profiler.should_profile(_scope())
+
+    assert not Profiler(token=None, sample_rate=0).enabled
+
+
+def test_ring_buffer() -> None:
+    profiler = Profiler(token="secret", buffer_size=3)
+    for _ in range(5):
+        with profiler.profile(_scope()):
+            pass
+    assert [p.profile_id for p in profiler.profiles()] == [5, 4, 3]
+    assert profiler.get(4) is not None
+    assert profiler.get(1) is None
+
+
+def test_single_cprofile() -> None:
+    profiler = Profiler(token="secret")
+    with profiler.profile(_scope()) as outer:
+        with profiler.profile(_scope()) as inner:
+            pass
+    assert outer.stats is not None
+    assert inner.stats is None
+    with pytest.raises(ValueError):
+        inner.collapsed()
+
+
+def _leaf() -> None:
+    time.sleep(0.002)
+
+
+def _branch() -> None:
+    _leaf()
+    _leaf()
+
+
+def _root() -> None:
+    _branch()
+    _leaf()
+
+
+def test_collapse_stats() -> None:
+    profiler = cProfile.Profile()
+    profiler.runcall(_root)
+    stacks = {}
+    for line in collapse_stats(pstats.Stats(profiler)).splitlines():
+        stack, micros = line.rsplit(" ", 1)
+        stacks[tuple(f.split(" ")[0] for f in stack.split(";"))] = int(micros)
+
+    sleeps = {stack: micros for stack, micros in stacks.items() if "sleep" in stack[-1]}
+    below_branch = [micros for stack, micros in sleeps.items() if "_branch" in stack]
+    below_root = [micros for stack, micros in sleeps.items() if "_branch" not in stack]
+    # Two thirds of the sleeping happened below _branch, a third right below _root
+    assert sum(below_branch) == pytest.approx(2 * sum(below_root), rel=0.3)
+    assert all(stack[-2] == "_leaf" for stack in sleeps)
@@ -0,0 +1,648 @@
+import asyncio
+import json
+from array import array
+from collections import Counter
+from typing import Any, Dict, List
+
+import aiohttp
+import pytest
+
+from fx.rates import (
+    ApiException,
+    CircuitBreaker,
+    CircuitOpen,
+    ClientException,
+    DummyRatesApi,
+    FixerApi,
+    HedgedRatesApi,
+    MirrorRatesApi,
+    ProviderLatency,
+    RateMatrix,
+    RatesApi,
+    RatesStore,
+    SharedRatesStore,
+)
+from fx.shared import FileStore, LeaderLock
+from tests.fake_fixer import LATEST, SYMBOLS, FakeFixer
+
+
+class StubFixerApi(FixerApi):
+    def __init__(self) -> None:
+        super().__init__("token")
+        self.calls: Counter = Counter()
+        self.responses: Dict[str, Any] = {
+            "latest": LATEST,
+            "symbols": SYMBOLS,
+        }
+
+    async def _get(self, endpoint: str) -> Dict[str, Any]:
+        self.calls[endpoint] += 1
+        response = self.responses[endpoint]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestRatesStore:
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_serves_from_memory_until_expired():
+        api, clock = StubFixerApi(), FakeClock()
+        store = RatesStore(api, ttl=60, refresh_ahead=10, clock=clock)
+
+        assert await store.get_rate("USD", "GBP") == 0.9 / 1.1
+        assert await store.get_symbols() == ["EUR", "USD", "GBP"]
+        clock.now = 59.0
+        assert await store.get_rate("GBP", "USD") == 1.1 / 0.9
+        assert api.calls == {"latest": 1, "symbols": 1}
+        assert (store.stats.hits, store.stats.misses) == (2, 1)
+
+        clock.now = 60.0
+        await store.get_rate("USD", "GBP")
+        assert api.calls == {"latest": 2, "symbols": 2}
+        assert (store.stats.hits, store.stats.misses) == (2, 2)
+        assert store.stats.refreshes == 2
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_max_age():
+        clock = FakeClock()
+        store = RatesStore(StubFixerApi(), ttl=60, refresh_ahead=10, clock=clock)
+        assert store.max_age() == 0
+        await store.get_snapshot()
+        assert store.max_age() == 60
+        clock.now = 45.5
+        assert store.max_age() == 14
+        clock.now = 61.0
+        assert store.max_age() == 0
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_serves_stale_rates_on_errors():
+        api, clock = StubFixerApi(), FakeClock()
+        store = RatesStore(api, ttl=60, refresh_ahead=10, clock=clock)
+        snapshot = await store.get_snapshot()
+        assert (store.age(), store.is_stale()) == (0, False)
+
+        api.responses["latest"] = ApiException("fixer.io is down")
+        clock.now = 90.0
+        assert await store.get_snapshot() is snapshot
+        assert (store.age(), store.is_stale(), store.max_age()) == (90, True, 0)
+        assert store.stats.stale == 1
+
+        api.responses["latest"] = LATEST
+        await store.get_snapshot()
+        assert (store.age(), store.is_stale()) == (0, False)
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_errors_without_rates():
+        api = StubFixerApi()
+        api.responses["latest"] = ApiException("fixer.io is down")
+        with pytest.raises(ApiException):
+            await RatesStore(api).get_snapshot()
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_listeners():
+        api = StubFixerApi()
+        store = RatesStore(api)
+        snapshots: list = []
+        store.add_listener(snapshots.append)
+
+        await store.refresh()
+        await store.refresh()
+        api.responses["latest"] = {**LATEST, "timestamp": LATEST["timestamp"] + 3600}
+        await store.refresh()
+        assert [s.timestamp for s in snapshots] == [
+            LATEST["timestamp"],
+            LATEST["timestamp"] + 3600,
+        ]
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_invalid_symbols():
+        store = RatesStore(StubFixerApi())
+        with pytest.raises(ClientException):
+            await store.get_rate("USD", "FOO")
+        with pytest.raises(ClientException):
+            await store.get_rate("FOO", "USD")
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_single_flight():
+        provider = StubProvider(delay=0.01)
+        store = RatesStore(provider)
+        snapshots = await asyncio.gather(*(store.get_snapshot() for _ in range(10)))
+        assert all(s is snapshots[0] for s in snapshots)
+        assert provider.calls == 1
+        assert (store.stats.misses, store.stats.refreshes) == (10, 1)
+
+        # A caller being cancelled doesn't fail the others
+        waiters = [asyncio.ensure_future(store.refresh()) for _ in range(2)]
+        await asyncio.sleep(0)
+        waiters[0].cancel()
+        await waiters[1]
+        assert (provider.calls, store.stats.refreshes) == (2, 2)
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_failed_refresh_cancels_symbols():
+        class SlowSymbols(StubProvider):
+            symbols_cancelled = False
+
+            async def get_symbols(self):
+                try:
+                    await asyncio.sleep(1)
+                except asyncio.CancelledError:
+                    self.symbols_cancelled = True
+                    raise
+                return await super().get_symbols()
+
+        provider = SlowSymbols(delay=0, error=True)
+        with pytest.raises(ApiException):
+            await RatesStore(provider).get_snapshot()
+        await asyncio.sleep(0)
+        assert provider.symbols_cancelled
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_background_refresh():
+        api = StubFixerApi()
+        store = RatesStore(api, ttl=0.5, refresh_ahead=0.45)
+        store.start()
+        try:
+            await asyncio.sleep(0.12)
+        finally:
+            await store.stop()
+        assert store.stats.refreshes >= 2
+        assert store.stats.misses == 0
+
+        await store.get_rate("USD", "GBP")
+        assert store.stats.hits == 1
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_background_refresh_errors():
+        api = StubFixerApi()
+        del api.responses["latest"]
+        store = RatesStore(api, ttl=60, refresh_ahead=10)
+        store.RETRY_DELAY = 0.01
+        store.start()
+        try:
+            await asyncio.sleep(0.05)
+        finally:
+            await store.stop()
+        assert store.stats.refreshes == 0
+        assert store.stats.errors >= 2
+
+
+class TestSharedRatesStore:
+    @staticmethod
+    def make_store(tmp_path, clock) -> SharedRatesStore:
+        return SharedRatesStore(
+            StubFixerApi(),
+            FileStore(str(tmp_path)),
+            LeaderLock(str(tmp_path / "leader.lock")),
+            ttl=60,
+            refresh_ahead=10,
+            clock=clock,
+        )
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_only_leader_fetches(tmp_path):
+        clock = FakeClock()
+        leader = TestSharedRatesStore.make_store(tmp_path, clock)
+        follower = TestSharedRatesStore.make_store(tmp_path, clock)
+        leader_snapshots: list = []
+        follower_snapshots: list = []
+        leader_only: list = []
+        leader.add_listener(leader_snapshots.append)
+        leader.add_listener(leader_only.append, all_workers=False)
+        follower.add_listener(follower_snapshots.append)
+        follower.add_listener(leader_only.append, all_workers=False)
+
+        await leader.refresh()
+        await follower.refresh()
+        assert (leader.is_leader, follower.is_leader) == (True, False)
+        assert await follower.get_rate("USD", "GBP") == 0.9 / 1.1
+        assert await follower.get_symbols() == ["EUR", "USD", "GBP"]
+        assert follower.max_age() == 60
+        # pylint: disable=protected-access
+        assert not follower._api.calls
+
+        leader._api.responses["latest"] = {
+            **LATEST,
+            "timestamp": LATEST["timestamp"] + 3600,
+        }
+        clock.now = 55.0
+        await leader.refresh()
+        snapshot = await follower.get_snapshot()
+        assert snapshot.timestamp == LATEST["timestamp"] + 3600
+        assert await follower.get_snapshot() is snapshot
+        assert [s.timestamp for s in follower_snapshots] == [
+            s.timestamp for s in leader_snapshots
+        ]
+        assert len(leader_only) == 2
+        assert not follower._api.calls
+
+        # Expired rates are served until a new leader takes over
+        clock.now = 200.0
+        assert follower.is_stale()
+        assert await follower.get_snapshot() is snapshot
+        await leader.stop()
+        await follower.refresh()
+        assert follower.is_leader
+        assert not follower.is_stale()
+        assert follower._api.calls == {"latest": 1, "symbols": 1}
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_follower_waits_for_leader(tmp_path):
+        clock = FakeClock()
+        leader = TestSharedRatesStore.make_store(tmp_path, clock)
+        follower = TestSharedRatesStore.make_store(tmp_path, clock)
+        assert leader._leader.acquire()  # pylint: disable=protected-access
+
+        async def publish() -> None:
+            await asyncio.sleep(0.1)
+            await leader.refresh()
+
+        snapshot, _ = await asyncio.gather(follower.get_snapshot(), publish())
+        assert snapshot.timestamp == LATEST["timestamp"]
+
+
+class TestRateMatrix:
+    @staticmethod
+    def test_from_base_rates():
+        matrix = RateMatrix.from_base_rates(LATEST["rates"])
+        assert matrix.symbols == ["EUR", "USD", "GBP"]
+        for a, rate_a in LATEST["rates"].items():
+            for b, rate_b in LATEST["rates"].items():
+                assert matrix.get_rate(a, b) == rate_b / rate_a
+
+    @staticmethod
+    def test_rows():
+        matrix = RateMatrix(["A", "B", "C"], array("d", range(9)))
+        assert matrix.rows() == [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
+        assert matrix.rows(["C", "A"]) == [[8, 6], [2, 0]]
+        with pytest.raises(ClientException):
+            matrix.rows(["A", "D"])
+
+    @staticmethod
+    def test_invalid_symbols():
+        matrix = RateMatrix.from_base_rates(LATEST["rates"])
+        with pytest.raises(ClientException):
+            matrix.get_rate("USD", "FOO")
+        with pytest.raises(ClientException):
+            matrix.get_rate("FOO", "USD")
+
+    @staticmethod
+    def test_size_mismatch():
+        with pytest.raises(ValueError):
+            RateMatrix(["A", "B"], array("d", range(3)))
+
+
+class TestCircuitBreaker:
+    @staticmethod
+    def test_opens_after_threshold():
+        clock = FakeClock()
+        breaker = CircuitBreaker(threshold=3, reset_timeout=10, clock=clock)
+        for _ in range(2):
+            breaker.record_failure()
+            assert breaker.allow()
+        breaker.record_success()
+        for _ in range(3):
+            assert breaker.allow()
+            breaker.record_failure()
+        assert breaker.is_open
+        assert not breaker.allow()
+
+    @staticmethod
+    def test_trial_calls():
+        clock = FakeClock()
+        breaker = CircuitBreaker(threshold=1, reset_timeout=10, clock=clock)
+        breaker.record_failure()
+        clock.now = 10.0
+        # A single trial call is let through
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record_failure()
+        assert not breaker.allow()
+
+        clock.now = 20.0
+        assert breaker.allow()
+        breaker.record_success()
+        assert not breaker.is_open
+        assert breaker.allow()
+
+
+class TestFixerApi:
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_are_coalesced():
+        async with FakeFixer(delay=0.05) as fixer, aiohttp.ClientSession() as session:
+            api = FixerApi("token", base_url=fixer.url, session=session)
+            rates = await asyncio.gather(
+                *(api.get_rate("USD", "GBP") for _ in range(500))
+            )
+            assert rates == [0.9 / 1.1] * 500
+            assert fixer.hits == {"latest": 1}
+
+            # Once the shared request finishes, the next call goes upstream again and is
+            # revalidated with the cached ETag
+            assert await api.get_rate("USD", "GBP") == 0.9 / 1.1
+            assert fixer.hits == {"latest": 2}
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_errors():
+        async with FakeFixer(delay=0.05) as fixer, aiohttp.ClientSession() as session:
+            fixer.responses["latest"] = {
+                "success": False,
+                "error": {"code": 101, "type": "invalid_access_key"},
+            }
+            api = FixerApi("token", base_url=fixer.url, session=session)
+            results = await asyncio.gather(
+                *(api.get_rate("USD", "GBP") for _ in range(100)),
+                return_exceptions=True,
+            )
+            assert all(isinstance(r, ApiException) for r in results)
+            assert fixer.hits == {"latest": 1}
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_coalescing_per_endpoint():
+        async with FakeFixer(delay=0.05) as fixer, aiohttp.ClientSession() as session:
+            api = FixerApi("token", base_url=fixer.url, session=session)
+            await asyncio.gather(
+                *(api.get_rate("USD", "GBP") for _ in range(50)),
+                *(api.get_symbols() for _ in range(50)),
+            )
+            assert fixer.hits == {"latest": 1, "symbols": 1}
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_snapshot_reused_when_not_modified():
+        async with FakeFixer() as fixer, aiohttp.ClientSession() as session:
+            api = FixerApi("token", base_url=fixer.url, session=session)
+            first = await api.get_snapshot()
+            assert await api.get_snapshot() is first
+            assert fixer.hits == {"latest": 2}
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_retries_errors():
+        async with FakeFixer(failures=2) as fixer, aiohttp.ClientSession() as session:
+            api = FixerApi("token", base_url=fixer.url, session=session, retries=2)
+            api.RETRY_BACKOFF = 0.001
+            assert await api.get_rate("USD", "GBP") == 0.9 / 1.1
+            assert fixer.hits == {"latest": 3}
+            assert api.breaker.failures == 0
+
+            fixer.failures = 3
+            with pytest.raises(ApiException):
+                await api.get_rate("USD", "GBP")
+            assert fixer.hits == {"latest": 6}
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_timeouts():
+        async with FakeFixer(delay=1.0) as fixer, aiohttp.ClientSession() as session:
+            api = FixerApi(
+                "token",
+                base_url=fixer.url,
+                session=session,
+                timeout=aiohttp.ClientTimeout(sock_read=0.05),
+                retries=1,
+            )
+            api.RETRY_BACKOFF = 0.001
+            start = asyncio.get_event_loop().time()
+            with pytest.raises(ApiException):
+                await api.get_rate("USD", "GBP")
+            assert asyncio.get_event_loop().time() - start < 0.5
+            assert fixer.hits == {"latest": 2}
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_circuit_breaker():
+        async with FakeFixer(failures=2) as fixer, aiohttp.ClientSession() as session:
+            breaker = CircuitBreaker(threshold=2, reset_timeout=0.1)
+            api = FixerApi(
+                "token", base_url=fixer.url, session=session, retries=5, breaker=breaker
+            )
+            api.RETRY_BACKOFF = 0.001
+            with pytest.raises(CircuitOpen):
+                await api.get_rate("USD", "GBP")
+            with pytest.raises(CircuitOpen):
+                await api.get_rate("USD", "GBP")
+            assert fixer.hits == {"latest": 2}
+
+            await asyncio.sleep(0.1)
+            assert await api.get_rate("USD", "GBP") == 0.9 / 1.1
+            assert not breaker.is_open
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_session_lifecycle(monkeypatch):
+        monkeypatch.setattr("fx.rates.FIXER_POOL_SIZE", 1)
+        async with FakeFixer(delay=0.05) as fixer:
+            api = FixerApi("token", base_url=fixer.url)
+            with pytest.raises(RuntimeError):
+                await api.get_symbols()
+
+            async with api:
+                await asyncio.gather(api.get_snapshot(), api.get_symbols())
+                await api.get_symbols()
+                stats = api.pool_stats
+                assert (stats.limit, stats.in_flight, stats.max_in_flight) == (1, 0, 2)
+                # Both endpoints were requested at once, but there's a single connection
+                assert stats.waits == 1
+                assert stats.wait_seconds > 0
+                assert (stats.connections_created, stats.connections_reused) == (1, 2)
+
+            with pytest.raises(RuntimeError):
+                await api.get_symbols()
+
+
+
+class TestMirrorRatesApi:
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_file(tmp_path):
+        path = tmp_path / "latest.json"
+        path.write_text(json.dumps(LATEST))
+        api = MirrorRatesApi(str(path))
+        assert await api.get_rate("USD", "GBP") == 0.9 / 1.1
+        assert await api.get_symbols() == ["EUR", "USD", "GBP"]
+        first = await api.get_snapshot()
+        assert await api.get_snapshot() is first
+
+        path.write_text(json.dumps({**LATEST, "timestamp": LATEST["timestamp"] + 60}))
+        assert (await api.get_snapshot()).timestamp == LATEST["timestamp"] + 60
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_url():
+        async with FakeFixer() as fixer:
+            api = MirrorRatesApi(f"{fixer.url}latest")
+            with pytest.raises(RuntimeError):
+                await api.get_snapshot()
+            await api.open()
+            try:
+                assert await api.get_rate("USD", "GBP") == 0.9 / 1.1
+            finally:
+                await api.close()
+            assert fixer.hits == {"latest": 1}
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_errors(tmp_path):
+        with pytest.raises(ApiException):
+            await MirrorRatesApi(str(tmp_path / "missing.json")).get_snapshot()
+        path = tmp_path / "latest.json"
+        for content in ("{", json.dumps({"success": False}), json.dumps({"base": 1})):
+            path.write_text(content)
+            with pytest.raises(ApiException):
+                await MirrorRatesApi(str(path)).get_snapshot()
+
+
+class StubProvider(DummyRatesApi):
+    def __init__(self, delay: float, error: bool = False) -> None:
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+
+    async def get_snapshot(self):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise ApiException("Stub error")
+        return await super().get_snapshot()
+
+
+def test_provider_latency():
+    latency = ProviderLatency(window=10)
+    assert latency.percentile(50) is None
+    for i in range(1, 21):
+        latency.record(i)
+    assert len(latency) == 10
+    assert latency.percentile(50) == 15
+    assert latency.percentile(95) == 20
+    assert latency.percentile(0) == 11
+
+
+class TestHedgedRatesApi:
+    @staticmethod
+    def _hedged(providers: Dict[str, RatesApi], **kwargs) -> HedgedRatesApi:
+        return HedgedRatesApi(providers, hedge_percentile=95, **kwargs)
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_fast_primary_isnt_hedged():
+        primary, backup = StubProvider(0.0), StubProvider(0.0)
+        api = TestHedgedRatesApi._hedged(
+            {"primary": primary, "backup": backup}, initial_delay=1.0
+        )
+        assert await api.get_rate("GBP", "USD") == DummyRatesApi.sync_get_rate(
+            "GBP", "USD"
+        )
+        assert (primary.calls, backup.calls, api.hedged) == (1, 0, 0)
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_slow_primary_is_hedged():
+        primary, backup = StubProvider(1.0), StubProvider(0.0)
+        api = TestHedgedRatesApi._hedged(
+            {"primary": primary, "backup": backup}, initial_delay=0.05
+        )
+        start = asyncio.get_event_loop().time()
+        await api.get_snapshot()
+        assert asyncio.get_event_loop().time() - start < 0.5
+        assert (primary.calls, backup.calls, api.hedged) == (1, 1, 1)
+        await asyncio.sleep(0)
+        assert primary.cancelled == 1
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_failures_fall_through():
+        failing, slow = StubProvider(0.0, error=True), StubProvider(0.05)
+        api = TestHedgedRatesApi._hedged(
+            {"failing": failing, "slow": slow, "unused": StubProvider(0.0)},
+            initial_delay=1.0,
+        )
+        await api.get_snapshot()
+        assert (failing.calls, slow.calls, api.hedged) == (1, 1, 0)
+        # Failing providers go last
+        assert api.ranking() == ["slow", "failing", "unused"]
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_all_failing():
+        api = TestHedgedRatesApi._hedged(
+            {"a": StubProvider(0.0, error=True), "b": StubProvider(0.01, error=True)},
+            initial_delay=0.001,
+        )
+        with pytest.raises(ApiException, match="All rates providers failed"):
+            await api.get_snapshot()
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_reorders_providers():
+        slow, fast = StubProvider(0.2), StubProvider(0.0)
+        api = TestHedgedRatesApi._hedged({"slow": slow, "fast": fast}, initial_delay=0.01)
+        await api.get_snapshot()
+        assert api.hedged == 1
+        assert api.ranking() == ["fast", "slow"]
+        await api.get_snapshot()
+        assert (slow.calls, fast.calls, api.hedged) == (1, 2, 1)
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_hedge_delay_follows_latency():
+        primary, backup = StubProvider(0.05), StubProvider(0.0)
+        api = TestHedgedRatesApi._hedged(
+            {"primary": primary, "backup": backup}, initial_delay=0.001, min_samples=2
+        )
+        api.latencies["primary"].record(0.5)
+        api.latencies["primary"].record(0.5)
+        await api.get_snapshot()
+        assert (primary.calls, backup.calls, api.hedged) == (1, 0, 0)
+
+    @staticmethod
+    @pytest.mark.asyncio
+    async def test_fixer_servers():
+        async with FakeFixer(delay=0.3) as slow, FakeFixer() as mirror:
+            async with aiohttp.ClientSession() as session:
+                fixer = FixerApi("token", base_url=slow.url, session=session)
+                api = TestHedgedRatesApi._hedged(
+                    {"fixer": fixer, "mirror": MirrorRatesApi(f"{mirror.url}latest")},
+                    initial_delay=0.05,
+                )
+                await api.open()
+                try:
+                    symbols: List[str] = await api.get_symbols()
+                    assert symbols == ["EUR", "USD", "GBP"]
+                    assert await api.get_rate("USD", "GBP") == 0.9 / 1.1
+                finally:
+                    await api.close()
+                # The mirror answered the hedged request first and became the primary
+                assert api.hedged == 1
+                assert api.ranking() == ["mirror", "fixer"]
+                assert (slow.hits, mirror.hits) == ({"symbols": 1}, {"latest": 2})
+                # Let the abandoned fixer.io request finish before its session closes
+                await asyncio.sleep(0.3)
@@ -0,0 +1,51 @@
+import os
+
+from fx.caching import VersionCounter
+from fx.shared import FileStore, LeaderLock, LocalStore
+
+
+def test_local_store() -> None:
+    store = LocalStore()
+    assert store.get("key") is None
+    store.set("key", b"a")
+    assert store.get("key") == b"a"
+    assert store.update("key", lambda value: value + b"b") == b"ab"
+
+
+def test_file_store(tmp_path) -> None:
+    store, other = FileStore(str(tmp_path)), FileStore(str(tmp_path))
+    assert store.get("key") is None
+    store.set("key", b"a")
+    value = other.get("key")
+    assert value == b"a"
+    # Unchanged values are read once
+    assert other.get("key") is value
+
+    assert other.update("key", lambda value: value + b"b") == b"ab"
+    assert store.get("key") == b"ab"
+    assert other.update("new", lambda value: value or b"c") == b"c"
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_shared_version_counter(tmp_path) -> None:
+    first = VersionCounter(FileStore(str(tmp_path)), "version")
+    second = VersionCounter(FileStore(str(tmp_path)), "version")
+    assert first.etag == second.etag
+    first.bump()
+    second.bump()
+    assert first.version == second.version == 2
+    assert first.etag == second.etag
+
+
+def test_leader_lock(tmp_path) -> None:
+    path = str(tmp_path / "leader.lock")
+    first, second = LeaderLock(path), LeaderLock(path)
+    assert first.acquire()
+    assert first.acquire()
+    assert not second.acquire()
+    assert (first.is_leader, second.is_leader) == (True, False)
+
+    first.release()
+    assert second.acquire()
+    assert not first.acquire()
+    second.release()
@@ -0,0 +1,33 @@
+import asyncio
+from typing import List
+
+import pytest
+
+from fx.tasks import BackgroundTask
+
+
+@pytest.mark.asyncio
+async def test_background_task() -> None:
+    calls: List[str] = []
+
+    async def run(name: str) -> None:
+        calls.append(name)
+        await asyncio.sleep(3600)
+
+    task = BackgroundTask()
+    assert not task.running
+    assert not await task.stop()
+
+    assert task.start(run, "first")
+    # Only one task runs at a time
+    assert not task.start(run, "second")
+    await asyncio.sleep(0)
+    assert task.running
+    assert calls == ["first"]
+
+    assert await task.stop()
+    assert not task.running
+    assert task.start(run, "third")
+    await asyncio.sleep(0)
+    assert await task.stop()
+    assert calls == ["first", "third"]
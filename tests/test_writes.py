@@ -0,0 +1,92 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from fx.database import Position, Trade
+from fx.writes import TradeWriter
+
+
+def _row(i: int) -> dict:
+    return {
+        "trade_id": f"TR{i:07d}",
+        "sell_ccy": "EUR",
+        "sell_amount": 100,
+        "buy_ccy": "USD",
+        "rate": 1.5,
+        "timestamp": datetime(2020, 1, 1),
+    }
+
+
+@pytest.mark.asyncio
+async def test_group_commit(db: Session) -> None:
+    writer = TradeWriter(window=0.01, max_size=30, session_factory=lambda: db)
+    writer.start()
+    try:
+        await asyncio.gather(*(writer.book(db, _row(i)) for i in range(100)))
+    finally:
+        await writer.stop()
+
+    assert db.query(Trade).count() == 100
+    assert (writer.trades, writer.groups) == (100, 4)
+    positions = {p.ccy: (p.bought, p.sold) for p in db.query(Position)}
+    assert positions == {"EUR": (0, 10_000), "USD": (15_000, 0)}
+
+
+@pytest.mark.asyncio
+async def test_failing_trade_doesnt_fail_group(db: Session) -> None:
+    writer = TradeWriter(window=0.01, session_factory=lambda: db)
+    writer.start()
+    try:
+        await writer.book(db, _row(0))
+        results = await asyncio.gather(
+            *(writer.book(db, _row(i)) for i in range(3)), return_exceptions=True
+        )
+    finally:
+        await writer.stop()
+
+    assert isinstance(results[0], IntegrityError)
+    assert results[1:] == [None, None]
+    assert db.query(Trade).count() == 3
+    assert db.query(Position).get("EUR").sold == 300
+
+
+@pytest.mark.asyncio
+async def test_stop_commits_queued_trades(db: Session) -> None:
+    writer = TradeWriter(window=0.1, session_factory=lambda: db)
+    writer.start()
+    booking = asyncio.ensure_future(writer.book(db, _row(0)))
+    await asyncio.sleep(0)
+    await writer.stop()
+    assert booking.done()
+    assert db.query(Trade).count() == 1
+
+
+@pytest.mark.asyncio
+async def test_not_running(db: Session) -> None:
+    writer = TradeWriter()
+    await writer.book(db, _row(0))
+    assert db.query(Trade).count() == 1
+    assert writer.groups == 0
+
+
+@pytest.mark.asyncio
+async def test_groups_use_own_session(db: Session) -> None:
+    sessions = []
+
+    def session_factory() -> Session:
+        sessions.append(db)
+        return db
+
+    writer = TradeWriter(window=0.01, session_factory=session_factory)
+    writer.start()
+    try:
+        # Sessions of the requests aren't used by the writer
+        await asyncio.gather(*(writer.book(None, _row(i)) for i in range(3)))
+    finally:
+        await writer.stop()
+
+    assert len(sessions) == writer.groups == 1
+    assert db.query(Trade).count() == 3
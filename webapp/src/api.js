@@ -1,8 +1,11 @@
 export default {
-  get_trades: async function() {
-    const resp = await fetch('/api/trades');
-    const {trades} = await resp.json();
-    return trades;
+  get_trades: async function(cursor) {
+    let url = '/api/trades';
+    if (cursor) {
+      url += '?cursor=' + encodeURIComponent(cursor);
+    }
+    const resp = await fetch(url);
+    return await resp.json();
   },
 
   create_trade: async function(trade) {
@@ -20,6 +23,12 @@ export default {
     return symbols;
   },
 
+  get_rates: async function(base) {
+    const resp = await fetch('/api/rates?base=' + base);
+    const {rates} = await resp.json();
+    return rates;
+  },
+
   get_rate: async function(from, to) {
     const resp = await fetch(
       '/api/rate?from_symbol=' + from + "&to_symbol=" + to
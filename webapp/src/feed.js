@@ -0,0 +1,56 @@
+import { writable } from 'svelte/store';
+
+// Latest rates snapshot pushed by the backend, null until the feed is connected
+export const snapshot = writable(null);
+// Whether the feed is connected, trades booked while it's not aren't pushed
+export const connected = writable(false);
+
+const trade_listeners = new Set();
+
+// Calls `listener` with each list of booked trades. Returns a function removing the listener.
+export function on_trades(listener) {
+  trade_listeners.add(listener);
+  return () => trade_listeners.delete(listener);
+}
+
+// Rates from `base` to every symbol of `snapshot`, computed like the backend does.
+export function rates_from(snapshot, base) {
+  if (!(base in snapshot.rates)) {
+    throw new Error('Unknown symbol ' + base);
+  }
+  const rates = {};
+  for (const symbol in snapshot.rates) {
+    rates[symbol] = snapshot.rates[symbol] / snapshot.rates[base];
+  }
+  return rates;
+}
+
+// Connects to /api/feed, reconnecting with exponential backoff when the connection drops.
+export function connect() {
+  const scheme = location.protocol === 'https:' ? 'wss:' : 'ws:';
+  let delay = 1000;
+
+  function open() {
+    const socket = new WebSocket(scheme + '//' + location.host + '/api/feed');
+    socket.onopen = () => {
+      delay = 1000;
+      connected.set(true);
+    };
+    socket.onmessage = (event) => {
+      const {type, data} = JSON.parse(event.data);
+      if (type === 'rates') {
+        snapshot.set(data);
+      } else if (type === 'trades') {
+        trade_listeners.forEach((listener) => listener(data));
+      }
+    };
+    socket.onclose = () => {
+      connected.set(false);
+      snapshot.set(null);
+      setTimeout(open, delay);
+      delay = Math.min(delay * 2, 30000);
+    };
+  }
+
+  open();
+}